@@ -0,0 +1,464 @@
+"""
+Incremental analysis of 8085 source files, served to editors as a language server
+(JSON-RPC 2.0 over stdio, framed with Content-Length headers like LSP).
+
+Lines are parsed once and cached by their text, an edit re-parses only the lines it
+touches. Label definitions and references are counted as the lines change, the
+diagnostics (unknown mnemonics, bad operands, undefined or duplicate labels) then
+come from the parsed lines without reading the file again.
+
+python analyzer.py
+"""
+import re
+import sys
+import json
+import traceback
+from collections import Counter
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Tuple
+
+from data import COMMANDS
+from converter import (
+    is_label,
+    is_repl_command,
+    operand_kind,
+    process_comments,
+    process_hex,
+)
+
+TOKEN = re.compile(r"[^ ]+")
+# Parsed lines kept, the cache starts over when it grows past this
+CACHE_SIZE = 1 << 16
+# LSP DiagnosticSeverity
+ERROR = 1
+
+# A range of columns on a line
+Span = Tuple[int, int]
+
+
+class Problem(NamedTuple):
+    start: int
+    end: int
+    message: str
+
+
+class Line:
+    """
+    What one source line defines, references and gets wrong.
+    Lines with the same text share one (cached) Line.
+    """
+
+    __slots__ = ("label", "label_span", "references", "problems", "is_valid")
+
+    def __init__(self):
+        self.label: str = ""
+        self.label_span: Span = (0, 0)
+        # (label, start, end) of the jump targets
+        self.references: Tuple[Tuple[str, int, int], ...] = ()
+        self.problems: Tuple[Problem, ...] = ()
+        # Only valid commands are added to the program (and their label registered)
+        self.is_valid: bool = False
+
+
+def tokenize(text: str) -> List[Tuple[str, int]]:
+    """
+    Tokens of a line and the column they start at, split like cmd_preprocessor does
+    """
+    tokens = []
+    for match in TOKEN.finditer(text.replace(",", " ")):
+        token = match.group()
+        stripped = token.strip()
+        if stripped:
+            tokens.append((stripped, match.start() + token.index(stripped)))
+    # Comments only ever cut the token list short (or the token with the ';')
+    kept = process_comments(tuple(token for token, _ in tokens))
+    return [(token, start) for token, (_, start) in zip(kept, tokens)]
+
+
+def analyze_line(text: str) -> Line:
+    """
+    Parse and validate a line the way cmd_preprocessor and Command.validate do,
+    collecting every problem instead of logging the first one
+    """
+    line = Line()
+    if not text.strip() or is_repl_command(text):
+        return line
+    tokens = tokenize(text)
+    if not tokens:
+        return line
+    if is_label(tokens[0][0]):
+        label, start = tokens.pop(0)
+        line.label = label[:-1]
+        line.label_span = (start, start + len(label) - 1)
+    if not tokens:
+        line.problems = (
+            Problem(
+                *line.label_span,
+                f"Command incomplete: only found label '{line.label}:'",
+            ),
+        )
+        return line
+
+    (name, name_start), arguments = tokens[0], tokens[1:]
+    if name not in COMMANDS:
+        line.problems = (
+            Problem(name_start, name_start + len(name), f"Command '{name}' not found."),
+        )
+        return line
+    problems = []
+    references = []
+    parameters = COMMANDS[name]["parameters"]
+    if len(arguments) != len(parameters):
+        last, last_start = arguments[-1] if arguments else tokens[0]
+        problems.append(
+            Problem(
+                name_start,
+                last_start + len(last),
+                f"Invalid number of arguments for command: {name}",
+            )
+        )
+    for (argument, start), (p_name, p_type) in zip(arguments, parameters.items()):
+        end = start + len(argument)
+        kind = operand_kind(p_type)
+        if kind in ("register", "pair") and argument not in p_type:
+            problems.append(
+                Problem(start, end, f"Got '{argument}' for parameter of type {p_name}")
+            )
+        elif p_name in ("address", "value") and not process_hex(argument):
+            problems.append(
+                Problem(
+                    start,
+                    end,
+                    f"Invalid token: Expected hex byte got '{argument}'",
+                )
+            )
+        elif kind == "label":
+            references.append((argument, start, end))
+    line.references = tuple(references)
+    line.problems = tuple(problems)
+    line.is_valid = not problems
+    return line
+
+
+class Document:
+    """
+    An open source file: its lines, their parsed Lines and the label counts
+    """
+
+    def __init__(self, text: str, cache: Dict[str, Line]):
+        self.cache = cache
+        self.lines: List[str] = []
+        self.parsed: List[Line] = []
+        # label -> valid lines defining it / jumps referencing it
+        self.definitions: Counter = Counter()
+        self.references: Counter = Counter()
+        self.replace(0, 0, 0, 0, text)
+
+    def parse(self, text: str) -> Line:
+        line = self.cache.get(text)
+        if line is None:
+            if len(self.cache) >= CACHE_SIZE:
+                self.cache.clear()
+            line = self.cache[text] = analyze_line(text)
+        return line
+
+    def count(self, lines: List[Line], sign: int) -> None:
+        for line in lines:
+            if line.label and line.is_valid:
+                add(self.definitions, line.label, sign)
+            for label, _, _ in line.references:
+                add(self.references, label, sign)
+
+    def replace(
+        self,
+        start_line: int,
+        start_column: int,
+        end_line: int,
+        end_column: int,
+        text: str,
+    ) -> None:
+        """
+        Replace the text in a range, re-parsing only the lines it covers
+        """
+        if not self.lines:
+            self.lines = [""]
+            self.parsed = [self.parse("")]
+        end_line = min(end_line, len(self.lines) - 1)
+        prefix = self.lines[start_line][:start_column]
+        suffix = self.lines[end_line][end_column:]
+        new_lines = (prefix + text + suffix).split("\n")
+        new_parsed = [self.parse(line.rstrip("\r")) for line in new_lines]
+        self.count(self.parsed[start_line : end_line + 1], -1)
+        self.count(new_parsed, 1)
+        self.lines[start_line : end_line + 1] = new_lines
+        self.parsed[start_line : end_line + 1] = new_parsed
+
+    def set_text(self, text: str) -> None:
+        self.replace(0, 0, len(self.lines) - 1, len(self.lines[-1]), text)
+
+    def diagnostics(self) -> List[dict]:
+        """
+        LSP diagnostics of the whole file
+        """
+        diagnostics = []
+        defined: Dict[str, int] = {}
+        definitions, references = self.definitions, self.references
+        for number, line in enumerate(self.parsed):
+            for problem in line.problems:
+                diagnostics.append(diagnostic(number, *problem))
+            if line.label and line.is_valid:
+                if line.label in defined and definitions[line.label] > 1:
+                    diagnostics.append(
+                        diagnostic(
+                            number,
+                            *line.label_span,
+                            f"Invalid Command Label: '{line.label}' already exists at line {defined[line.label] + 1}",
+                        )
+                    )
+                else:
+                    defined.setdefault(line.label, number)
+            for label, start, end in line.references:
+                if label not in definitions:
+                    diagnostics.append(
+                        diagnostic(
+                            number, start, end, f"Label '{label}' is never defined"
+                        )
+                    )
+        return diagnostics
+
+    def label_at(self, number: int, column: int) -> Optional[str]:
+        if number >= len(self.parsed):
+            return None
+        line = self.parsed[number]
+        if line.label and line.label_span[0] <= column <= line.label_span[1]:
+            return line.label
+        for label, start, end in line.references:
+            if start <= column <= end:
+                return label
+        return None
+
+    def definition(self, label: str) -> Optional[Tuple[int, int, int]]:
+        """
+        (line, start, end) of the label's (first, effective) definition
+        """
+        if label not in self.definitions:
+            return None
+        for number, line in enumerate(self.parsed):
+            if line.label == label and line.is_valid:
+                return (number, *line.label_span)
+        return None
+
+    def references_of(self, label: str) -> List[Tuple[int, int, int]]:
+        if label not in self.references:
+            return []
+        return [
+            (number, start, end)
+            for number, line in enumerate(self.parsed)
+            for reference, start, end in line.references
+            if reference == label
+        ]
+
+
+def add(counter: Counter, label: str, count: int) -> None:
+    """
+    Add to a label's count, dropping labels that reach 0 so membership means in use
+    """
+    counter[label] += count
+    if counter[label] <= 0:
+        del counter[label]
+
+
+def diagnostic(number: int, start: int, end: int, message: str) -> dict:
+    return {
+        "range": {
+            "start": {"line": number, "character": start},
+            "end": {"line": number, "character": end},
+        },
+        "severity": ERROR,
+        "source": "8085",
+        "message": message,
+    }
+
+
+def location(uri: str, number: int, start: int, end: int) -> dict:
+    return {
+        "uri": uri,
+        "range": {
+            "start": {"line": number, "character": start},
+            "end": {"line": number, "character": end},
+        },
+    }
+
+
+class AnalysisServer:
+    """
+    Keeps the open documents and answers the JSON-RPC messages of an editor
+    """
+
+    def __init__(self, reader: BinaryIO, writer: BinaryIO):
+        self.reader = reader
+        self.writer = writer
+        self.documents: Dict[str, Document] = {}
+        # Parsed lines shared by all the documents
+        self.cache: Dict[str, Line] = {}
+        self.is_shut_down = False
+
+    def read_message(self) -> Optional[dict]:
+        """
+        The next message, None at the end of input
+        """
+        length = None
+        while True:
+            header = self.reader.readline()
+            if not header:
+                return None
+            header = header.strip()
+            if not header:
+                break
+            name, _, value = header.decode("ascii").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        if length is None:
+            return {}
+        try:
+            return json.loads(self.reader.read(length))
+        except ValueError:
+            return {}
+
+    def send(self, message: dict) -> None:
+        message["jsonrpc"] = "2.0"
+        body = json.dumps(message).encode("utf-8")
+        self.writer.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+        self.writer.flush()
+
+    def publish(self, uri: str) -> None:
+        document = self.documents.get(uri)
+        self.send(
+            {
+                "method": "textDocument/publishDiagnostics",
+                "params": {
+                    "uri": uri,
+                    "diagnostics": document.diagnostics() if document else [],
+                },
+            }
+        )
+
+    def serve(self) -> int:
+        """
+        Answer messages until exit, Returns: the exit code
+        """
+        while True:
+            message = self.read_message()
+            if message is None:
+                return 1
+            if message.get("method") == "exit":
+                return 0 if self.is_shut_down else 1
+            self.handle(message)
+
+    def handle(self, message: dict) -> None:
+        if not message:
+            self.send({"id": None, "error": {"code": -32700, "message": "Parse error"}})
+            return
+        method, params = message.get("method"), message.get("params") or {}
+        handler = getattr(self, "on_" + str(method).replace("/", "_"), None)
+        if handler is None:
+            if "id" in message:
+                self.send(
+                    {
+                        "id": message["id"],
+                        "error": {"code": -32601, "message": f"No method {method}"},
+                    }
+                )
+            return
+        try:
+            result = handler(params)
+        except Exception as e:
+            # A malformed message (a change range outside the document ...) mustn't
+            # stop the server, the editor gets an error for a request
+            traceback.print_exc(file=sys.stderr)
+            if "id" in message:
+                self.send(
+                    {
+                        "id": message["id"],
+                        "error": {"code": -32603, "message": f"{method}: {e!r}"},
+                    }
+                )
+            return
+        if "id" in message:
+            self.send({"id": message["id"], "result": result})
+
+    def on_initialize(self, params: dict) -> dict:
+        return {
+            "capabilities": {
+                # Incremental changes
+                "textDocumentSync": {"openClose": True, "change": 2},
+                "definitionProvider": True,
+                "referencesProvider": True,
+            },
+            "serverInfo": {"name": "8085-analyzer"},
+        }
+
+    def on_shutdown(self, params: dict) -> None:
+        self.is_shut_down = True
+
+    def on_textDocument_didOpen(self, params: dict) -> None:
+        document = params["textDocument"]
+        self.documents[document["uri"]] = Document(document["text"], self.cache)
+        self.publish(document["uri"])
+
+    def on_textDocument_didChange(self, params: dict) -> None:
+        uri = params["textDocument"]["uri"]
+        document = self.documents.get(uri)
+        if document is None:
+            return
+        for change in params["contentChanges"]:
+            if "range" not in change:
+                document.set_text(change["text"])
+                continue
+            start, end = change["range"]["start"], change["range"]["end"]
+            document.replace(
+                start["line"],
+                start["character"],
+                end["line"],
+                end["character"],
+                change["text"],
+            )
+        self.publish(uri)
+
+    def on_textDocument_didClose(self, params: dict) -> None:
+        uri = params["textDocument"]["uri"]
+        self.documents.pop(uri, None)
+        self.publish(uri)
+
+    def __label_at(self, params: dict) -> Tuple[Optional[Document], Optional[str]]:
+        document = self.documents.get(params["textDocument"]["uri"])
+        if document is None:
+            return None, None
+        position = params["position"]
+        return document, document.label_at(position["line"], position["character"])
+
+    def on_textDocument_definition(self, params: dict) -> Optional[dict]:
+        document, label = self.__label_at(params)
+        found = document.definition(label) if label else None
+        if found is None:
+            return None
+        return location(params["textDocument"]["uri"], *found)
+
+    def on_textDocument_references(self, params: dict) -> List[dict]:
+        document, label = self.__label_at(params)
+        if not label:
+            return []
+        uri = params["textDocument"]["uri"]
+        found = document.references_of(label)
+        if params.get("context", {}).get("includeDeclaration"):
+            definition = document.definition(label)
+            found = ([definition] if definition else []) + found
+        return [location(uri, *where) for where in found]
+
+
+if __name__ == "__main__":
+    from machine import set_logging
+
+    # stdout carries the protocol, keep the simulator's own records out of the way
+    set_logging(False)
+    server = AnalysisServer(sys.stdin.buffer, sys.stdout.buffer)
+    sys.exit(server.serve())
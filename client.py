@@ -0,0 +1,154 @@
+"""
+Thin client of the warm simulator daemon (daemon.py), takes the options of main.py.
+
+It hands its stdin, stdout and stderr to a daemon worker over a Unix socket, the worker
+runs the command line in this directory as main.py would, and the client exits with its
+exit code. Only the standard library is imported, so an invocation costs python's
+startup and a socket round trip. Without a daemon listening it runs main.py itself.
+
+python daemon.py &
+python client.py -db /tmp/state.json -c "MVI A 05H;inspect"
+"""
+import os
+import sys
+import json
+import array
+import stat
+import signal
+import socket
+import struct
+from typing import Optional
+
+# Path of the daemon's socket, a default per user when not set
+SOCKET_VARIABLE = "PYASSM_SOCKET"
+SOCKET_NAME = "daemon.sock"
+
+
+def socket_directory() -> str:
+    """
+    The default socket's directory, only its owner (mode 0700) can enter it
+    """
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "pyassm-8085")
+    return f"/tmp/pyassm-8085-{os.getuid()}"
+
+
+def socket_path() -> str:
+    if os.environ.get(SOCKET_VARIABLE):
+        return os.environ[SOCKET_VARIABLE]
+    return os.path.join(socket_directory(), SOCKET_NAME)
+
+
+def private_directory(directory: str) -> None:
+    """
+    Create directory for this user only, or check an existing one is.
+    Raises: OSError when another user owns it or can enter it
+    """
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise OSError(f"'{directory}' isn't a directory of this user")
+    if info.st_mode & 0o077:
+        raise OSError(f"'{directory}' is open to other users: chmod 700 it")
+
+
+def peer_check(conn: socket.socket, path: str) -> Optional[str]:
+    """
+    Why the daemon listening at path isn't this user's, None when it is
+    """
+    if hasattr(socket, "SO_PEERCRED"):
+        credentials = conn.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        _, uid, _ = struct.unpack("3i", credentials)
+    else:
+        info = os.stat(path)
+        if info.st_mode & 0o077:
+            return f"'{path}' is open to other users"
+        uid = info.st_uid
+    if uid != os.getuid():
+        return f"'{path}' is served by another user (uid {uid})"
+    return None
+
+
+def send_request(conn: socket.socket, request: dict, fds: list) -> None:
+    """
+    One JSON line, with the file descriptors attached
+    """
+    data = json.dumps(request).encode() + b"\n"
+    ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))]
+    sent = conn.sendmsg([data], ancillary)
+    conn.sendall(data[sent:])
+
+
+def read_message(conn: socket.socket, pending: bytearray) -> Optional[dict]:
+    """
+    The next JSON line from conn, None when it's closed first
+    """
+    while b"\n" not in pending:
+        chunk = conn.recv(4096)
+        if not chunk:
+            return None
+        pending += chunk
+    line, _, rest = bytes(pending).partition(b"\n")
+    pending[:] = rest
+    return json.loads(line)
+
+
+def connect() -> Optional[socket.socket]:
+    """
+    The daemon's socket, None without one or when it isn't this user's daemon: the
+    streams and the environment are only handed to it
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    path = socket_path()
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+        problem = peer_check(conn, path)
+    except OSError:
+        conn.close()
+        return None
+    if problem:
+        print(f"Not using the daemon: {problem}", file=sys.stderr)
+        conn.close()
+        return None
+    return conn
+
+
+def run_local(args: list) -> None:
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    os.execv(sys.executable, [sys.executable, main] + args)
+
+
+def run(args: list) -> int:
+    """
+    Run main.py's command line args on the daemon, Returns: its exit code
+    """
+    conn = connect()
+    if conn is None:
+        run_local(args)
+    request = {"args": args, "cwd": os.getcwd(), "env": dict(os.environ)}
+    pending = bytearray()
+    with conn:
+        send_request(conn, request, [0, 1, 2])
+        started = read_message(conn, pending)
+        if started is None:
+            print("Daemon worker closed the connection", file=sys.stderr)
+            return 1
+        # Ctrl-C goes to the worker running the command line, like to main.py
+        worker = started["pid"]
+        signal.signal(signal.SIGINT, lambda *_: os.kill(worker, signal.SIGINT))
+        finished = read_message(conn, pending)
+    if finished is None:
+        print("Daemon worker exited without an exit code", file=sys.stderr)
+        return 1
+    return finished["exit"]
+
+
+if __name__ == "__main__":
+    sys.exit(run(sys.argv[1:]))
@@ -1,20 +1,76 @@
 from collections.abc import Iterable
 from typing import Optional
+from weakref import WeakValueDictionary
 
 from loguru import logger
 
 from data import COMMANDS, REGISTER_PAIRS
 from state_model import State
-from converter import hex_to_simple, is_label
+from converter import int_to_simple, operand_kind, process_operands
+from ports import port_key
 
 
 class Command:
-    def __init__(self, name: str, args: tuple, state: State, label: str = ""):
+    """
+    A decoded 8085 instruction. It holds no machine state, the State is passed to eval(),
+    so identical instructions can share one instance (see Command.intern).
+    """
+
+    __slots__ = (
+        "name",
+        "args",
+        "label",
+        "is_valid",
+        "cycles",
+        "cycles_taken",
+        "operands",
+        "handler",
+        "__weakref__",
+    )
+
+    # Live interned commands keyed by (name, args, label), dropped once nothing uses them
+    _interned: "WeakValueDictionary[tuple, Command]" = WeakValueDictionary()
+
+    def __init__(
+        self, name: str, args: tuple, label: str = "", is_valid: Optional[bool] = None
+    ):
         self.name = name
         self.args = args
-        self.state = state
         self.label = label
-        self.is_valid = self.validate()
+        # is_valid is passed for instructions already validated (sessions, program cache)
+        self.is_valid = self.validate() if is_valid is None else is_valid
+        spec = COMMANDS[name]
+        self.cycles = spec["cycles"]
+        if "M" in args and "cycles_memory" in spec:
+            self.cycles = spec["cycles_memory"]
+        self.cycles_taken = spec.get("cycles_taken", self.cycles)
+        # Operands parsed once, bytes and words as ints, see converter.process_operands
+        self.operands = process_operands(name, args) if self.is_valid else args
+        self.handler = getattr(Command, spec["function"])
+
+    @classmethod
+    def intern(
+        cls, name: str, args: tuple, label: str = "", is_valid: Optional[bool] = None
+    ) -> "Command":
+        """
+        Returns the shared Command for this instruction, creating (and validating) it once
+        """
+        key = (name, args, label)
+        command = cls._interned.get(key)
+        if command is None:
+            command = cls(name, args, label=label, is_valid=is_valid)
+            cls._interned[key] = command
+        return command
+
+    @property
+    def operand_kinds(self) -> tuple:
+        """
+        Kind of each operand: register, pair, byte, word, label or port
+        """
+        return tuple(
+            operand_kind(p_type)
+            for p_type in COMMANDS[self.name]["parameters"].values()
+        )
 
     def validate(self) -> bool:
         validations = (
@@ -46,478 +102,464 @@ class Command:
                     return False
         return True
 
-    def eval(self):
+    def eval(self, state: State):
         """
-        Get function str from command and convert it to self function and call it with args
+        Call the handler of the command with its parsed operands
         """
-        logger.debug("Evaluating command: " + str(self))
-        func = COMMANDS[self.name]["function"]
-        params = COMMANDS[self.name]["parameters"]
-        class_func = getattr(self, func)
-        if not params:
-            return class_func()
-        else:
-            return class_func(self.args)
+        logger.debug("Evaluating command: {}", self)
+        if not self.operands:
+            return self.handler(self, state)
+        return self.handler(self, state, self.operands)
 
-    def inspect(self) -> None:
-        self.state.inspect()
+    def inspect(self, state: State) -> None:
+        state.inspect()
 
-    def halt(self) -> None:
+    def halt(self, state: State) -> None:
+        """
+        Stop the run, until an interrupt is acknowledged or the program is run again
+        """
         logger.debug("HLT received.")
-        return
+        state.halted = True
+        state.echo("Halted")
 
-    def move(self, args: tuple) -> None:
+    def move(self, state: State, operands: tuple) -> None:
         """
         Move value from register to register
         """
-        logger.debug(f"MOV: {args}")
-        register_to, register_from = args[0], args[1]
-        value = self.state.registers[register_from]
-        self.state.registers[register_to] = value
-        logger.debug(f"MOVED: {register_to}[{value}] <- {register_from}")
-        print(f"{register_to} -> {hex_to_simple(value)} [From {register_from}]")
+        register_to, register_from = operands
+        value = state.get_register(register_from)
+        state.set_register(register_to, value)
+        if state.verbose:
+            state.echo(
+                f"{register_to} -> {int_to_simple(value)} [From {register_from}]"
+            )
 
-    def move_to_immediate(self, args: tuple) -> None:
+    def move_to_immediate(self, state: State, operands: tuple) -> None:
         """
         Move to immediate position
         """
-        logger.debug(f"MVI: {args}")
-        register = args[0]
-        value = args[1]
-        formatted_value = f"0x{int(value, 16):02x}"
-        self.state.registers[register] = formatted_value
-        logger.debug("MOVED TO IMMEDIATE:" f"{self.state.registers[register]=}")
-        print(f"{register} -> {hex_to_simple(formatted_value)}")
+        register, value = operands
+        state.set_register(register, value)
+        if state.verbose:
+            state.echo(f"{register} -> {int_to_simple(value)}")
 
-    def load_accumulator(self, args: tuple):
+    def load_accumulator(self, state: State, operands: tuple):
         """
         Load accumulator with value from register
         """
-        logger.debug(f"LDA: {args}")
-        # convert to string representation for dict key
-        address = args[0]
-        address = f"0x{int(address, 16):04x}"
-        if not self.state.memory.get(address):
+        address = operands[0]
+        value = state.memory.read_byte(address)
+        if value is None:
             logger.debug(
-                f"Address {address} is not in memory:",
-                f"Creating and init to 0",
+                f"Address {address:04x} is not in memory: Creating and init to 0"
+            )
+            value = 0
+            state.memory.write_byte(address, value)
+        state.set_register("A", value)
+        if state.verbose:
+            state.echo(
+                f"A -> {int_to_simple(value)}",
+                f"[From {int_to_simple(address, 4)}]",
             )
-            self.state.memory[address] = f"0x{0:02x}"
-        self.state.accumulator = self.state.memory[address]
-        logger.debug(f"LOADED ACCUMULATOR: {self.state.accumulator}")
-        print(
-            f"A -> {hex_to_simple(self.state.accumulator)}",
-            f"[From {hex_to_simple(address)}]",
-        )
 
-    def store_accumulator(self, args: tuple) -> None:
+    def store_accumulator(self, state: State, operands: tuple) -> None:
         """
         Store accumulator to register
         """
-        logger.debug(f"STA: {args}")
-        address = args[0]
-        address = f"0x{int(address, 16):04x}"
-        self.state.memory[address] = self.state.accumulator
-        logger.debug(
-            "STORED ACCUMULATOR:",
-            f"{self.state.memory[address]}",
-        )
-        print(
-            f"{hex_to_simple(address)} ->" f" {hex_to_simple(self.state.accumulator)}"
-        )
+        address = operands[0]
+        value = state.get_register("A")
+        state.memory.write_byte(address, value)
+        if state.verbose:
+            state.echo(f"{int_to_simple(address, 4)} -> {int_to_simple(value)}")
 
-    def store_accumulator_to_register_pair(self, args: tuple) -> None:
+    def store_accumulator_to_register_pair(self, state: State, operands: tuple) -> None:
         """
         Store accumulator to register pair
         """
-        logger.debug(f"STAX: {args}")
-        register = args[0]
-        REG1, REG2 = REGISTER_PAIRS[register]
-        mem_addr = self.state.get_mem_addr_register_pair(register)
-        self.state.memory[mem_addr] = self.state.accumulator
-        logger.debug(f"Stored from ACCUMULATOR: {self.state.accumulator} to {mem_addr}")
-        print(
-            f"{REG1}{REG2} [{mem_addr}] -> {hex_to_simple(self.state.accumulator)} [From A]"
-        )
+        register = operands[0]
+        value = state.get_register("A")
+        state.memory.write_byte(state.get_register_pair(register), value)
+        if state.verbose:
+            REG1, REG2 = REGISTER_PAIRS[register]
+            mem_addr = state.get_mem_addr_register_pair(register)
+            state.echo(f"{REG1}{REG2} [{mem_addr}] -> {int_to_simple(value)} [From A]")
 
-    def add(self, args: tuple) -> None:
+    def add(self, state: State, operands: tuple) -> None:
         """
         Add value from register to accumulator
         """
-        logger.debug(f"ADD: {args}")
-        register = args[0]
-        value = self.state.registers[register]
-        acc_value = self.state.accumulator
-        self.__add(value)
-        logger.debug(f"ADDED: {self.state.accumulator}")
-
-        print(
-            f"A -> {hex_to_simple(acc_value)} + {hex_to_simple(value)} -> {hex_to_simple(self.state.accumulator)}"
-        )
-        flags = self.state.flags
-        if flags["carry"] or flags["zero"] or flags["sign"]:
-            print(
-                f"FLAGS: CY->{int(flags['carry'])}, S->{int(flags['sign'])}, Z->{int(flags['zero'])}"
+        value = state.get_register(operands[0])
+        acc_value = state.get_register("A")
+        result = self.__add(state, value)
+        if state.verbose:
+            state.echo(
+                f"A -> {int_to_simple(acc_value)} + {int_to_simple(value)} -> {int_to_simple(result)}"
             )
+            self.__echo_flags(state)
 
-    def add_immediate(self, args: tuple) -> None:
+    def add_immediate(self, state: State, operands: tuple) -> None:
         """
         Add a 8-bit number to Accumulator
         """
-        logger.debug(f"Add Immediate: {args}")
-        value = args[0]
-        formatted_value = f"0x{int(value, 16):02x}"
-        acc_value = self.state.accumulator
-        self.__add(value)
-        logger.debug(f"ADDED: {self.state.accumulator}")
-        print(
-            f"A -> {hex_to_simple(acc_value)} + {hex_to_simple(formatted_value)} -> {hex_to_simple(self.state.accumulator)}\t"
-        )
-        flags = self.state.flags
-        if flags["carry"] or flags["zero"] or flags["sign"]:
-            print(
-                f"FLAGS: CY->{int(flags['carry'])}, S->{int(flags['sign'])}, Z->{int(flags['zero'])}"
+        value = operands[0]
+        acc_value = state.get_register("A")
+        result = self.__add(state, value)
+        if state.verbose:
+            state.echo(
+                f"A -> {int_to_simple(acc_value)} + {int_to_simple(value)} -> {int_to_simple(result)}\t"
             )
+            self.__echo_flags(state)
 
-    def subtract_immediate(self, args: tuple) -> None:
+    def subtract_immediate(self, state: State, operands: tuple) -> None:
         """
         Subtract a 8-bit number from accumulator
         """
-        logger.debug(f"Sub Immediate: {args}")
-        acc_value = self.state.accumulator  # for logging only
-        result = self.__compare_sub_immediate(args)
-        self.state.accumulator = result
-
-        value = args[0]
-        formatted_value = f"0x{int(args[0], 16):02x}"
-        logger.debug(
-            f"Subtracted '{value}' from '{acc_value}': {self.state.accumulator}"
-        )
-        print(
-            f"A -> {hex_to_simple(acc_value)} - {hex_to_simple(formatted_value)} -> {hex_to_simple(self.state.accumulator)}"
-            f"\nFLAGS: CY->{int(self.state.flags['carry'])}, S->{int(self.state.flags['sign'])}, Z->{int(self.state.flags['zero'])}"
-        )
+        value = operands[0]
+        acc_value = state.get_register("A")
+        result = self.__compare_sub(state, value)
+        state.set_register("A", result)
+        if state.verbose:
+            state.echo(
+                f"A -> {int_to_simple(acc_value)} - {int_to_simple(value)} -> {int_to_simple(result)}"
+                f"\n{self.__format_flags(state)}"
+            )
 
-    def subtract(self, args: tuple) -> None:
+    def subtract(self, state: State, operands: tuple) -> None:
         """
         Subtract a register from accumulator
         """
-        logger.debug(f"Sub Immediate: {args}")
-        acc_value = self.state.accumulator
-        register = args[0]
-        register_value = self.state.registers[register]
-        result = self.__compare_sub_immediate((register_value,))
-        self.state.accumulator = result
-
-        logger.debug(
-            f"Subtracted '{register_value}' from '{acc_value}': {self.state.accumulator}"
-        )
-        print(
-            f"A - {register} -> {hex_to_simple(acc_value)} - {hex_to_simple(register_value)} -> {hex_to_simple(self.state.accumulator)}"
-            f"\nFLAGS: CY->{int(self.state.flags['carry'])}, S->{int(self.state.flags['sign'])}, Z->{int(self.state.flags['zero'])}"
-        )
+        register = operands[0]
+        register_value = state.get_register(register)
+        acc_value = state.get_register("A")
+        result = self.__compare_sub(state, register_value)
+        state.set_register("A", result)
+        if state.verbose:
+            state.echo(
+                f"A - {register} -> {int_to_simple(acc_value)} - {int_to_simple(register_value)} -> {int_to_simple(result)}"
+                f"\n{self.__format_flags(state)}"
+            )
 
-    def compare_immediate(self, args: tuple) -> None:
+    def compare_immediate(self, state: State, operands: tuple) -> None:
         """
         Compare a 8-bit number from accumulator
         """
-        logger.debug(f"Sub Immediate: {args}")
-        value = args[0]
-        formatted_value = f"0x{int(value, 16):02x}"
-        acc_value = self.state.accumulator
-
-        result = self.__compare_sub_immediate(args)
-        logger.debug(f"Compared '{value}' from '{acc_value}': {result}")
-        print(
-            f"[A] {hex_to_simple(acc_value)} - {hex_to_simple(formatted_value)} -> {hex_to_simple(result)}"
-            f"\nFLAGS: CY->{int(self.state.flags['carry'])}, S->{int(self.state.flags['sign'])}, Z->{int(self.state.flags['zero'])}"
-        )
+        value = operands[0]
+        acc_value = state.get_register("A")
+        result = self.__compare_sub(state, value)
+        if state.verbose:
+            state.echo(
+                f"[A] {int_to_simple(acc_value)} - {int_to_simple(value)} -> {int_to_simple(result, 1)}"
+                f"\n{self.__format_flags(state)}"
+            )
 
-    def compare(self, args: tuple) -> None:
+    def compare(self, state: State, operands: tuple) -> None:
         """
         Subtract a register from accumulator
         """
-        logger.debug(f"Sub Immediate: {args}")
-        register = args[0]
-        register_value = self.state.registers[register]
-        acc_value = self.state.accumulator
-
-        result = self.__compare_sub_immediate((register_value,))
-        logger.debug(f"Compared '{register_value}' from '{acc_value}': {result}")
-        print(
-            f"A - {register} -> {hex_to_simple(acc_value)} - {hex_to_simple(register_value)} -> {hex_to_simple(result)}"
-            f"\nFLAGS: CY->{int(self.state.flags['carry'])}, S->{int(self.state.flags['sign'])}, Z->{int(self.state.flags['zero'])}"
-        )
+        register = operands[0]
+        register_value = state.get_register(register)
+        acc_value = state.get_register("A")
+        result = self.__compare_sub(state, register_value)
+        if state.verbose:
+            state.echo(
+                f"A - {register} -> {int_to_simple(acc_value)} - {int_to_simple(register_value)} -> {int_to_simple(result, 1)}"
+                f"\n{self.__format_flags(state)}"
+            )
 
-    def and_immediate(self, args: tuple) -> None:
+    def and_immediate(self, state: State, operands: tuple) -> None:
         """
         Bitwise Logical AND with accumulator and 8 byte data
         """
-        logger.debug(f"AND Immediate: {args}")
-        value = args[0]
-        formatted_value = f"0x{int(value, 16):02x}"
-        acc_value = self.state.accumulator
-        result = int(acc_value, 16) & int(value, 16)
-        self.change_state_flags(zero=True if result == 0 else False)
-        self.state.accumulator = f"0x{result:02x}"
-        logger.debug(f"{value} AND {acc_value} -> {result}:{self.state.accumulator}")
-        print(
-            f"{hex_to_simple(acc_value)} & {hex_to_simple(formatted_value)} -> {hex_to_simple(self.state.accumulator)}"
-        )
-        if self.state.flags["zero"]:
-            print(
-                f"FLAGS: CY->{int(self.state.flags['carry'])}, S->{int(self.state.flags['sign'])}, Z->{int(self.state.flags['zero'])}"
+        value = operands[0]
+        acc_value = state.get_register("A")
+        result = acc_value & value
+        self.change_state_flags(state, zero=result == 0)
+        state.set_register("A", result)
+        if state.verbose:
+            state.echo(
+                f"{int_to_simple(acc_value)} & {int_to_simple(value)} -> {int_to_simple(result)}"
             )
+            if state.flags["zero"]:
+                state.echo(self.__format_flags(state))
 
-    def or_immediate(self, args: tuple) -> None:
+    def or_immediate(self, state: State, operands: tuple) -> None:
         """
         Bitwise Logical OR with accumulator and 8 byte data
         """
-        logger.debug(f"OR Immediate: {args}")
-        value = args[0]
-        formatted_value = f"0x{int(value, 16):02x}"
-        acc_value = self.state.accumulator
-        result = int(acc_value, 16) | int(value, 16)
-        self.change_state_flags(zero=True if result == 0 else False)
-        self.state.accumulator = f"0x{result:02x}"
-        logger.debug(f"{value} OR {acc_value} -> {result}:{self.state.accumulator}")
-        print(
-            f"{hex_to_simple(acc_value)} | {hex_to_simple(formatted_value)} -> {hex_to_simple(self.state.accumulator)}"
-        )
-        if self.state.flags["zero"]:
-            print(
-                f"FLAGS: CY->{int(self.state.flags['carry'])}, S->{int(self.state.flags['sign'])}, Z->{int(self.state.flags['zero'])}"
+        value = operands[0]
+        acc_value = state.get_register("A")
+        result = acc_value | value
+        self.change_state_flags(state, zero=result == 0)
+        state.set_register("A", result)
+        if state.verbose:
+            state.echo(
+                f"{int_to_simple(acc_value)} | {int_to_simple(value)} -> {int_to_simple(result)}"
             )
+            if state.flags["zero"]:
+                state.echo(self.__format_flags(state))
 
-    def rotate_right_accumulator(self) -> None:
+    def rotate_right_accumulator(self, state: State) -> None:
         """
         Rotate Right Accumulator
         Copy the LSB to carry and first place of byte
         1001 -> RRC -> 1100 [CY->1]
         """
-        logger.debug(f"RRC: ")
-        acc_value = self.state.accumulator
-        result = int(acc_value, 16) >> 1
-        shifted_bit = int(acc_value, 16) & 1
+        acc_value = state.get_register("A")
+        shifted_bit = acc_value & 1
+        result = acc_value >> 1
         if shifted_bit:
-            result = result | int("80", 16)
-        self.change_state_flags(carry=True if shifted_bit == 1 else False)
-        self.change_state_flags(zero=True if result == 0 else False)
-        self.state.accumulator = f"0x{result:02x}"
-        logger.debug(
-            f"{acc_value} >> 1 -> {result}:{self.state.accumulator} CY->{shifted_bit}"
-        )
-        print(
-            f"{hex_to_simple(acc_value)} >> 1 -> {hex_to_simple(self.state.accumulator)}"
-            f"\nFLAGS: CY->{int(self.state.flags['carry'])}, S->{int(self.state.flags['sign'])}, Z->{int(self.state.flags['zero'])}"
-        )
+            result = result | 0x80
+        self.change_state_flags(state, carry=shifted_bit == 1, zero=result == 0)
+        state.set_register("A", result)
+        if state.verbose:
+            state.echo(
+                f"{int_to_simple(acc_value)} >> 1 -> {int_to_simple(result)}"
+                f"\n{self.__format_flags(state)}"
+            )
 
-    def increment_register(self, args: tuple) -> None:
+    def increment_register(self, state: State, operands: tuple) -> None:
         """
         Increment a given register by 1
         """
-        logger.debug(f"INR: {args}")
-        register = args[0]
-        register_value = self.state.registers[register]
-        increment_by = f"0x{1:02x}"
-        incremented_int_value = int(register_value, 16) + int(increment_by, 16)
-        self.state.registers[register] = hex(abs(incremented_int_value))
-        incremented_value = self.state.registers[register]
-        logger.debug(f"Incremented: {register} to {incremented_value}")
-        print(
-            f"{register} -> {hex_to_simple(register_value)} + {hex_to_simple(increment_by)} -> {hex_to_simple(incremented_value)}"
-        )
+        register = operands[0]
+        register_value = state.get_register(register)
+        incremented_value = register_value + 1
+        state.set_register(register, incremented_value)
+        if state.verbose:
+            state.echo(
+                f"{register} -> {int_to_simple(register_value)} + 01H -> {int_to_simple(incremented_value)}"
+            )
 
-    def decrement_register(self, args: tuple) -> None:
+    def decrement_register(self, state: State, operands: tuple) -> None:
         """
         Decrement a given register by 1
         """
-        logger.debug(f"DCR: {args}")
-        register = args[0]
-        register_value = self.state.registers[register]
-        decrement_by = f"0x{1:02x}"  # eq to hex(0x01)
-        decremented_int_value = int(register_value, 16) - int(decrement_by, 16)
-        if decremented_int_value < 0:
-            self.change_state_flags(carry=True, sign=True, zero=False)
-        elif decremented_int_value > 0:
-            self.change_state_flags(carry=False, sign=False, zero=False)
-        elif decremented_int_value == 0:
-            self.change_state_flags(carry=False, sign=False, zero=True)
-        self.state.registers[register] = hex(abs(decremented_int_value))
-        decremented_value = self.state.registers[register]
-        logger.debug(f"Decremented: {register} to {decremented_value}")
-        print(
-            f"{register} -> {hex_to_simple(register_value)} - {hex_to_simple(decrement_by)} -> {hex_to_simple(decremented_value)}"
-        )
+        register = operands[0]
+        register_value = state.get_register(register)
+        decremented_value = register_value - 1
+        if decremented_value < 0:
+            self.change_state_flags(state, carry=True, sign=True, zero=False)
+        elif decremented_value > 0:
+            self.change_state_flags(state, carry=False, sign=False, zero=False)
+        elif decremented_value == 0:
+            self.change_state_flags(state, carry=False, sign=False, zero=True)
+        decremented_value = abs(decremented_value)
+        state.set_register(register, decremented_value)
+        if state.verbose:
+            state.echo(
+                f"{register} -> {int_to_simple(register_value)} - 01H -> {int_to_simple(decremented_value)}"
+            )
 
-    def increment_extended_register(self, args: tuple):
+    def increment_extended_register(self, state: State, operands: tuple):
         """
         Increment the xtended register pair by 1
         """
-        logger.debug(f"INX: {args}")
-        register = args[0]
-        REG1, REG2 = REGISTER_PAIRS[register]
-        register_addr = self.state.get_mem_addr_register_pair(register)
-        logger.debug(
-            f"Got mem addr stored by register pair {REG1}{REG2}: {register_addr}"
+        register = operands[0]
+        # Shown as it was held, before the increment
+        register_addr = (
+            state.get_mem_addr_register_pair(register) if state.verbose else ""
         )
-        increment_by = f"0x{1:02x}"
-        incremented_int_value = int(register_addr, 16) + int(increment_by, 16)
-        incremented_value = f"0x{incremented_int_value:04x}"
-        self.state.set_register_pair_value(incremented_value, register)
-        hex1, hex2 = self.state.registers[REG1], self.state.registers[REG2]
-        logger.debug(f"{REG1} -> {hex1} | {REG2} -> {hex2}")
-        print(f"{REG1}{REG2} -> {incremented_value} [{register_addr} + {increment_by}]")
+        incremented_value = state.get_register_pair(register) + 1
+        state.set_register_pair(register, incremented_value)
+        if state.verbose:
+            REG1, REG2 = REGISTER_PAIRS[register]
+            state.echo(
+                f"{REG1}{REG2} -> 0x{incremented_value:04x} [{register_addr} + 0x01]"
+            )
 
-    def decrement_extended_register(self, args: tuple) -> None:
+    def decrement_extended_register(self, state: State, operands: tuple) -> None:
         """
         Decrement the xtended register pair by 1
         """
-        logger.debug(f"DCX: {args}")
-        register = args[0]
-        REG1, REG2 = REGISTER_PAIRS[register]
-        register_addr = self.state.get_mem_addr_register_pair(register)
-        logger.debug(
-            f"Got mem addr stored by register pair {REG1}{REG2}: {register_addr}"
-        )
-        decrement_by = f"0x{1:02x}"
-        decremented_int_value = int(register_addr, 16) - int(decrement_by, 16)
-        if decremented_int_value < 0:
+        register = operands[0]
+        decremented_value = state.get_register_pair(register) - 1
+        if decremented_value < 0:
             logger.error(
-                f"Memory address '{register_addr}' gets negative when decremented"
+                f"Memory address '{state.get_mem_addr_register_pair(register)}' gets negative when decremented"
             )
             return
-        decremented_value = f"0x{decremented_int_value:04x}"
-        self.state.set_register_pair_value(decremented_value, register)
-        hex1, hex2 = self.state.registers[REG1], self.state.registers[REG2]
-        logger.debug(f"{REG1} -> {hex1} | {REG2} -> {hex2}")
-        print(f"{REG1}{REG2} -> {decremented_value} [{register_addr} - {decrement_by}]")
+        register_addr = (
+            state.get_mem_addr_register_pair(register) if state.verbose else ""
+        )
+        state.set_register_pair(register, decremented_value)
+        if state.verbose:
+            REG1, REG2 = REGISTER_PAIRS[register]
+            state.echo(
+                f"{REG1}{REG2} -> 0x{decremented_value:04x} [{register_addr} - 0x01]"
+            )
 
-    def load_register_pair_immediate(self, args: tuple) -> None:
+    def load_register_pair_immediate(self, state: State, operands: tuple) -> None:
         """
         Load register pair from immediate
         """
-        logger.debug(f"LXI: {args}")
-        register, value = args[0], args[1]
-        value = f"0x{int(value, 16):04x}"
-        self.state.set_register_pair_value(value, register)
-        REG1, REG2 = REGISTER_PAIRS[register]
-        hex1, hex2 = self.state.registers[REG1], self.state.registers[REG2]
-        print(f"{REG1}{REG2} -> {value} [{REG1} -> {hex1} {REG2} -> {hex2}]")
+        register, value = operands
+        state.set_register_pair(register, value)
+        if state.verbose:
+            REG1, REG2 = REGISTER_PAIRS[register]
+            state.echo(
+                f"{REG1}{REG2} -> 0x{value:04x} [{REG1} -> 0x{value >> 8:02x} {REG2} -> 0x{value & 0xFF:02x}]"
+            )
 
-    def load_accumulator_from_register_pair(self, args: tuple) -> None:
+    def load_accumulator_from_register_pair(
+        self, state: State, operands: tuple
+    ) -> None:
         """
         Load accumulator from register pair
         """
-        logger.debug(f"LDAX: {args}")
-        register = args[0]
-        REG1, REG2 = REGISTER_PAIRS[register]
-        hex1, hex2 = self.state.registers[REG1], self.state.registers[REG2]
-        value = self.state.get_register_pair_value(register)
-        self.state.accumulator = value
-        logger.debug(f"LOADED ACCUMULATOR: {self.state.accumulator}")
-        print(
-            f"A -> {hex_to_simple(self.state.accumulator)}",
-            f" ; FROM {REG1}{REG2} -> [{hex1}{hex2[2:]}]",
-        )
+        register = operands[0]
+        value = state.memory.read_byte(state.get_register_pair(register))
+        if value is None:
+            value = 0
+        state.set_register("A", value)
+        if state.verbose:
+            REG1, REG2 = REGISTER_PAIRS[register]
+            state.echo(
+                f"A -> {int_to_simple(value)}",
+                f" ; FROM {REG1}{REG2} -> [{state.get_mem_addr_register_pair(register)}]",
+            )
 
-    def jump_if_zero(self, args: tuple) -> Optional[str]:
+    def jump_if_zero(self, state: State, operands: tuple) -> Optional[str]:
         """
         Jump to a given label if Zero flag is True
         """
-        logger.debug(f"JZ: {args}")
-        label = args[0] + ":"
-        if not is_label(label):
-            logger.debug(f"JZ: Invalid label syntax, '{label[:-1]}'")
-        if self.state.flags["zero"]:
-            return label[:-1]
+        if state.flags["zero"]:
+            return operands[0]
 
-    def jump_if_not_zero(self, args: tuple) -> Optional[str]:
+    def jump_if_not_zero(self, state: State, operands: tuple) -> Optional[str]:
         """
         Jump to a given label if Zero flag is False
         """
-        logger.debug(f"JNZ: {args}")
-        label = args[0] + ":"
-        if not is_label(label):
-            logger.debug(f"JNZ: Invalid label syntax, '{label[:-1]}'")
-        if not self.state.flags["zero"]:
-            return label[:-1]
+        if not state.flags["zero"]:
+            return operands[0]
 
-    def jump_if_carry(self, args: tuple) -> Optional[str]:
+    def jump_if_carry(self, state: State, operands: tuple) -> Optional[str]:
         """
         Jump to a given label if Carry flag is True
         """
-        logger.debug(f"JC: {args}")
-        label = args[0] + ":"
-        if not is_label(label):
-            logger.debug(f"JC: Invalid label syntax, '{label[:-1]}'")
-        if self.state.flags["carry"]:
-            return label[:-1]
+        if state.flags["carry"]:
+            return operands[0]
 
-    def jump_if_not_carry(self, args: tuple) -> Optional[str]:
+    def jump_if_not_carry(self, state: State, operands: tuple) -> Optional[str]:
         """
         Jump to a given label if Carry flag is False
         """
-        logger.debug(f"JNC: {args}")
-        label = args[0] + ":"
-        if not is_label(label):
-            logger.debug(f"JNC: Invalid label syntax, '{label[:-1]}'")
-        if not self.state.flags["carry"]:
-            return label[:-1]
+        if not state.flags["carry"]:
+            return operands[0]
 
-    def out(self, args: tuple) -> None:
+    def out(self, state: State, operands: tuple) -> None:
         """
         Display the vaue of accumulator to display port
         """
-        logger.debug(f"OUT: {args}")
-        port = args[0]
-        acc_value = self.state.accumulator
-        print(f"{port}: {hex_to_simple(acc_value)}")
+        port = operands[0]
+        acc_value = state.get_register("A")
+        ports = state.ports
+        if state.verbose and not ports.attached(port):
+            # Shown when the command is done, with the other OUTs, not once per byte
+            ports.console.write(port_key(port), acc_value)
+        ports.write(port, acc_value)
+
+    def input_port(self, state: State, operands: tuple) -> None:
+        """
+        Load the accumulator with a byte read from the device on the port
+        """
+        port = operands[0]
+        value = state.ports.read(port)
+        if value is None:
+            return
+        state.set_register("A", value)
+        if state.verbose:
+            state.echo(f"A -> {int_to_simple(value)} [From {port}]")
+
+    def enable_interrupts(self, state: State) -> None:
+        """
+        Enable the maskable interrupts (RST 7.5/6.5/5.5)
+        """
+        state.interrupts_enabled = True
+        state.echo("Interrupts enabled")
+
+    def disable_interrupts(self, state: State) -> None:
+        """
+        Disable the maskable interrupts (RST 7.5/6.5/5.5)
+        """
+        state.interrupts_enabled = False
+        state.echo("Interrupts disabled")
+
+    def set_interrupt_mask(self, state: State) -> None:
+        """
+        Set the RST masks from accumulator when bit 3 (mask set enable) is 1:
+        bit 0 -> RST5.5, bit 1 -> RST6.5, bit 2 -> RST7.5 (1 masks it)
+        bit 4 resets a pending RST7.5
+        """
+        acc_value = state.get_register("A")
+        if acc_value & 0x08:
+            for bit, name in enumerate(("RST5.5", "RST6.5", "RST7.5")):
+                state.interrupt_masks[name] = bool(acc_value & (1 << bit))
+        if acc_value & 0x10:
+            state.pending_interrupts.discard("RST7.5")
+        masks = state.interrupt_masks
+        logger.debug(f"SIM: {int_to_simple(acc_value)} -> {masks}")
+        state.echo(
+            f"MASKS: 7.5->{int(masks['RST7.5'])}, 6.5->{int(masks['RST6.5'])}, 5.5->{int(masks['RST5.5'])}"
+        )
+
+    def return_from_interrupt(self, state: State) -> Optional[int]:
+        """
+        Return from a service routine, Returns: Index of the command to resume at
+        """
+        if not state.return_stack:
+            logger.error("RET: No interrupt service routine to return from")
+            return None
+        return state.return_stack.pop()
 
-    def change_state_flags(self, **kwargs) -> None:
+    def change_state_flags(self, state: State, **kwargs) -> None:
         """
         Helper function to set state flags in one simple call
         """
         for key, value in kwargs.items():
-            if key not in self.state.flags:
+            if key not in state.flags:
                 raise ValueError(
-                    f"No such flag '{key}' present at state flags {self.state.flags}"
+                    f"No such flag '{key}' present at state flags {state.flags}"
                 )
-            self.state.flags[key] = value
+            state.flags[key] = value
 
-    def __compare_sub_immediate(self, args: tuple) -> str:
+    def __compare_sub(self, state: State, value: int) -> int:
         """
-        Variation of compare immediate that changes flags and returns value
+        Subtract value from accumulator, changing the flags, and return the result
         Utilization or reuse for subtraction and comparison
         """
-        value = args[0]
-        acc_value = self.state.accumulator
-        operation_value = int(acc_value, 16) - int(value, 16)
+        operation_value = state.get_register("A") - value
         if operation_value < 0:
-            self.change_state_flags(carry=True, sign=True, zero=False)
+            self.change_state_flags(state, carry=True, sign=True, zero=False)
         elif operation_value > 0:
-            self.change_state_flags(carry=False, sign=False, zero=False)
+            self.change_state_flags(state, carry=False, sign=False, zero=False)
         elif operation_value == 0:
-            self.change_state_flags(carry=False, sign=False, zero=True)
-        return hex(abs(operation_value))
+            self.change_state_flags(state, carry=False, sign=False, zero=True)
+        return abs(operation_value)
 
-    def __add(self, value: str) -> None:
+    def __add(self, state: State, value: int) -> int:
         """
-        Core logic for both ADD and ADI operations
+        Core logic for both ADD and ADI operations, Returns: the new accumulator
         """
-        acc_value = self.state.accumulator
-        operation_value = int(acc_value, 16) + int(value, 16)
-        if operation_value > int("0xff", 16):
-            self.change_state_flags(carry=True, sign=False, zero=False)
-            hex_op_value = f"0x{int(hex(operation_value), 16):02x}"
-            carry_discarded_value = f"0x{hex_op_value[-2:]}"
-            self.state.accumulator = carry_discarded_value
+        operation_value = state.get_register("A") + value
+        if operation_value > 0xFF:
+            self.change_state_flags(state, carry=True, sign=False, zero=False)
+            # The carry is discarded
+            operation_value &= 0xFF
         elif operation_value == 0:
-            self.change_state_flags(carry=False, sign=False, zero=True)
-            self.state.accumulator = hex(operation_value)
+            self.change_state_flags(state, carry=False, sign=False, zero=True)
         else:
-            self.change_state_flags(carry=False, sign=False, zero=False)
-            self.state.accumulator = hex(operation_value)
+            self.change_state_flags(state, carry=False, sign=False, zero=False)
+        state.set_register("A", operation_value)
+        return operation_value
+
+    def __format_flags(self, state: State) -> str:
+        flags = state.flags
+        return f"FLAGS: CY->{int(flags['carry'])}, S->{int(flags['sign'])}, Z->{int(flags['zero'])}"
+
+    def __echo_flags(self, state: State) -> None:
+        flags = state.flags
+        if flags["carry"] or flags["zero"] or flags["sign"]:
+            state.echo(self.__format_flags(state))
 
     def __str__(self):
         label = f"{self.label}: " if self.label else ""
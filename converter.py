@@ -1,10 +1,20 @@
 import os
 import sys
+from typing import Optional
 
 from loguru import logger
 
-from data import COMMANDS, LOG_LEVEL_SHORT_FORM, HANDLER_FORMAT
+from data import (
+    COMMANDS,
+    LOG_LEVEL_SHORT_FORM,
+    HANDLER_FORMAT,
+    HEX_TEXT_EXTENSIONS,
+    REPL_LINES,
+    REPL_PREFIXES,
+)
 from messages import msg_cli_help
+from guards import process_limits
+from history import History
 
 
 def hex_to_simple(hex_code: str) -> str:
@@ -57,6 +67,40 @@ def process_hex(argument: str) -> str:
     return hex_code
 
 
+def operand_kind(p_type) -> str:
+    """
+    Kind of the operand a parameter takes: register, pair, byte, word, label or port
+    """
+    if isinstance(p_type, dict):
+        return "pair"
+    if not isinstance(p_type, str):
+        return "register"
+    if p_type == "display_port":
+        return "port"
+    return p_type
+
+
+def process_operands(cmdname: str, cmdargs: tuple) -> tuple:
+    """
+    Operands of a processed instruction: bytes and words parsed once into ints,
+    registers, register pairs, labels and ports stay names
+    ('MVI', ('A', '0x05')) -> ('A', 5)
+    """
+    operands = list(cmdargs)
+    cmd_parameters = COMMANDS[cmdname]["parameters"]
+    for index, p_type in enumerate(list(cmd_parameters.values())[: len(operands)]):
+        if operand_kind(p_type) in ("byte", "word"):
+            operands[index] = int(cmdargs[index], 16)
+    return tuple(operands)
+
+
+def int_to_simple(value: int, digits: int = 2) -> str:
+    """
+    Convert int to simple hex 00H representation.
+    """
+    return f"{value:0{digits}X}H"
+
+
 def process_comments(cmd_list: tuple) -> tuple:
     """
     Iterates through the list and if ';' found discard ';' and all items after ';'
@@ -99,6 +143,70 @@ def process_file_mode_args(filename: str) -> tuple:
     return tuple(cmds)
 
 
+def is_hex_text_file(filename: str) -> bool:
+    """
+    Memory files ending with .hex or .txt hold hex text, everything else is raw binary
+    """
+    return os.path.splitext(filename)[1].lower() in HEX_TEXT_EXTENSIONS
+
+
+def process_hex_text(text: str) -> Optional[bytes]:
+    """
+    Convert hex text to bytes, bytes are separated by spaces, commas or newlines
+    '0A 1BH, ff ; comment' -> b'\x0a\x1b\xff'
+    Returns: bytes/None: None (and the error logged) for invalid hex text
+    """
+    tokens = []
+    for line in text.splitlines():
+        line = line.split(";")[0].replace(",", " ")
+        tokens.extend(
+            token[:-1] if token[-1] in "hH" else token for token in line.split()
+        )
+    try:
+        return bytes(int(token, 16) for token in tokens)
+    except ValueError:
+        logger.error(
+            ValueError(f"Invalid hex text: Expected hex bytes got '{text[:40]}'")
+        )
+        return None
+
+
+def read_memory_file(filename: str) -> Optional[bytes]:
+    """
+    Read a binary or hex text memory file into bytes
+    Returns: bytes/None: None (and the error logged) for a missing or invalid file
+    """
+    if not os.path.exists(filename):
+        logger.error(f"No file named {filename} found.")
+        return None
+    if is_hex_text_file(filename):
+        with open(filename, "r") as rf:
+            return process_hex_text(rf.read())
+    with open(filename, "rb") as rf:
+        return rf.read()
+
+
+def write_memory_file(filename: str, data: bytes) -> None:
+    """
+    Write bytes to a binary or hex text (16 bytes per line) memory file
+    """
+    if not is_hex_text_file(filename):
+        with open(filename, "wb") as wf:
+            wf.write(data)
+        return
+    with open(filename, "w") as wf:
+        for offset in range(0, len(data), 16):
+            wf.write(data[offset : offset + 16].hex(" ").upper() + "\n")
+
+
+def is_repl_command(command: str) -> bool:
+    """
+    Determine if a line is a special repl command rather than an 8085 instruction
+    """
+    command = command.strip()
+    return command in REPL_LINES or command.split()[0] in REPL_PREFIXES
+
+
 def is_label(token: str) -> bool:
     """
     Determine if a token is a label or not
@@ -136,10 +244,43 @@ def process_cmd_line_args(args: tuple, logger) -> tuple:
         level = args[1]
         log_level = LOG_LEVEL_SHORT_FORM.get(level, log_level)
         args = args[2:]
+    watchdog = None
+    if len(args) > 1 and args[0] == "-w":
+        watchdog = process_limits(args[1])
+        if watchdog is None:
+            print(f"Invalid limits '{args[1]}': Use \"-h\" option for help")
+            exit(1)
+        args = args[2:]
+    trace_file = ""
+    if len(args) > 1 and args[0] == "-t":
+        trace_file = args[1]
+        args = args[2:]
+    # Imported here, diagnostics builds on the command model which imports this module
+    from diagnostics import parse_log_spec, start_diagnostics
+
+    log_spec = None
+    if len(args) > 1 and args[0] == "-l":
+        log_spec = parse_log_spec(args[1])
+        if log_spec is None:
+            print(f"Invalid log spec '{args[1]}': Use \"-h\" option for help")
+            exit(1)
+        args = args[2:]
+    history = None
+    if len(args) > 1 and args[0] == "-H":
+        if not args[1].isdigit() or int(args[1]) < 1:
+            print(f"Invalid history limit '{args[1]}': Use \"-h\" option for help")
+            exit(1)
+        history = History(int(args[1]))
+        args = args[2:]
 
     logger.remove()
     logger.add(sys.stderr, level=log_level, format=HANDLER_FORMAT)
-    logger.add("debug.log", level="DEBUG", rotation="1 MB")
+    sampler = None
+    if log_spec is None:
+        logger.add("debug.log", level="DEBUG", rotation="1 MB")
+    else:
+        # The queued JSON log takes the place of debug.log
+        sampler = start_diagnostics(log_spec)
 
     logger.debug(f"Got cmd args {args}")
     commands, file_db = tuple(), ""
@@ -151,9 +292,21 @@ def process_cmd_line_args(args: tuple, logger) -> tuple:
         file_db = filename
         args = args[2:]
     if len(args) > 1 and args[0] == "-f":
-        commands = process_file_mode_args(args[1])
+        # Imported here, the cache decodes with the interpreter which imports this module
+        from program_cache import load_program
+
+        commands = load_program(args[1], process_file_mode_args(args[1]))
         args = args[2:]
     if len(args) > 1 and args[0] == "-c":
         commands = process_c_mode_args(args[1:])
         args = args[2:]
-    return (args, commands, file_db, indirect_mode)
+    return (
+        args,
+        commands,
+        file_db,
+        indirect_mode,
+        watchdog,
+        trace_file,
+        sampler,
+        history,
+    )
@@ -1,4 +1,12 @@
 from collections import UserDict
+from collections.abc import MutableMapping
+from typing import Callable, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+# Page table handlers: read(address) -> byte, write(address, byte)
+ReadHandler = Callable[[int], int]
+WriteHandler = Callable[[int, int], None]
 
 
 class RegisterDict(UserDict):
@@ -27,22 +35,171 @@ class RegisterDict(UserDict):
             self[key] = other[key]
 
 
-class MemoryDict(UserDict):
+class MemoryDict(MutableMapping):
+    """
+    The 64 KiB address space stored in one contiguous bytearray.
+
+    It still behaves like a dict of hex strings ('0x2050' -> '0x0a') for the rest of the code.
+    buffer  : The raw bytes of memory, bulk loads and dumps are plain slice operations on it.
+    written : Addresses that have been written, in the order they were first written.
+              Only these are reported as keys (inspect, save), untouched memory reads as missing.
+    last_write : Address of the latest single byte write, the trace recorder resets it per step.
+    page_versions : Per 256 byte page, the version current at its latest write.
+              dirty.mark() bumps version, so pages written since a marker are the ones >= its version.
+    read_handlers, write_handlers : The page table, per 256 byte page the function reads/writes
+              of its addresses go to (ROM, device windows, unmapped, see memory_map.py).
+              None is plain RAM in buffer, with nothing mapped (mapped_pages 0) RAM is one check.
+    """
+
+    SIZE = 0x10000
+    PAGE_SHIFT = 8
+    PAGES = SIZE >> PAGE_SHIFT
+
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+        self.buffer: bytearray = bytearray(self.SIZE)
+        self.written: Dict[int, None] = {}
+        self.last_write: int = -1
+        self.version: int = 0
+        self.page_versions: List[int] = [0] * (self.SIZE >> self.PAGE_SHIFT)
+        self.read_handlers: List[Optional[ReadHandler]] = [None] * self.PAGES
+        self.write_handlers: List[Optional[WriteHandler]] = [None] * self.PAGES
+        self.page_kinds: List[str] = ["ram"] * self.PAGES
+        self.mapped_pages: int = 0
         self.update(*args, **kwargs)
 
+    def read_byte(self, address: int) -> Optional[int]:
+        """
+        The byte at address, None if it was never written.
+        An address past FFFF is logged as an error and reads 0.
+        """
+        if not 0 <= address < self.SIZE:
+            logger.error(f"Invalid address 0x{address:x}: Memory ends at 0xffff")
+            return 0
+        if self.mapped_pages:
+            read = self.read_handlers[address >> self.PAGE_SHIFT]
+            if read is not None:
+                return read(address)
+        if address not in self.written:
+            return None
+        return self.buffer[address]
+
+    def write_byte(self, address: int, value: int) -> None:
+        """
+        Store a byte, a write past FFFF is logged as an error and dropped.
+        A value above FF (registers aren't wrapped) keeps its low byte, with a warning.
+        """
+        if not (0 <= address < self.SIZE and 0 <= value <= 0xFF):
+            if not 0 <= address < self.SIZE:
+                logger.error(f"Invalid address 0x{address:x}: Memory ends at 0xffff")
+                return
+            logger.warning(
+                f"Value 0x{value:x} doesn't fit a byte: Storing 0x{value & 0xFF:02x} at 0x{address:04x}"
+            )
+            value &= 0xFF
+        if self.mapped_pages:
+            write = self.write_handlers[address >> self.PAGE_SHIFT]
+            if write is not None:
+                write(address, value)
+                return
+        self.buffer[address] = value
+        self.written[address] = None
+        self.last_write = address
+        self.page_versions[address >> self.PAGE_SHIFT] = self.version
+
     def __setitem__(self, key: str, value: str):
-        key = f"0x{int(key, 16):04x}"
-        value = f"0x{int(value, 16):02x}"
-        super().__setitem__(key, value)
+        self.write_byte(int(key, 16), int(value, 16))
 
     def __getitem__(self, key: str):
-        return super().__getitem__(key)
+        value = self.read_byte(int(key, 16))
+        if value is None:
+            raise KeyError(key)
+        return f"0x{value:02x}"
 
-    def update(self, *args, **kwargs):
-        if len(args) > 1:
-            raise TypeError("update expected at most 1 arguments, got %d" % len(args))
-        other = dict(*args, **kwargs)
-        for key in other:
-            self[key] = other[key]
+    def __delitem__(self, key: str):
+        address = int(key, 16)
+        del self.written[address]
+        self.buffer[address] = 0
+        self.page_versions[address >> self.PAGE_SHIFT] = self.version
+
+    def __iter__(self) -> Iterator[str]:
+        for address in self.written:
+            yield f"0x{address:04x}"
+
+    def __len__(self) -> int:
+        return len(self.written)
+
+    def __contains__(self, key) -> bool:
+        return int(key, 16) in self.written
+
+    def load(self, address: int, data: bytes) -> None:
+        """
+        Copy a block of bytes into memory starting at address in one slice assignment
+        """
+        end = address + len(data)
+        if address < 0 or end > self.SIZE:
+            raise IndexError(
+                f"Block of {len(data)} bytes at 0x{address:04x} exceeds the address space"
+            )
+        self.buffer[address:end] = data
+        self.written.update(dict.fromkeys(range(address, end)))
+        if data:
+            first, last = address >> self.PAGE_SHIFT, (end - 1) >> self.PAGE_SHIFT
+            self.page_versions[first : last + 1] = [self.version] * (last - first + 1)
+
+    def map_pages(
+        self,
+        address: int,
+        size: int,
+        read: Optional[ReadHandler] = None,
+        write: Optional[WriteHandler] = None,
+        kind: str = "ram",
+    ) -> None:
+        """
+        Send the reads/writes of the whole pages in address..address+size to the handlers,
+        no handler leaves that access to RAM
+        """
+        page_size = 1 << self.PAGE_SHIFT
+        if address % page_size or size % page_size or size <= 0:
+            raise ValueError(
+                f"Mapping 0x{address:04x}+0x{size:x} isn't whole {page_size} byte pages"
+            )
+        if address + size > self.SIZE:
+            raise IndexError(
+                f"Mapping of {size} bytes at 0x{address:04x} exceeds the address space"
+            )
+        for page in range(
+            address >> self.PAGE_SHIFT, (address + size) >> self.PAGE_SHIFT
+        ):
+            self.read_handlers[page] = read
+            self.write_handlers[page] = write
+            self.page_kinds[page] = kind
+        self.mapped_pages = sum(kind != "ram" for kind in self.page_kinds)
+
+    def is_mapped(self, address: int) -> bool:
+        """
+        Whether address is on a page that isn't plain RAM
+        """
+        return (
+            bool(self.mapped_pages)
+            and self.page_kinds[address >> self.PAGE_SHIFT] != "ram"
+        )
+
+    def take_map(self, other: "MemoryDict") -> None:
+        """
+        Use the page table of other memory (when a restore replaces the memory)
+        """
+        self.read_handlers = other.read_handlers
+        self.write_handlers = other.write_handlers
+        self.page_kinds = other.page_kinds
+        self.mapped_pages = other.mapped_pages
+
+    def dump(self, address: int, length: int) -> bytes:
+        """
+        Copy length bytes of memory starting at address, untouched memory reads as 0
+        """
+        end = address + length
+        if address < 0 or length < 0 or end > self.SIZE:
+            raise IndexError(
+                f"Block of {length} bytes at 0x{address:04x} exceeds the address space"
+            )
+        return bytes(self.buffer[address:end])
@@ -0,0 +1,243 @@
+"""
+Warm simulator daemon: the modules imported once, command lines run by pre-forked workers.
+
+Every 'python main.py -db file -c "..."' pays python's startup and the imports (rich,
+loguru) before the first instruction, the org babel workflow does it for every block.
+The daemon imports everything, listens on a Unix socket and keeps a pool of forked
+workers waiting on it. A worker takes one client's (client.py) stdin, stdout and stderr,
+directory and environment, runs its command line like main.py and sends back the exit
+code, then exits and the daemon forks a fresh one in its place. Each run starts from a
+clean copy of the warm process, -db sessions are restored from their files as usual.
+
+python daemon.py [--socket PATH] [--workers N]
+python client.py -db /tmp/state.json -c "MVI A 05H;inspect"
+"""
+import os
+import sys
+import json
+import array
+import atexit
+import select
+import signal
+import socket
+import argparse
+import traceback
+from typing import List, Set, Tuple
+
+from client import socket_directory, socket_path, private_directory
+
+# Workers waiting for a client
+WORKERS = 2
+BACKLOG = 64
+# File descriptors a client hands over: stdin, stdout, stderr
+STREAMS = 3
+# Seconds between two checks of an idle worker that the daemon is still there
+PARENT_CHECK = 1.0
+
+
+def warm_up() -> None:
+    """
+    Import what any command line can need, including the modules imported on first use
+    """
+    import main  # noqa: F401
+    import session  # noqa: F401
+    import diagnostics  # noqa: F401
+    import program_cache  # noqa: F401
+    import rich.console  # noqa: F401
+
+
+def receive_request(conn: socket.socket) -> Tuple[dict, List[int]]:
+    """
+    The client's JSON line and the file descriptors that came with it
+    """
+    fds = array.array("i")
+    pending = bytearray()
+    while b"\n" not in pending:
+        data, ancillary, _, _ = conn.recvmsg(
+            4096, socket.CMSG_LEN(STREAMS * fds.itemsize)
+        )
+        if not data:
+            raise ConnectionError("Client closed the connection")
+        pending += data
+        for level, kind, payload in ancillary:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                usable = len(payload) - len(payload) % fds.itemsize
+                fds.frombytes(payload[:usable])
+    line, _, _ = bytes(pending).partition(b"\n")
+    return json.loads(line), list(fds)
+
+
+def run_command_line(args: List[str]) -> int:
+    """
+    main.py's command line in this process, Returns: its exit code
+    """
+    import main
+
+    sys.argv = ["main.py"] + args
+    try:
+        main.cli(tuple(args))
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        traceback.print_exc()
+        return 130
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def accept(listener: socket.socket, daemon: int) -> socket.socket:
+    """
+    The next client, the worker exits when the daemon is gone (killed) or interrupted.
+    The listener is non blocking, another worker may take the client first.
+    """
+    try:
+        while True:
+            ready, _, _ = select.select([listener], [], [], PARENT_CHECK)
+            if os.getppid() != daemon:
+                os._exit(0)
+            if not ready:
+                continue
+            try:
+                conn, _ = listener.accept()
+            except BlockingIOError:
+                continue
+            conn.setblocking(True)
+            return conn
+    except KeyboardInterrupt:
+        os._exit(0)
+
+
+def serve_client(listener: socket.socket, daemon: int) -> None:
+    """
+    Worker: wait for a client, run its command line on its streams and exit
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    conn = accept(listener, daemon)
+    listener.close()
+    try:
+        request, fds = receive_request(conn)
+    except ConnectionError:
+        # A client gone before asking anything (the probe of a starting daemon)
+        os._exit(0)
+    except ValueError as e:
+        print(f"Invalid request: {e}", file=sys.stderr)
+        os._exit(1)
+    if len(fds) != STREAMS:
+        print(
+            f"Invalid request: {len(fds)} streams instead of {STREAMS}", file=sys.stderr
+        )
+        os._exit(1)
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    for stream in (sys.stdout, sys.stderr):
+        stream.reconfigure(line_buffering=stream.isatty())
+    os.environ.clear()
+    os.environ.update(request["env"])
+    code = 1
+    try:
+        os.chdir(request["cwd"])
+        conn.sendall(json.dumps({"pid": os.getpid()}).encode() + b"\n")
+        code = run_command_line(request["args"])
+    except OSError as e:
+        print(e, file=sys.stderr)
+    finally:
+        # What main.py's exit would do: exit handlers (diagnostics log), flushed streams
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            conn.sendall(json.dumps({"exit": code}).encode() + b"\n")
+        except OSError:
+            pass
+        os._exit(code)
+
+
+def spawn(listener: socket.socket) -> int:
+    daemon = os.getpid()
+    pid = os.fork()
+    if pid == 0:
+        serve_client(listener, daemon)
+    return pid
+
+
+def listen(path: str) -> socket.socket:
+    """
+    Listening socket at path, a stale one left by a daemon that died is replaced.
+    The default one is in a directory only this user can enter.
+    """
+    if os.path.dirname(path) == socket_directory():
+        private_directory(socket_directory())
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+        else:
+            # A worker of the running daemon took the probe, it gets no request
+            probe.close()
+            raise OSError(f"A daemon is already listening on '{path}'")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Created with mode 0600, not opened to everyone until a chmod
+    umask = os.umask(0o177)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(umask)
+    listener.listen(BACKLOG)
+    listener.setblocking(False)
+    return listener
+
+
+def serve(path: str, workers: int = WORKERS) -> None:
+    """
+    Keep workers forked workers waiting on the socket at path until interrupted
+    """
+    listener = listen(path)
+    warm_up()
+    pool: Set[int] = set()
+    # SIGTERM stops the daemon like Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"Listening on {path} with {workers} workers", file=sys.stderr)
+    try:
+        for _ in range(workers):
+            pool.add(spawn(listener))
+        while True:
+            pid, _ = os.wait()
+            if pid in pool:
+                pool.discard(pid)
+                pool.add(spawn(listener))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in pool:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        listener.close()
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Warm 8085 simulator daemon, run command lines with client.py"
+    )
+    parser.add_argument("--socket", default=socket_path(), help="Unix socket path")
+    parser.add_argument(
+        "--workers", type=int, default=WORKERS, help="Workers waiting for clients"
+    )
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("At least one worker")
+    try:
+        serve(args.socket, args.workers)
+    except OSError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -1,6 +1,11 @@
 """
 Dict of supported COMMAND, description, related function and parameters.
+
+cycles        : T-states the instruction takes
+cycles_memory : T-states when an operand is the M register (memory access)
+cycles_taken  : T-states of a conditional jump when the jump is taken
 """
+import sys
 
 # List of 8085 Registers
 REGISTERS = (
@@ -24,6 +29,8 @@ COMMANDS = {
     "MOV": {
         "description": "Move data from one register to another",
         "function": "move",
+        "cycles": 4,
+        "cycles_memory": 7,
         "parameters": {
             "source": REGISTERS,
             "destination": REGISTERS,
@@ -32,6 +39,8 @@ COMMANDS = {
     "MVI": {
         "description": "Move to immediate",
         "function": "move_to_immediate",
+        "cycles": 7,
+        "cycles_memory": 10,
         "parameters": {
             "register": REGISTERS,
             "value": "byte",
@@ -40,6 +49,8 @@ COMMANDS = {
     "INR": {
         "description": "Increment Register",
         "function": "increment_register",
+        "cycles": 4,
+        "cycles_memory": 10,
         "parameters": {
             "register": REGISTERS,
         },
@@ -47,6 +58,8 @@ COMMANDS = {
     "DCR": {
         "description": "Decrement Register",
         "function": "decrement_register",
+        "cycles": 4,
+        "cycles_memory": 10,
         "parameters": {
             "register": REGISTERS,
         },
@@ -54,6 +67,7 @@ COMMANDS = {
     "LXI": {
         "description": "Load register pair immediate",
         "function": "load_register_pair_immediate",
+        "cycles": 10,
         "parameters": {
             "register_pair": REGISTER_PAIRS,
             "address": "word",
@@ -62,6 +76,7 @@ COMMANDS = {
     "LDA": {
         "description": "Load accumulator",
         "function": "load_accumulator",
+        "cycles": 13,
         "parameters": {
             "address": "word",
         },
@@ -69,6 +84,7 @@ COMMANDS = {
     "STA": {
         "description": "Store accumulator",
         "function": "store_accumulator",
+        "cycles": 13,
         "parameters": {
             "address": "word",
         },
@@ -76,11 +92,14 @@ COMMANDS = {
     "HLT": {
         "description": "Halt",
         "function": "halt",
+        "cycles": 5,
         "parameters": {},
     },
     "ADD": {
         "description": "Add",
         "function": "add",
+        "cycles": 4,
+        "cycles_memory": 7,
         "parameters": {
             "register": REGISTERS,
         },
@@ -88,6 +107,8 @@ COMMANDS = {
     "SUB": {
         "description": "Subtract",
         "function": "subtract",
+        "cycles": 4,
+        "cycles_memory": 7,
         "parameters": {
             "register": REGISTERS,
         },
@@ -95,6 +116,7 @@ COMMANDS = {
     "ADI": {
         "description": "Add Immediate",
         "function": "add_immediate",
+        "cycles": 7,
         "parameters": {
             "value": "byte",
         },
@@ -102,6 +124,7 @@ COMMANDS = {
     "SUI": {
         "description": "Subtract Immediate",
         "function": "subtract_immediate",
+        "cycles": 7,
         "parameters": {
             "value": "byte",
         },
@@ -109,6 +132,8 @@ COMMANDS = {
     "CMP": {
         "description": "Compare",
         "function": "compare",
+        "cycles": 4,
+        "cycles_memory": 7,
         "parameters": {
             "register": REGISTERS,
         },
@@ -116,6 +141,7 @@ COMMANDS = {
     "CPI": {
         "description": "Compare Immediate",
         "function": "compare_immediate",
+        "cycles": 7,
         "parameters": {
             "value": "byte",
         },
@@ -123,6 +149,7 @@ COMMANDS = {
     "ANI": {
         "description": "And Immediate with Accumulator",
         "function": "and_immediate",
+        "cycles": 7,
         "parameters": {
             "value": "byte",
         },
@@ -130,6 +157,7 @@ COMMANDS = {
     "ORI": {
         "description": "OR Immediate with Accumulator",
         "function": "or_immediate",
+        "cycles": 7,
         "parameters": {
             "value": "byte",
         },
@@ -137,55 +165,140 @@ COMMANDS = {
     "RRC": {
         "description": "Rotate Right Accumulator",
         "function": "rotate_right_accumulator",
+        "cycles": 4,
         "parameters": {},
     },
     "LDAX": {
         "description": "Load accumulator from register pair",
         "function": "load_accumulator_from_register_pair",
+        "cycles": 7,
         "parameters": {"register_pair": {k: REGISTER_PAIRS[k] for k in ("B", "D")}},
     },
     "STAX": {
         "description": "Store accumulator to register pair",
         "function": "store_accumulator_to_register_pair",
+        "cycles": 7,
         "parameters": {"register_pair": {k: REGISTER_PAIRS[k] for k in ("B", "D")}},
     },
     "INX": {
         "description": "Incremented xtended register pairs",
         "function": "increment_extended_register",
+        "cycles": 6,
         "parameters": {"register_pair": REGISTER_PAIRS},
     },
     "DCX": {
         "description": "Decrement xtended register pairs",
         "function": "decrement_extended_register",
+        "cycles": 6,
         "parameters": {"register_pair": REGISTER_PAIRS},
     },
     "JZ": {
         "description": "Jump If Zero",
         "function": "jump_if_zero",
+        "cycles": 7,
+        "cycles_taken": 10,
         "parameters": {"word": "label"},
     },
     "JNZ": {
         "description": "Jump If Not Zero",
         "function": "jump_if_not_zero",
+        "cycles": 7,
+        "cycles_taken": 10,
         "parameters": {"word": "label"},
     },
     "JC": {
         "description": "Jump If Carry",
         "function": "jump_if_carry",
+        "cycles": 7,
+        "cycles_taken": 10,
         "parameters": {"word": "label"},
     },
     "JNC": {
         "description": "Jump If Not Carry",
         "function": "jump_if_not_carry",
+        "cycles": 7,
+        "cycles_taken": 10,
         "parameters": {"word": "label"},
     },
     "OUT": {
         "description": "Out",
         "function": "out",
+        "cycles": 10,
+        "parameters": {"word": "display_port"},
+    },
+    "IN": {
+        "description": "In, load accumulator from port",
+        "function": "input_port",
+        "cycles": 10,
         "parameters": {"word": "display_port"},
     },
+    "EI": {
+        "description": "Enable Interrupts",
+        "function": "enable_interrupts",
+        "cycles": 4,
+        "parameters": {},
+    },
+    "DI": {
+        "description": "Disable Interrupts",
+        "function": "disable_interrupts",
+        "cycles": 4,
+        "parameters": {},
+    },
+    "SIM": {
+        "description": "Set Interrupt Mask from accumulator",
+        "function": "set_interrupt_mask",
+        "cycles": 4,
+        "parameters": {},
+    },
+    "RET": {
+        "description": "Return from interrupt service routine",
+        "function": "return_from_interrupt",
+        "cycles": 10,
+        "parameters": {},
+    },
+}
+
+# Interrupts in priority order, their service routines are the labels of the same name
+INTERRUPTS = ("TRAP", "RST7.5", "RST6.5", "RST5.5")
+
+# T-states taken by the processor to acknowledge an interrupt (push return address, vector)
+INTERRUPT_ACK_CYCLES = 12
+
+# Special repl commands, these are not 8085 instructions
+REPL_COMMANDS = {
+    "help": "Display this message",
+    "inspect": "Display the registers, memory and flags",
+    "quit": "Exit the interpreter",
+    "load": "load <FILENAME> <ADDRESS> : Load a binary/hex text file into memory at address",
+    "dump": "dump <FILENAME> <ADDRESS> <LENGTH> : Dump a memory range to a binary/hex text file",
+    "diff": "Display the registers, flags and memory changed since the previous diff",
+    "profile": "profile on/off : Count executions, T-states and jumps taken per line, 'profile' shows the annotated listing",
+    "heatmap": "heatmap on/off : Count memory reads/writes per address, 'heatmap' reports, 'heatmap csv/grid <FILENAME>' exports",
+    "run": "run / run <N> : Run the program entered so far at full speed (or N commands) and print a summary",
+    "until": "until <LABEL> : Run at full speed until reaching the label and print a summary",
+    "port": "port <PORT> <DEVICE> : Attach ring, console, stdin or a <FILENAME> sink to a port (off detaches), 'port <PORT>' shows a ring",
 }
 
+# Simulator version, part of the key of the compiled program cache (program_cache.py)
+VERSION = "0.1.0"
+# Python that wrote a marshal file (program cache, session image), marshal can differ
+# between versions and implementations
+MARSHAL_TAG = sys.implementation.cache_tag or (
+    f"{sys.implementation.name}-{sys.version_info[0]}{sys.version_info[1]}"
+)
+# Decoded -f programs are cached in a directory of this name next to the source file
+PROGRAM_CACHE_DIR = "__8085cache__"
+
+# Lines the REPL handles itself (main.process_command): whole lines, then first words
+REPL_LINES = ("help", "quit", "inspect", "diff")
+REPL_PREFIXES = ("load", "dump", "port", "profile", "heatmap", "run", "until")
+
+# A -db file with this extension holds the whole session (program included), see session.py
+SESSION_IMAGE_EXTENSION = ".img"
+
+# Memory files with these extensions are read and written as hex text, others as raw binary
+HEX_TEXT_EXTENSIONS = (".hex", ".txt")
+
 HANDLER_FORMAT = (
     "<cyan>{name: >10}</cyan>: |"
     "<level>{level: <8}</level> | "
@@ -0,0 +1,196 @@
+"""
+Diagnostics for production runs: structured JSON log records written by a background
+thread, and sampled per instruction records instead of a debug line for every one.
+
+The interpreter only puts dicts on a queue, the writer thread turns them into JSON
+lines. Instruction records are sampled (one in every N, jumps taken, flag changes),
+simulator log records pass the per module levels, so the DEBUG chatter of the
+instruction loop never gets made.
+
+-l debug.json:every=1000,jumps,flags,level=INFO,interpreter=DEBUG
+"""
+import os
+import json
+import queue
+import atexit
+import threading
+from typing import Dict, Optional, TextIO, Tuple
+
+from loguru import logger
+
+from command_model import Command
+from state_model import State
+
+LEVELS = ("TRACE", "DEBUG", "INFO", "SUCCESS", "WARNING", "ERROR", "CRITICAL")
+# Simulator log records below this level are dropped unless a module level says otherwise
+DEFAULT_LEVEL = "INFO"
+
+
+class QueuedJsonWriter:
+    """
+    Writes records (dicts) as JSON lines to a file from a background thread
+    """
+
+    def __init__(self, filename: str):
+        self.file: TextIO = open(filename, "a")
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+        self.closed = False
+
+    def write(self, record: dict) -> None:
+        self.queue.put(record)
+
+    def sink(self, message) -> None:
+        """
+        loguru sink, the record's fields are copied here and serialized in the thread
+        """
+        record = message.record
+        self.queue.put(
+            {
+                "time": record["time"].timestamp(),
+                "level": record["level"].name,
+                "module": record["name"],
+                "function": record["function"],
+                "line": record["line"],
+                "message": record["message"],
+                **record["extra"],
+            }
+        )
+
+    def drain(self) -> None:
+        file = self.file
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            file.write(json.dumps(record, default=str) + "\n")
+            # Write out what has piled up before waiting on the queue again
+            if self.queue.empty():
+                file.flush()
+        file.flush()
+
+    def close(self) -> None:
+        """
+        Write out the queued records and close the file
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+
+class Sampler:
+    """
+    Picks the instructions that get a record: every Nth one, jumps taken, flag changes
+    """
+
+    def __init__(
+        self,
+        writer: QueuedJsonWriter,
+        every: int = 0,
+        jumps: bool = False,
+        flags: bool = False,
+    ):
+        self.writer = writer
+        self.every = every
+        self.jumps = jumps
+        self.flags = flags
+        self.steps = 0
+        self.last_flags: Optional[tuple] = None
+
+    def record(self, index: int, command: Command, jumped: bool, state: State) -> None:
+        """
+        Called after each evaluated command, jumped: a jump was taken
+        """
+        self.steps += 1
+        reason = ""
+        if self.every and self.steps % self.every == 0:
+            reason = "sample"
+        elif self.jumps and jumped:
+            reason = "jump"
+        if self.flags:
+            flags = tuple(state.flags.values())
+            if flags != self.last_flags:
+                if self.last_flags is not None and not reason:
+                    reason = "flags"
+                self.last_flags = flags
+        if not reason:
+            return
+        self.writer.write(
+            {
+                "step": self.steps,
+                "reason": reason,
+                "index": index,
+                "command": str(command),
+                "cycles": state.cycles,
+                "registers": dict(state.registers.data),
+                "flags": dict(state.flags),
+            }
+        )
+
+
+class LogSpec:
+    """
+    Parsed -l FILE[:OPTION,...] option, options: every=N, jumps, flags,
+    level=LEVEL (all modules) and MODULE=LEVEL
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.every = 0
+        self.jumps = False
+        self.flags = False
+        self.levels: Dict[str, str] = {"": DEFAULT_LEVEL}
+
+
+def split_spec(spec: str) -> Tuple[str, str]:
+    """
+    'path:options' -> (path, options), split at the last colon so a Windows drive stays in
+    the path ('C:\\logs\\d.json'). A tail with a path separator is part of the path.
+    """
+    path, colon, options = spec.rpartition(":")
+    drive, _ = os.path.splitdrive(spec)
+    if not colon or len(path) < len(drive) or "/" in options or "\\" in options:
+        return spec, ""
+    return path, options
+
+
+def parse_log_spec(spec: str) -> Optional[LogSpec]:
+    """
+    Returns: LogSpec/None: None (and the error logged) for an invalid spec
+    """
+    filename, options = split_spec(spec)
+    if not filename:
+        logger.error(f"Invalid log spec '{spec}': No file name")
+        return None
+    log_spec = LogSpec(filename)
+    for option in filter(None, options.split(",")):
+        name, _, value = option.partition("=")
+        if option in ("jumps", "flags"):
+            setattr(log_spec, option, True)
+        elif name == "every" and value.isdigit():
+            log_spec.every = int(value)
+        elif value.upper() in LEVELS:
+            log_spec.levels["" if name == "level" else name] = value.upper()
+        else:
+            logger.error(f"Invalid log spec option '{option}'")
+            return None
+    return log_spec
+
+
+def start_diagnostics(log_spec: LogSpec) -> Sampler:
+    """
+    Add the queued JSON sink for the simulator's log records, Returns: the instruction sampler
+    """
+    writer = QueuedJsonWriter(log_spec.filename)
+    atexit.register(writer.close)
+    levels = log_spec.levels
+    logger.add(
+        writer.sink,
+        level=min(levels.values(), key=LEVELS.index),
+        filter=levels,
+    )
+    return Sampler(writer, log_spec.every, log_spec.jumps, log_spec.flags)
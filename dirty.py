@@ -0,0 +1,116 @@
+"""
+What changed in a State: since a marker, or between two machine.snapshot() dicts.
+
+Memory pages remember the version they were last written at (MemoryDict.page_versions),
+so a diff only compares the pages written since the marker. The 8 registers and 4 flags
+are cheaper to compare than to track.
+
+marker = mark(state)
+... run ...
+changes = changes_since(state, marker)   # {"registers": {"A": (0, 5)}, "memory": {0x2050: (None, 5)} ...}
+"""
+from typing import Dict, Optional, Tuple
+
+from data import REGISTERS
+from state_model import State
+from custom_dictionaries import MemoryDict
+
+# name/address -> (old value, new value), None for memory that wasn't written
+Changes = Dict[str, Dict]
+
+
+class Marker:
+    """
+    Registers and flags at the mark, plus a copy of memory to diff the dirty pages against
+    """
+
+    __slots__ = ("registers", "flags", "memory", "buffer", "written", "version")
+
+    def __init__(self, state: State):
+        memory = state.memory
+        memory.version += 1
+        self.version = memory.version
+        self.memory = memory
+        self.registers = {reg: int(state.registers[reg], 16) for reg in REGISTERS}
+        self.flags = dict(state.flags)
+        self.buffer = bytes(memory.buffer)
+        self.written = set(memory.written)
+
+
+def mark(state: State) -> Marker:
+    return Marker(state)
+
+
+def changes_since(state: State, marker: Marker) -> Changes:
+    memory = state.memory
+    registers = {}
+    for reg, old in marker.registers.items():
+        new = int(state.registers[reg], 16)
+        if new != old:
+            registers[reg] = (old, new)
+    flags = {
+        flag: (old, state.flags[flag])
+        for flag, old in marker.flags.items()
+        if state.flags[flag] != old
+    }
+
+    if memory is marker.memory:
+        pages = [
+            page
+            for page, version in enumerate(memory.page_versions)
+            if version >= marker.version
+        ]
+    else:
+        # The memory was replaced (restored from a file db), compare every page
+        pages = range(MemoryDict.SIZE >> MemoryDict.PAGE_SHIFT)
+    # Addresses written (or deleted) since the mark, plus the bytes that differ on the pages
+    addresses = memory.written.keys() ^ marker.written
+    page_size = 1 << MemoryDict.PAGE_SHIFT
+    for page in pages:
+        start = page << MemoryDict.PAGE_SHIFT
+        end = start + page_size
+        if memory.buffer[start:end] != marker.buffer[start:end]:
+            addresses.update(
+                address
+                for address in range(start, end)
+                if memory.buffer[address] != marker.buffer[address]
+            )
+    changed_memory: Dict[int, Tuple[Optional[int], Optional[int]]] = {}
+    for address in sorted(addresses):
+        old = marker.buffer[address] if address in marker.written else None
+        new = memory.buffer[address] if address in memory.written else None
+        if old != new:
+            changed_memory[address] = (old, new)
+    return {"registers": registers, "flags": flags, "memory": changed_memory}
+
+
+def diff_snapshots(first: dict, second: dict) -> Changes:
+    """
+    Changes from the first machine.snapshot() to the second
+    """
+    changes: Changes = {"registers": {}, "flags": {}, "memory": {}}
+    for kind in ("registers", "flags"):
+        for name, old in first[kind].items():
+            if second[kind][name] != old:
+                changes[kind][name] = (old, second[kind][name])
+    for address in sorted(set(first["memory"]) | set(second["memory"])):
+        old, new = first["memory"].get(address), second["memory"].get(address)
+        if old != new:
+            changes["memory"][address] = (old, new)
+    return changes
+
+
+def format_changes(changes: Changes) -> str:
+    """
+    One line per change: 'A: 00H -> 05H', 'zero: 0 -> 1', '2050H: -- -> 05H'
+    """
+    lines = []
+    for reg, (old, new) in changes["registers"].items():
+        lines.append(f"{reg}: {old:02X}H -> {new:02X}H")
+    for flag, (old, new) in changes["flags"].items():
+        lines.append(f"{flag}: {int(old)} -> {int(new)}")
+    for address, (old, new) in changes["memory"].items():
+        old_text = "--" if old is None else f"{old:02X}H"
+        new_text = "--" if new is None else f"{new:02X}H"
+        lines.append(f"{address:04X}H: {old_text} -> {new_text}")
+    return "\n".join(lines) if lines else "No changes"
@@ -0,0 +1,269 @@
+"""
+Peephole fusion of the loop idioms lab programs are made of. A pass over the commands finds
+loops ending in a 'DCR r' / 'JNZ head' countdown whose body is one of:
+
+countdown : nothing else                             L: DCR C / JNZ L
+fill      : MOV M,r or MVI M,x then INX H            L: MOV M A / INX H / DCR C / JNZ L
+copy      : a load (LDAX rp, MOV A,M), a store (STAX rp, MOV M,A) and INX of both pairs
+            L: LDAX B / STAX D / INX B / INX D / DCR C / JNZ L
+
+At full speed (no trace output, tracer, profiler, heatmap or sampler) the interpreter runs
+iterations of such a loop as one bulk operation (a slice fill or copy) instead of stepping
+them, with the registers, flags, memory, T-states and counters ending up exactly as stepping
+would leave them. Whenever that can't be shown from the current state (mapped memory,
+registers above FF, a counter at 0, an address past FFFF) the loop is stepped as usual.
+"""
+from typing import Dict, List, Optional
+
+from command_model import Command
+from data import REGISTER_PAIRS
+from state_model import State
+
+
+class FusedLoop:
+    """
+    A loop from head (the labelled command) to the closing JNZ, counting down counter.
+    size: Commands per iteration. cycles_taken: T-states of an iteration that jumps back,
+    cycles_exit: of the last one, falling through the JNZ.
+    """
+
+    kind = "countdown"
+
+    def __init__(self, head: int, commands: List[Command]):
+        self.head = head
+        self.size = len(commands)
+        self.label = commands[0].label
+        self.counter = commands[-2].operands[0]
+        self.cycles_taken = sum(command.cycles_taken for command in commands)
+        self.cycles_exit = self.cycles_taken - commands[-1].cycles_taken
+        self.cycles_exit += commands[-1].cycles
+
+    def iterations(self, state: State) -> int:
+        """
+        Iterations left when entering the head with this state, 0 if they can't be fused
+        """
+        # DCR of 0 gives 1 (with carry and sign), that loop isn't worth fusing
+        return int(state.registers.data[self.counter], 16)
+
+    def execute(self, state: State, iterations: int, remaining: int) -> None:
+        """
+        Apply the effect of the next iterations, of the remaining ones
+        """
+        registers = state.registers.data
+        counter = int(registers[self.counter], 16) - iterations
+        registers[self.counter] = f"0x{counter:02x}"
+        state.flags.update(carry=False, sign=False, zero=iterations == remaining)
+
+    def __str__(self):
+        return f"{self.kind} loop {self.label} ({self.size} commands)"
+
+
+class FillLoop(FusedLoop):
+    """
+    MOV M,r / MVI M,x, INX H: store one value at HL, HL+1, ...
+    """
+
+    kind = "fill"
+
+    def __init__(self, head: int, commands: List[Command]):
+        super().__init__(head, commands)
+        store = commands[0]
+        # Register the value comes from, None for MVI
+        self.source: Optional[str] = None
+        self.value = 0
+        if store.name == "MOV":
+            self.source = store.operands[1]
+        else:
+            self.value = store.operands[1]
+
+    def iterations(self, state: State) -> int:
+        count = super().iterations(state)
+        registers = state.registers.data
+        value = self.value
+        if self.source is not None:
+            value = int(registers[self.source], 16)
+        if value > 0xFF or state.memory.mapped_pages:
+            return 0
+        if not pair_fits(state, "H", count):
+            return 0
+        return count
+
+    def execute(self, state: State, iterations: int, remaining: int) -> None:
+        value = self.value
+        if self.source is not None:
+            value = int(state.registers.data[self.source], 16)
+        memory = state.memory
+        start = state.get_register_pair("H")
+        end = start + iterations
+        memory.buffer[start:end] = bytes((value,)) * iterations
+        # INX H stores M back to HL, so the address past the last store is written too
+        mark_written(memory, range(start, end + 1))
+        set_register_pair(state, "H", end)
+        super().execute(state, iterations, remaining)
+
+
+class CopyLoop(FusedLoop):
+    """
+    Load from one register pair's address, store to the other's, increment both
+    """
+
+    kind = "copy"
+
+    def __init__(self, head: int, commands: List[Command]):
+        super().__init__(head, commands)
+        load, store = commands[:2]
+        self.source = load.operands[0] if load.name == "LDAX" else "H"
+        self.destination = store.operands[0] if store.name == "STAX" else "H"
+
+    def iterations(self, state: State) -> int:
+        count = super().iterations(state)
+        if state.memory.mapped_pages:
+            return 0
+        if not pair_fits(state, self.source, count):
+            return 0
+        if not pair_fits(state, self.destination, count):
+            return 0
+        return count
+
+    def execute(self, state: State, iterations: int, remaining: int) -> None:
+        memory = state.memory
+        buffer = memory.buffer
+        source = state.get_register_pair(self.source)
+        destination = state.get_register_pair(self.destination)
+        if source < destination < source + iterations:
+            # Overlapping forwards, stores land ahead of the loads: byte by byte
+            for offset in range(iterations):
+                buffer[destination + offset] = buffer[source + offset]
+            value = buffer[source + iterations - 1]
+        else:
+            value = buffer[source + iterations - 1]
+            buffer[destination : destination + iterations] = buffer[
+                source : source + iterations
+            ]
+        stored = range(destination, destination + iterations)
+        if self.source == "H":
+            # INX H stores M back to the next source address after every store
+            mark_written(
+                memory,
+                (
+                    address
+                    for offset, written in enumerate(stored, start=1)
+                    for address in (written, source + offset)
+                ),
+            )
+        elif self.destination == "H":
+            mark_written(memory, range(destination, destination + iterations + 1))
+        else:
+            mark_written(memory, stored)
+        state.registers.data["A"] = f"0x{value:02x}"
+        set_register_pair(state, self.source, source + iterations)
+        set_register_pair(state, self.destination, destination + iterations)
+        super().execute(state, iterations, remaining)
+
+
+def pair_fits(state: State, register: str, count: int) -> bool:
+    """
+    The pair holds a plain 16 bit address that stays within FFFF for count increments
+    """
+    high, low = REGISTER_PAIRS[register]
+    registers = state.registers.data
+    if int(registers[high], 16) > 0xFF or int(registers[low], 16) > 0xFF:
+        return False
+    return state.get_register_pair(register) + count <= 0xFFFF
+
+
+def set_register_pair(state: State, register: str, value: int) -> None:
+    """
+    Like State.set_register_pair, M of a new HL was already marked written with the stores
+    """
+    REG1, REG2 = REGISTER_PAIRS[register]
+    registers = state.registers.data
+    registers[REG1] = f"0x{value >> 8:02x}"
+    registers[REG2] = f"0x{value & 0xFF:02x}"
+    if register == "H":
+        registers["M"] = f"0x{state.memory.buffer[value]:02x}"
+
+
+def mark_written(memory, addresses) -> None:
+    """
+    Record writes to addresses, in the order stepping would have written them
+    """
+    addresses = list(addresses)
+    if not addresses:
+        return
+    memory.written.update(dict.fromkeys(addresses))
+    memory.last_write = addresses[-1]
+    shift = memory.PAGE_SHIFT
+    first, last = min(addresses) >> shift, max(addresses) >> shift
+    memory.page_versions[first : last + 1] = [memory.version] * (last - first + 1)
+
+
+def match_loop(head: int, commands: List[Command]) -> Optional[FusedLoop]:
+    """
+    The fused loop of commands (head to JNZ), None if they aren't one of the idioms
+    """
+    label = commands[0].label
+    decrement, jump = commands[-2:]
+    if jump.name != "JNZ" or jump.operands[0] != label:
+        return None
+    if decrement.name != "DCR" or decrement.operands[0] == "M":
+        return None
+    # Only the head may be jumped into
+    if any(command.label for command in commands[1:]):
+        return None
+    counter = decrement.operands[0]
+    body = commands[:-2]
+    names = tuple(command.name for command in body)
+    if not body:
+        return FusedLoop(head, commands)
+    if names in (("MOV", "INX"), ("MVI", "INX")):
+        store, increment = body
+        if store.operands[0] != "M" or increment.operands[0] != "H":
+            return None
+        if counter in ("H", "L"):
+            return None
+        if store.name == "MOV" and store.operands[1] in ("H", "L", "M", counter):
+            return None
+        return FillLoop(head, commands)
+    if len(body) == 4 and names[2:] == ("INX", "INX"):
+        load, store, first, second = body
+        if load.name == "LDAX":
+            source = load.operands[0]
+        elif load.name == "MOV" and load.operands == ("A", "M"):
+            source = "H"
+        else:
+            return None
+        if store.name == "STAX":
+            destination = store.operands[0]
+        elif store.name == "MOV" and store.operands == ("M", "A"):
+            destination = "H"
+        else:
+            return None
+        if source == destination:
+            return None
+        if {first.operands[0], second.operands[0]} != {source, destination}:
+            return None
+        # A carries the byte, the pairs the addresses
+        if counter in ["A"] + REGISTER_PAIRS[source] + REGISTER_PAIRS[destination]:
+            return None
+        return CopyLoop(head, commands)
+    return None
+
+
+def find_loops(command_logs: List[Command]) -> Dict[int, FusedLoop]:
+    """
+    Fusable loops by the index of their head
+    """
+    loops: Dict[int, FusedLoop] = {}
+    for index, command in enumerate(command_logs):
+        if command.name != "JNZ":
+            continue
+        label = command.operands[0]
+        # The longest idiom is the copy, 6 commands
+        for head in range(max(index - 5, 0), index):
+            if command_logs[head].label == label:
+                loop = match_loop(head, command_logs[head : index + 1])
+                if loop is not None:
+                    loops[head] = loop
+                break
+    return loops
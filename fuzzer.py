@@ -0,0 +1,250 @@
+"""
+Random program fuzzer and differential checker for the execution engines.
+
+Generates seeded random programs over the data.COMMANDS instruction set,
+runs each on two engines and diffs the final registers, flags and memory.
+
+python fuzzer.py -n 1000 -s 7 -e repl machine
+"""
+import sys
+import time
+import random
+import argparse
+from typing import Callable, Dict, List, Tuple
+
+from data import COMMANDS, REGISTERS, REGISTER_PAIRS
+from interpreter import Interpreter, cmd_preprocessor
+from machine import Machine, set_logging, snapshot
+
+# A program line and whether the minimizer must keep it (labels and loop counters)
+Line = Tuple[str, bool]
+
+# Instructions whose parameters are labels get structured (loops/skips) instead of random operands
+JUMPS = tuple(
+    name
+    for name, spec in COMMANDS.items()
+    if "label" in tuple(spec["parameters"].values())
+)
+LOOP_JUMPS = ("JNZ", "JNC")
+COUNTERS = ("B", "C", "D", "E")
+PAIR_OF = {reg: pair for pair, regs in REGISTER_PAIRS.items() for reg in regs}
+PORTS = ("PORT0", "PORT1", "A")
+
+# Safety net for engines with a step limit, generated loops are bounded far below this
+MAX_STEPS = 100_000
+
+
+def random_address(rng: random.Random) -> str:
+    """
+    Mostly a small window so loads and stores collide, sometimes anywhere or the top edge
+    """
+    roll = rng.random()
+    if roll < 0.8:
+        address = rng.randint(0x2050, 0x205F)
+    elif roll < 0.95:
+        address = rng.randint(0, 0xFFFF)
+    else:
+        address = 0xFFFF
+    return f"{address:04X}H"
+
+
+def random_operand(rng: random.Random, p_name: str, p_type) -> str:
+    if isinstance(p_type, dict):
+        return rng.choice(tuple(p_type))
+    if isinstance(p_type, tuple):
+        return rng.choice(p_type)
+    if p_type == "byte":
+        return f"{rng.randint(0, 0xFF):02X}H"
+    if p_type == "word":
+        return random_address(rng)
+    return rng.choice(PORTS)
+
+
+def random_instruction(rng: random.Random, avoid: str = "") -> str:
+    """
+    A random non jump instruction. With avoid, never mentions that register (or its pair)
+    so it can't disturb a loop counter.
+    """
+    while True:
+        name = rng.choice(tuple(name for name in COMMANDS if name not in JUMPS))
+        params = COMMANDS[name]["parameters"].items()
+        operands = [random_operand(rng, p_name, p_type) for p_name, p_type in params]
+        if avoid and (avoid in operands or PAIR_OF[avoid] in operands):
+            continue
+        return " ".join((name, *operands))
+
+
+def generate_program(rng: random.Random, size: int = 20) -> List[Line]:
+    """
+    Build a program of straight code, counter loops (DCR r; JNZ/JNC label)
+    and conditional forward skips (JZ/JNZ/JC/JNC label), every loop is bounded.
+    """
+    program: List[Line] = []
+    labels = 0
+    while len(program) < size:
+        roll = rng.random()
+        if roll < 0.6:
+            program.append((random_instruction(rng), False))
+        elif roll < 0.8:
+            counter = rng.choice(COUNTERS)
+            label = f"L{labels}"
+            body = [random_instruction(rng, avoid=counter)]
+            body += [
+                random_instruction(rng, avoid=counter) for _ in range(rng.randint(0, 3))
+            ]
+            program.append((f"MVI {counter} {rng.randint(0, 8):02X}H", False))
+            program.append((f"{label}: {body[0]}", True))
+            program.extend((line, False) for line in body[1:])
+            program.append((f"DCR {counter}", True))
+            program.append((f"{rng.choice(LOOP_JUMPS)} {label}", False))
+        else:
+            label = f"S{labels}"
+            program.append((f"{rng.choice(JUMPS)} {label}", False))
+            for _ in range(rng.randint(1, 3)):
+                program.append((random_instruction(rng), False))
+            program.append((f"{label}: {random_instruction(rng)}", True))
+        labels += 1
+    return program
+
+
+def run_repl(lines: List[str]) -> dict:
+    """
+    Reference engine: feeds the lines one by one like the repl does
+    """
+    interpreter = Interpreter()
+    interpreter.state.verbose = False
+    try:
+        for line in lines:
+            cmd = cmd_preprocessor(line)
+            if cmd and cmd.is_valid and interpreter.add_command(cmd):
+                interpreter.execute_next()
+    except Exception as e:
+        return snapshot(interpreter.state, type(e).__name__)
+    return snapshot(interpreter.state)
+
+
+def run_machine(lines: List[str]) -> dict:
+    """
+    Loads the whole program in the headless Machine and runs it
+    """
+    machine = Machine()
+    try:
+        machine.load(lines)
+        machine.run(max_steps=MAX_STEPS)
+    except Exception as e:
+        return snapshot(machine.state, type(e).__name__)
+    return snapshot(machine.state)
+
+
+def run_sweep(lines: List[str]) -> dict:
+    """
+    A single instance of the NumPy lockstep engine
+    """
+    return sweep("\n".join(lines), count=1, max_steps=MAX_STEPS).state(0)
+
+
+# Engines compared by the fuzzer, faster engines register themselves here
+ENGINES: Dict[str, Callable[[List[str]], dict]] = {
+    "repl": run_repl,
+    "machine": run_machine,
+}
+
+try:
+    from sweep import sweep
+except ImportError:  # numpy isn't installed
+    pass
+else:
+    ENGINES["sweep"] = run_sweep
+
+
+def diff_states(first: dict, second: dict) -> List[str]:
+    """
+    Human readable differences between two snapshots
+    """
+    differences = []
+    for reg, value in first["registers"].items():
+        if value != second["registers"][reg]:
+            differences.append(
+                f"register {reg}: {value:02X}H != {second['registers'][reg]:02X}H"
+            )
+    for flag, value in first["flags"].items():
+        if value != second["flags"][flag]:
+            differences.append(
+                f"flag {flag}: {int(value)} != {int(second['flags'][flag])}"
+            )
+    for address in sorted(set(first["memory"]) | set(second["memory"])):
+        value1 = first["memory"].get(address)
+        value2 = second["memory"].get(address)
+        if value1 != value2:
+            differences.append(f"memory {address:04X}H: {value1} != {value2}")
+    if first["error"] != second["error"]:
+        differences.append(f"error: '{first['error']}' != '{second['error']}'")
+    return differences
+
+
+def mismatch(program: List[Line], engines: Tuple[str, str]) -> List[str]:
+    lines = [line for line, _ in program]
+    return diff_states(ENGINES[engines[0]](lines), ENGINES[engines[1]](lines))
+
+
+def minimize(program: List[Line], engines: Tuple[str, str]) -> List[Line]:
+    """
+    Drop chunks of unprotected lines (halving the chunk size) while the engines still disagree
+    """
+    chunk = len(program) // 2
+    while chunk >= 1:
+        index = 0
+        while index < len(program):
+            removable = [line for line in program[index : index + chunk] if not line[1]]
+            if len(removable) == chunk:
+                candidate = program[:index] + program[index + chunk :]
+                if mismatch(candidate, engines):
+                    program = candidate
+                    continue
+            index += 1
+        chunk //= 2
+    return program
+
+
+def fuzz(
+    count: int, seed: int, engines: Tuple[str, str], size: int = 20
+) -> List[List[Line]]:
+    """
+    Run count random programs on both engines. Returns: The minimized failing programs.
+    Program i is generated from seed * 1_000_003 + i, so a failure reproduces on its own.
+    """
+    failures = []
+    start = time.perf_counter()
+    for index in range(count):
+        rng = random.Random(seed * 1_000_003 + index)
+        program = generate_program(rng, size)
+        differences = mismatch(program, engines)
+        if not differences:
+            continue
+        program = minimize(program, engines)
+        failures.append(program)
+        print(f"\nMismatch in program #{index} (seed {seed}), minimized:")
+        for line, _ in program:
+            print(f"\t{line}")
+        for difference in mismatch(program, engines):
+            print(f"  {difference}")
+    elapsed = time.perf_counter() - start
+    print(
+        f"{count} programs, {len(failures)} mismatches, "
+        f"{count / elapsed:.1f} programs/sec [{engines[0]} vs {engines[1]}]"
+    )
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--count", type=int, default=1000)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, default=20, help="Lines per program")
+    parser.add_argument(
+        "-e", "--engines", nargs=2, default=("repl", "machine"), choices=ENGINES
+    )
+    args = parser.parse_args()
+    set_logging(False)
+    failures = fuzz(args.count, args.seed, tuple(args.engines), args.size)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,216 @@
+"""
+Guards against runaway programs: instruction count, wall-clock time, host memory and hot loops.
+"""
+import os
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Not available on windows, the memory guard is skipped there
+    resource = None
+
+MB = 1024 * 1024
+
+# Termination status of a run
+COMPLETED = "completed"
+INSTRUCTION_LIMIT = "instruction_limit"
+TIME_LIMIT = "time_limit"
+MEMORY_LIMIT = "memory_limit"
+LOOP_LIMIT = "loop_limit"
+
+# Exit codes of the cli when a guard stops the execution
+EXIT_CODES = {
+    INSTRUCTION_LIMIT: 3,
+    TIME_LIMIT: 4,
+    MEMORY_LIMIT: 5,
+    LOOP_LIMIT: 6,
+}
+
+# Names of the limits in the cli -w option, mapped to Watchdog arguments
+LIMIT_NAMES = {
+    "steps": "max_instructions",
+    "time": "max_seconds",
+    "memory": "max_memory_mb",
+    "loop": "max_loop_iterations",
+}
+
+
+class ExecutionLimitExceeded(Exception):
+    """
+    Raised from inside the instruction loop when a guard trips
+    """
+
+    def __init__(self, status: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.exit_code = EXIT_CODES[status]
+
+
+class Watchdog:
+    """
+    Counts executed instructions and taken jumps, and checks the limits.
+
+    tick() is called for every instruction, it only compares a counter,
+    the clock and memory are only looked at every check_interval instructions.
+    jumps : Taken jumps per label, the iterations of the loop starting at that label.
+    """
+
+    def __init__(
+        self,
+        max_instructions: Optional[int] = None,
+        max_seconds: Optional[float] = None,
+        max_memory_mb: Optional[float] = None,
+        max_loop_iterations: Optional[int] = None,
+        check_interval: int = 1024,
+    ):
+        self.max_instructions = max_instructions
+        self.max_seconds = max_seconds
+        self.max_memory_mb = max_memory_mb
+        self.max_loop_iterations = max_loop_iterations
+        self.check_interval = check_interval
+        self.start()
+
+    def start(self) -> None:
+        """
+        Reset the counters and the clock, called at the start of every run
+        """
+        self.instructions: int = 0
+        self.jumps: Dict[str, int] = {}
+        self.started_at: float = time.monotonic()
+        self.next_check: int = self.check_interval
+        if self.max_instructions is not None:
+            self.next_check = min(self.next_check, self.max_instructions + 1)
+        # The memory limit is on what the run adds, earlier runs of the process don't count
+        self.memory_at_start: Optional[float] = None
+        if self.max_memory_mb is not None:
+            self.memory_at_start = resident_memory_mb()
+
+    def tick(self) -> None:
+        """
+        Count an instruction about to be executed
+        """
+        self.instructions += 1
+        if self.instructions >= self.next_check:
+            self.check()
+
+    def jump(self, label: str) -> None:
+        """
+        Count a taken jump to label. Going over the loop limit stops the run
+        at the next tick, so every stop happens between two instructions.
+        """
+        iterations = self.jumps.get(label, 0) + 1
+        self.jumps[label] = iterations
+        if (
+            self.max_loop_iterations is not None
+            and iterations > self.max_loop_iterations
+        ):
+            self.next_check = self.instructions + 1
+
+    def allowance(self, label: str) -> Tuple[int, Optional[int]]:
+        """
+        Instructions that can run before the next check, and taken jumps to label
+        before the loop limit (None without one)
+        """
+        jumps = None
+        if self.max_loop_iterations is not None:
+            jumps = self.max_loop_iterations - self.jumps.get(label, 0)
+        return self.next_check - self.instructions - 1, jumps
+
+    def advance(self, instructions: int, label: str, jumps: int) -> None:
+        """
+        Count instructions and taken jumps to label run in one go (a fused loop),
+        within the allowance, so no check or limit is passed over
+        """
+        self.instructions += instructions
+        if jumps:
+            self.jumps[label] = self.jumps.get(label, 0) + jumps
+
+    def check(self) -> None:
+        """
+        Runs before the instruction just counted executes, so it isn't counted as executed
+        """
+        executed = self.instructions - 1
+        self.next_check = self.instructions + self.check_interval
+        if self.max_loop_iterations is not None:
+            hottest = self.hottest_loop()
+            if hottest and hottest[1] > self.max_loop_iterations:
+                self.stop(
+                    LOOP_LIMIT,
+                    f"loop limit of {self.max_loop_iterations} reached",
+                    executed,
+                )
+        if self.max_instructions is not None:
+            if self.instructions > self.max_instructions:
+                self.stop(
+                    INSTRUCTION_LIMIT,
+                    f"instruction limit of {self.max_instructions} reached",
+                    executed,
+                )
+            self.next_check = min(self.next_check, self.max_instructions + 1)
+        if self.max_seconds is not None:
+            if time.monotonic() - self.started_at > self.max_seconds:
+                self.stop(
+                    TIME_LIMIT, f"time limit of {self.max_seconds}s reached", executed
+                )
+        if self.max_memory_mb is not None and self.memory_at_start is not None:
+            used_mb = resident_memory_mb() - self.memory_at_start
+            if used_mb > self.max_memory_mb:
+                self.stop(
+                    MEMORY_LIMIT,
+                    f"memory limit of {self.max_memory_mb}MB reached ({used_mb:.0f}MB)",
+                    executed,
+                )
+
+    def hottest_loop(self) -> Optional[Tuple[str, int]]:
+        """
+        Label jumped to most often and its iteration count
+        """
+        if not self.jumps:
+            return None
+        label = max(self.jumps, key=self.jumps.get)
+        return label, self.jumps[label]
+
+    def stop(self, status: str, reason: str, executed: int) -> None:
+        message = f"Execution stopped after {executed} instructions: {reason}"
+        hottest = self.hottest_loop()
+        if hottest:
+            message += f", hot loop at '{hottest[0]}' ({hottest[1]} iterations)"
+        raise ExecutionLimitExceeded(status, message)
+
+
+def resident_memory_mb() -> Optional[float]:
+    """
+    Resident memory of this process now (/proc/self/statm on linux). Elsewhere its peak,
+    ru_maxrss in bytes on macOS, which only grows once past the earlier runs' peak.
+    None on windows.
+    """
+    try:
+        with open("/proc/self/statm") as rf:
+            pages = int(rf.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / MB
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / MB if sys.platform == "darwin" else peak / 1024
+
+
+def process_limits(limits: str) -> Optional[Watchdog]:
+    """
+    Build a Watchdog from the cli option, "steps=100000,time=5,memory=512,loop=1000"
+    """
+    kwargs = {}
+    for item in limits.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() not in LIMIT_NAMES:
+            return None
+        try:
+            kwargs[LIMIT_NAMES[name.strip()]] = (
+                float(value) if name.strip() in ("time", "memory") else int(value)
+            )
+        except ValueError:
+            return None
+    return Watchdog(**kwargs)
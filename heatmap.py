@@ -0,0 +1,136 @@
+"""
+Per address read and write counters over the 64 KiB address space.
+
+Counts what each instruction accesses in the machine (LDA, STA, LDAX, STAX and the
+M operand), not how often the simulator looks at its own memory for display.
+"""
+from array import array
+from typing import Dict, List, Tuple
+
+from command_model import Command
+from state_model import State
+
+SIZE = 0x10000
+PAGE_SIZE = 0x100
+
+# Memory accesses of an instruction: (kind, where), where is "address" for the
+# address operand or the register pair holding it (H for the M operand)
+Access = Tuple[str, str]
+
+
+def command_accesses(command: Command) -> Tuple[Access, ...]:
+    name, args = command.name, command.args
+    if name == "LDA":
+        return (("read", "address"),)
+    if name == "STA":
+        return (("write", "address"),)
+    if name == "LDAX":
+        return (("read", args[0]),)
+    if name == "STAX":
+        return (("write", args[0]),)
+    if "M" not in args:
+        return ()
+    if name == "MOV":
+        destination, source = args
+        accesses = (("read", "H"),) if source == "M" else ()
+        return accesses + ((("write", "H"),) if destination == "M" else ())
+    if name == "MVI":
+        return (("write", "H"),)
+    if name in ("INR", "DCR"):
+        return (("read", "H"), ("write", "H"))
+    return (("read", "H"),)
+
+
+class Heatmap:
+    def __init__(self):
+        self.reads: array = array("I", bytes(4 * SIZE))
+        self.writes: array = array("I", bytes(4 * SIZE))
+        # Decoded accesses per (name, args), the commands themselves aren't kept alive
+        self.accesses: Dict[Tuple[str, tuple], Tuple[Access, ...]] = {}
+
+    def record(self, command: Command, state: State) -> None:
+        """
+        Count the memory accesses command is about to make, call it before command.eval
+        """
+        key = (command.name, command.args)
+        accesses = self.accesses.get(key)
+        if accesses is None:
+            accesses = self.accesses[key] = command_accesses(command)
+        for kind, where in accesses:
+            if where == "address":
+                address = command.operands[0]
+            else:
+                address = state.get_register_pair(where)
+            if address >= SIZE:
+                continue
+            counters = self.reads if kind == "read" else self.writes
+            counters[address] += 1
+
+    def touched(self) -> List[int]:
+        return [
+            address
+            for address in range(SIZE)
+            if self.reads[address] or self.writes[address]
+        ]
+
+    def ranges(self) -> List[Tuple[int, int]]:
+        """
+        Contiguous touched address ranges, (first, last)
+        """
+        ranges: List[Tuple[int, int]] = []
+        for address in self.touched():
+            if ranges and ranges[-1][1] == address - 1:
+                ranges[-1] = (ranges[-1][0], address)
+            else:
+                ranges.append((address, address))
+        return ranges
+
+    def report(self, top: int = 10) -> str:
+        """
+        Totals, the hottest addresses and the touched ranges
+        """
+        touched = self.touched()
+        if not touched:
+            return "No memory accesses recorded"
+        pages = sorted({address // PAGE_SIZE for address in touched})
+        lines = [
+            f"{sum(self.reads)} reads, {sum(self.writes)} writes, "
+            f"{len(touched)} addresses in {len(pages)} pages",
+            "",
+            "Hot addresses:",
+        ]
+        hottest = sorted(
+            touched, key=lambda address: self.reads[address] + self.writes[address]
+        )[::-1][:top]
+        for address in hottest:
+            lines.append(
+                f"  {address:04X}H: {self.reads[address]:>8} reads {self.writes[address]:>8} writes"
+            )
+        lines += ["", "Touched ranges:"]
+        for first, last in self.ranges():
+            lines.append(f"  {first:04X}H-{last:04X}H ({last - first + 1} bytes)")
+        return "\n".join(lines)
+
+    def export_csv(self, filename: str) -> None:
+        """
+        address,reads,writes for every touched address
+        """
+        with open(filename, "w") as wf:
+            wf.write("address,reads,writes\n")
+            for address in self.touched():
+                wf.write(
+                    f"{address:04X},{self.reads[address]},{self.writes[address]}\n"
+                )
+
+    def export_grid(self, filename: str) -> None:
+        """
+        256 x 256 accesses (reads + writes) grid, a row per page, loads with numpy.loadtxt
+        """
+        with open(filename, "w") as wf:
+            for page in range(SIZE // PAGE_SIZE):
+                start = page * PAGE_SIZE
+                row = (
+                    self.reads[address] + self.writes[address]
+                    for address in range(start, start + PAGE_SIZE)
+                )
+                wf.write(" ".join(map(str, row)) + "\n")
@@ -0,0 +1,129 @@
+"""
+Bounded command history for repl sessions that run for days.
+
+Every command entered stays in Interpreter.command_logs for the jumps back to it, so the
+history only grows. Compaction drops the commands that can't run again: execution only
+gets back into the history at an entry point, every label (a jump to it can still be
+typed) and where a RET, a paused run or the running command resumes. From an entry point
+execution falls through to the end of the history, a RET ends it. What's left is the
+commands before the first label and the ones after a RET up to the next label.
+'run' starts at the first command kept.
+
+Compaction runs when the history has doubled since the last one, and when it's longer
+than the limit. Above the limit after compacting, the oldest commands are dropped too,
+the labels forgotten that way are logged as a warning and a jump to one of them waits
+for it like for an undefined label.
+"""
+from typing import List, Optional, Set
+
+from loguru import logger
+
+# Commands entered before the first compaction, and at least between two
+COMPACT_MIN = 256
+
+
+class History:
+    """
+    limit: Most commands kept, None for no limit (only the unreachable ones are dropped)
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        if limit is not None and limit < 1:
+            raise ValueError(f"Invalid history limit {limit}: At least one command")
+        self.limit = limit
+        self.next_compaction = COMPACT_MIN
+        self.dropped = 0
+
+    def due(self, length: int) -> bool:
+        if self.limit is not None and length > self.limit:
+            return True
+        return length >= self.next_compaction
+
+    def compact(self, interpreter) -> int:
+        """
+        Drop the commands of interpreter.command_logs that can't run again, and the oldest
+        ones above the limit. Returns: Commands dropped
+        """
+        commands = interpreter.command_logs
+        keep = self.live(interpreter)
+        resumes = self.resumes(interpreter)
+        if self.limit is not None and sum(keep) > self.limit:
+            # Oldest first, down to the limit but never past a resume point
+            cut, kept = len(commands), 0
+            while kept < self.limit:
+                cut -= 1
+                kept += keep[cut]
+            cut = min([cut] + [index for index in resumes if index < len(commands)])
+            forgotten = [
+                label
+                for label, index in interpreter.labels_map.items()
+                if index < cut and keep[index]
+            ]
+            if forgotten:
+                logger.warning(
+                    f"History limit of {self.limit} commands: Forgot labels {', '.join(forgotten)}"
+                )
+            keep[:cut] = [False] * cut
+        dropped = len(commands) - sum(keep)
+        if dropped:
+            remove(interpreter, keep)
+            self.dropped += dropped
+            logger.debug(f"Compacted history: Dropped {dropped} commands")
+        self.next_compaction = max(2 * len(interpreter.command_logs), COMPACT_MIN)
+        return dropped
+
+    def resumes(self, interpreter) -> Set[int]:
+        """
+        Indices execution resumes at: RETs, a paused run, the running command
+        """
+        resumes = set(interpreter.state.return_stack)
+        if interpreter.run_pointer:
+            resumes.add(interpreter.run_pointer)
+        if interpreter.command_index_pointer != -1:
+            resumes.add(interpreter.command_index_pointer)
+        return resumes
+
+    def live(self, interpreter) -> List[bool]:
+        """
+        Per command: it can be reached from an entry point (see the module docstring)
+        """
+        commands = interpreter.command_logs
+        entries = self.resumes(interpreter)
+        entries.update(interpreter.labels_map.values())
+        keep = [False] * len(commands)
+        for index in sorted(entries):
+            while index < len(commands) and not keep[index]:
+                keep[index] = True
+                index += 1
+                if commands[index - 1].name == "RET":
+                    break
+        return keep
+
+
+def remove(interpreter, keep: List[bool]) -> None:
+    """
+    Drop the commands not kept, remapping every index into command_logs
+    """
+    new_index: List[int] = []
+    kept = 0
+    for flag in keep:
+        new_index.append(kept)
+        kept += flag
+    # A resume point past the last command stays past it
+    new_index.append(kept)
+    interpreter.command_logs = [
+        command for command, flag in zip(interpreter.command_logs, keep) if flag
+    ]
+    interpreter.labels_map = {
+        label: new_index[index]
+        for label, index in interpreter.labels_map.items()
+        if keep[index]
+    }
+    state = interpreter.state
+    state.return_stack = [new_index[index] for index in state.return_stack]
+    interpreter.run_pointer = new_index[interpreter.run_pointer]
+    if interpreter.command_index_pointer != -1:
+        interpreter.command_index_pointer = new_index[interpreter.command_index_pointer]
+    interpreter.scanned_loops = (None, 0, {})
+    if interpreter.profiler is not None:
+        interpreter.profiler.compact(keep)
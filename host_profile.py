@@ -0,0 +1,350 @@
+"""
+Profile of the simulator itself (not of the 8085 program, that is profiler.py): where the
+host's time goes, by function and by subsystem.
+
+Runs a workload under cProfile, or under a sampling profiler (a thread looking at the main
+thread's stack every interval, much lower overhead), and gives both a pstats file and
+collapsed stacks ('main.py:main;interpreter.py:step;... 1234' per line, in microseconds),
+the input of flamegraph.pl, speedscope and inferno.
+cProfile only records caller -> callee edges, so its stacks are rebuilt from them,
+each function's time spread over its callers in proportion to their share of it.
+
+with host_profile("out") as profile:    # out.pstats, out.collapsed
+    machine.run()
+print(profile.report())
+
+python main.py --profile out -f program.txt
+python main.py --profile out:sample -f program.txt
+"""
+import os
+import re
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MODES = ("cprofile", "sample")
+# Seconds between two samples of the sampling profiler
+SAMPLE_INTERVAL = 0.001
+# Call paths kept per function when rebuilding stacks from cProfile
+MAX_PATHS = 256
+# Call path share below which it's dropped
+MIN_SHARE = 1e-4
+SUBSYSTEMS = (
+    "lexing",
+    "validation",
+    "dispatch",
+    "state access",
+    "I/O",
+    "logging",
+    "other",
+)
+
+# pstats function key: (filename, first line, function name)
+Function = Tuple[str, int, str]
+Stack = Tuple[Function, ...]
+
+# Subsystem of the simulator modules, functions listed in SUBSYSTEM_FUNCTIONS aside
+SUBSYSTEM_MODULES = {
+    "converter.py": "lexing",
+    "program_cache.py": "lexing",
+    "command_model.py": "dispatch",
+    "interpreter.py": "dispatch",
+    "fusion.py": "dispatch",
+    "scheduler.py": "dispatch",
+    "guards.py": "dispatch",
+    "machine.py": "dispatch",
+    "main.py": "dispatch",
+    "sweep.py": "dispatch",
+    "state_model.py": "state access",
+    "custom_dictionaries.py": "state access",
+    "memory_map.py": "state access",
+    "dirty.py": "state access",
+    "ports.py": "I/O",
+    "session.py": "I/O",
+    "tracer.py": "I/O",
+    "messages.py": "I/O",
+    "diagnostics.py": "logging",
+}
+SUBSYSTEM_FUNCTIONS = {
+    ("interpreter.py", "cmd_preprocessor"): "lexing",
+    ("converter.py", "process_operands"): "validation",
+    ("converter.py", "operand_kind"): "validation",
+    ("converter.py", "read_memory_file"): "I/O",
+    ("converter.py", "write_memory_file"): "I/O",
+    ("command_model.py", "__init__"): "validation",
+    ("command_model.py", "intern"): "validation",
+    ("command_model.py", "validate"): "validation",
+    ("command_model.py", "validate_args_length"): "validation",
+    ("command_model.py", "validate_args_type"): "validation",
+}
+# Builtins that are I/O whoever calls them
+IO_BUILTINS = ("print", "input", "open", "write", "read", "readline", "flush")
+
+
+def subsystem(function: Function) -> Optional[str]:
+    """
+    Subsystem of a function, None for builtins and code outside the simulator
+    """
+    filename, _, name = function
+    if "loguru" in filename:
+        return "logging"
+    if "rich" in filename.split(os.sep):
+        return "I/O"
+    if filename == "~":
+        # <built-in method builtins.print>, <method 'write' of '_io.TextIOWrapper' objects>
+        match = re.search(r"(?:method|function) '?([\w.]+)", name)
+        method = match.group(1).split(".")[-1] if match else ""
+        return "I/O" if method in IO_BUILTINS else None
+    module = os.path.basename(filename)
+    return SUBSYSTEM_FUNCTIONS.get((module, name), SUBSYSTEM_MODULES.get(module))
+
+
+def frame_name(function: Function) -> str:
+    filename, _, name = function
+    if filename == "~":
+        return name
+    return f"{os.path.basename(filename)}:{name}"
+
+
+class HostProfile:
+    """
+    mode: cprofile (every call, exact counts, slows the simulator down a few times)
+    or sample (the main thread's stack every interval seconds)
+    """
+
+    def __init__(self, mode: str = "cprofile", interval: float = SAMPLE_INTERVAL):
+        if mode not in MODES:
+            raise ValueError(f"Invalid profile mode '{mode}': Use one of {MODES}")
+        self.mode = mode
+        self.interval = interval
+        self.profile: Optional[cProfile.Profile] = None
+        self.samples: Counter = Counter()
+        self.sampling = threading.Event()
+        self.sampler: Optional[threading.Thread] = None
+        self.switch_interval: float = sys.getswitchinterval()
+        self.elapsed: float = 0.0
+        self.started_at: float = 0.0
+        self._stats: Optional[pstats.Stats] = None
+        self._stacks: Optional[Dict[Stack, float]] = None
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        if self.mode == "cprofile":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            return
+        # The sampling thread waits for the GIL, switch it as often as samples are taken
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switch_interval, self.interval))
+        self.sampling.set()
+        self.sampler = threading.Thread(
+            target=self.sample, args=(threading.get_ident(),), daemon=True
+        )
+        self.sampler.start()
+
+    def stop(self) -> None:
+        if self.profile is not None:
+            self.profile.disable()
+        if self.sampler is not None:
+            self.sampling.clear()
+            self.sampler.join()
+            sys.setswitchinterval(self.switch_interval)
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def sample(self, thread_id: int) -> None:
+        """
+        Sampling thread: the profiled thread's stack, weighted by the time since the last one
+        """
+        last = time.perf_counter()
+        while self.sampling.is_set():
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(thread_id)
+            now = time.perf_counter()
+            stack: List[Function] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += now - last
+            last = now
+
+    @property
+    def stacks(self) -> Dict[Stack, float]:
+        """
+        Seconds spent per call stack (root first), in the function at its top
+        """
+        if self._stacks is None:
+            if self.mode == "sample":
+                self._stacks = dict(self.samples)
+            else:
+                self._stacks = stacks_from_stats(self.stats.stats)
+        return self._stacks
+
+    @property
+    def stats(self) -> pstats.Stats:
+        if self._stats is None:
+            if self.mode == "cprofile":
+                self._stats = pstats.Stats(self.profile)
+            else:
+                self._stats = pstats.Stats(SampledStats(self.samples))
+        return self._stats
+
+    def subsystems(self) -> Dict[str, float]:
+        """
+        Seconds per subsystem, time in builtins and libraries goes to the subsystem
+        of the nearest simulator function calling them
+        """
+        totals = dict.fromkeys(SUBSYSTEMS, 0.0)
+        for stack, seconds in self.stacks.items():
+            for function in reversed(stack):
+                name = subsystem(function)
+                if name is not None:
+                    totals[name] += seconds
+                    break
+            else:
+                totals["other"] += seconds
+        return totals
+
+    def report(self, top: int = 10) -> str:
+        """
+        Time per subsystem and the functions with the most time of their own
+        """
+        totals = self.subsystems()
+        profiled = sum(totals.values()) or 1.0
+        lines = [
+            f"Host profile ({self.mode}): {self.elapsed:.3f}s",
+            "",
+            f"  {'Subsystem':<14} {'Seconds':>9} {'Percent':>8}",
+        ]
+        for name, seconds in totals.items():
+            lines.append(f"  {name:<14} {seconds:>9.3f} {seconds / profiled:>8.1%}")
+        own: Dict[Function, float] = defaultdict(float)
+        for stack, seconds in self.stacks.items():
+            own[stack[-1]] += seconds
+        lines += ["", f"  {'Own seconds':>11}  Function"]
+        for function, seconds in sorted(own.items(), key=lambda x: -x[1])[:top]:
+            lines.append(f"  {seconds:>11.4f}  {frame_name(function)}")
+        return "\n".join(lines)
+
+    def collapsed(self) -> str:
+        """
+        Collapsed stacks, one 'frame;frame;frame microseconds' line per stack
+        """
+        lines = []
+        for stack, seconds in sorted(self.stacks.items()):
+            microseconds = round(seconds * 1e6)
+            if microseconds:
+                frames = ";".join(frame_name(function) for function in stack)
+                lines.append(f"{frames} {microseconds}")
+        return "\n".join(lines)
+
+    def write(self, prefix: str) -> None:
+        """
+        prefix.pstats (for pstats, snakeviz) and prefix.collapsed (for flamegraphs)
+        """
+        self.stats.dump_stats(f"{prefix}.pstats")
+        with open(f"{prefix}.collapsed", "w") as wf:
+            wf.write(self.collapsed() + "\n")
+
+
+class SampledStats:
+    """
+    pstats data made of samples: calls are samples, times their seconds
+    """
+
+    def __init__(self, samples: Counter):
+        self.stats: Dict[Function, tuple] = {}
+        own: Dict[Function, float] = defaultdict(float)
+        total: Dict[Function, float] = defaultdict(float)
+        counts: Dict[Function, int] = defaultdict(int)
+        callers: Dict[Function, Dict[Function, list]] = defaultdict(dict)
+        for stack, seconds in samples.items():
+            own[stack[-1]] += seconds
+            # A function in the stack more than once (recursion) counts once
+            for function in set(stack):
+                total[function] += seconds
+                counts[function] += 1
+            for caller, function in set(zip(stack, stack[1:])):
+                edge = callers[function].setdefault(caller, [0, 0, 0.0, 0.0])
+                edge[0] += 1
+                edge[1] += 1
+                edge[3] += seconds
+        for function in total:
+            self.stats[function] = (
+                counts[function],
+                counts[function],
+                own[function],
+                total[function],
+                {caller: tuple(edge) for caller, edge in callers[function].items()},
+            )
+
+    def create_stats(self) -> None:
+        pass
+
+
+def stacks_from_stats(stats: Dict[Function, tuple]) -> Dict[Stack, float]:
+    """
+    Call stacks rebuilt from cProfile's caller -> callee edges: the own time of a function
+    spread over the paths reaching it, by each caller's share of its cumulative time
+    """
+    paths: Dict[Function, List[Tuple[Stack, float]]] = {}
+    visiting = set()
+
+    def paths_to(function: Function) -> List[Tuple[Stack, float]]:
+        if function in paths:
+            return paths[function]
+        visiting.add(function)
+        callers = {
+            caller: edge
+            for caller, edge in stats[function][4].items()
+            if caller in stats and caller not in visiting
+        }
+        weights = {
+            caller: (edge[3] if isinstance(edge, tuple) else edge)
+            for caller, edge in callers.items()
+        }
+        total = sum(weights.values())
+        found: List[Tuple[Stack, float]] = []
+        if not callers:
+            found = [((function,), 1.0)]
+        for caller, weight in weights.items():
+            share = weight / total if total else 1 / len(weights)
+            for path, path_share in paths_to(caller):
+                if share * path_share >= MIN_SHARE:
+                    found.append((path + (function,), share * path_share))
+        found.sort(key=lambda x: -x[1])
+        visiting.discard(function)
+        paths[function] = found[:MAX_PATHS]
+        return paths[function]
+
+    stacks: Dict[Stack, float] = defaultdict(float)
+    for function, (_, _, own, _, _) in stats.items():
+        if own <= 0:
+            continue
+        for path, share in paths_to(function):
+            stacks[path] += own * share
+    return dict(stacks)
+
+
+@contextmanager
+def host_profile(
+    prefix: str = "", mode: str = "cprofile", interval: float = SAMPLE_INTERVAL
+) -> Iterator[HostProfile]:
+    """
+    Profile the body of the with statement, writing prefix.pstats and prefix.collapsed
+    if a prefix is given, also when the body exits (the cli's exit() calls)
+    """
+    profile = HostProfile(mode, interval)
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        if prefix:
+            profile.write(prefix)
@@ -1,9 +1,21 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
 from loguru import logger
 
 from command_model import Command
 from state_model import State
+from data import COMMANDS, INTERRUPTS, INTERRUPT_ACK_CYCLES
+from converter import process_instruction_args, is_label, process_comments
+from guards import Watchdog
+from scheduler import EventScheduler
+from tracer import TraceRecorder
+from profiler import Profiler
+from diagnostics import Sampler
+from fusion import FusedLoop, find_loops
+from observers import StateObserver
+from history import History
+from heatmap import Heatmap
+from dirty import Marker
 
 
 class Interpreter:
@@ -23,6 +35,43 @@ class Interpreter:
 
         labels_map:
         - Whenever a command is added to the command_logs list. The ones with label are indexed in this dict.
+
+        watchdog:
+        - Optional guards (instruction count, time, memory, hot loops) ticked before every command.
+        - When a guard trips it raises guards.ExecutionLimitExceeded out of execute_next/step.
+
+        scheduler:
+        - Timed events (interrupts, peripherals) due at a state.cycles count.
+        - next_event_cycle is the earliest of them, checked once after each command.
+
+        tracer:
+        - Optional binary trace recorder, gets a record for every evaluated command.
+
+        profiler:
+        - Optional per command counters (executions, T-states, jumps taken) by command_logs index.
+
+        heatmap:
+        - Optional per address memory read and write counters.
+
+        sampler:
+        - Optional diagnostics sampler, structured records of sampled commands, jumps and flag changes.
+
+        diff_marker:
+        - State marked by the latest 'diff' repl command, the next one shows what changed since.
+
+        run_pointer:
+        - Index the next 'run'/'until' repl command starts at, past the first only when a run paused.
+
+        observer:
+        - Optional coalesced change events for front-ends, counts every command, see observers.py.
+
+        history:
+        - Optional bounded history, drops the commands that can't run again, see history.py.
+
+        fusion:
+        - Run the countdown, fill and copy loops (see fusion.py) in bulk when running at full speed.
+        - scanned_loops: (command list scanned, its length, fusable loops by head index) of the
+          latest scan, stale once command_logs is another list (restored, handed over) or grew.
         """
         self.state: State = State()
         self.command_logs: List[Command] = []
@@ -30,12 +79,38 @@ class Interpreter:
         self.is_execution_suspended: bool = False
         self.waiting_label: str = ""
         self.labels_map: Dict[str, int] = {}
+        self.watchdog: Optional[Watchdog] = None
+        self.next_event_cycle: float = float("inf")
+        self.scheduler: EventScheduler = EventScheduler(self)
+        self.tracer: Optional[TraceRecorder] = None
+        self.profiler: Optional[Profiler] = None
+        self.heatmap: Optional[Heatmap] = None
+        self.sampler: Optional[Sampler] = None
+        self.diff_marker: Optional[Marker] = None
+        self.run_pointer: int = 0
+        self.observer: Optional[StateObserver] = None
+        self.history: Optional[History] = None
+        self.fusion: bool = True
+        self.scanned_loops: Tuple[
+            Optional[List[Command]], int, Dict[int, FusedLoop]
+        ] = (None, 0, {})
 
     def execute_next(self) -> None:
         """
         Gets the command to run from the command_index_pointer and executes it
         only if the is_execution_suspended is false
         """
+        try:
+            self.execute_pointed()
+        finally:
+            # OUT values shown by the trace go out once the command is done
+            self.state.ports.console.flush()
+
+    def execute_pointed(self) -> None:
+        if self.state.halted:
+            logger.debug(f"Halted: Execution skipped for '{self.command_logs[-1]}'")
+            return
+
         self.revaluate_suspension()
 
         if self.is_execution_suspended:
@@ -48,23 +123,35 @@ class Interpreter:
         if self.command_index_pointer == -1:
             command_pointed = self.command_logs[self.command_index_pointer]
             logger.debug(f"Pointer at latest command: '{command_pointed}', executing..")
-            self.evaluate_command(command_pointed)
-        # if the pointer was modified keep executing from that index to latest item.
-        else:
+            if self.watchdog is not None:
+                self.watchdog.tick()
+            self.evaluate_command(command_pointed, len(self.command_logs) - 1)
+
+        # if the pointer was modified (by a jump) keep executing from that index to latest item.
+        while (
+            self.command_index_pointer != -1
+            and not self.is_execution_suspended
+            and not self.state.halted
+        ):
             if self.command_index_pointer >= len(self.command_logs):
-                logger.debug(
-                    f"Pointer increment reached latest: resetting to -1 and executing.."
-                )
+                logger.debug(f"Pointer increment reached latest: resetting to -1")
                 self.command_index_pointer = -1
-                self.execute_next()
-            else:
-                command_pointed = self.command_logs[self.command_index_pointer]
-                logger.debug(
-                    f"Pointer re-oriented to '{command_pointed=}' at '{self.command_index_pointer}'"
-                )
-                self.command_index_pointer += 1
-                self.evaluate_command(command_pointed)
-                self.execute_next()
+                return
+            self.step()
+
+    def step(self) -> None:
+        """
+        Executes the single command at command_index_pointer and moves the pointer past it.
+        A jump inside the command re-orients the pointer to the label instead.
+        """
+        if self.watchdog is not None:
+            self.watchdog.tick()
+        command_pointed = self.command_logs[self.command_index_pointer]
+        logger.debug(
+            f"Pointer re-oriented to '{command_pointed=}' at '{self.command_index_pointer}'"
+        )
+        self.command_index_pointer += 1
+        self.evaluate_command(command_pointed, self.command_index_pointer - 1)
 
     def revaluate_suspension(self) -> None:
         """
@@ -110,6 +197,136 @@ class Interpreter:
         self.command_logs.append(command)
         return True
 
+    def compact_history(self) -> None:
+        """
+        Compact the command history when it's due, between two commands entered
+        """
+        if self.history is not None and self.history.due(len(self.command_logs)):
+            self.history.compact(self)
+
+    def run(self, max_steps: Optional[int] = None, until: str = "") -> Tuple[str, int]:
+        """
+        Execute the commands entered so far at full speed with the trace output off,
+        from the start or where the previous run paused.
+        max_steps: Pause after that many commands. until: Stop on reaching the label.
+        Returns: (status, commands executed), status: halted (HLT), completed (ran past
+        the last command), paused (max_steps), reached (until) or waiting (undefined label)
+        """
+        state = self.state
+        until_index = self.labels_map.get(until) if until else None
+        verbose, state.verbose = state.verbose, False
+        state.halted = False
+        self.command_index_pointer = self.run_pointer
+        steps, status = 0, "completed"
+        # A loop holding the until label is stepped, to stop there
+        loops = {
+            head: loop
+            for head, loop in self.fused_loops().items()
+            if until_index is None or not head <= until_index < head + loop.size
+        }
+        try:
+            while self.command_index_pointer < len(self.command_logs):
+                if max_steps is not None and steps >= max_steps:
+                    status = "paused"
+                    break
+                if steps and self.command_index_pointer == until_index:
+                    status = "reached"
+                    break
+                if loops:
+                    fused = self.fuse(
+                        loops, None if max_steps is None else max_steps - steps
+                    )
+                    if fused:
+                        steps += fused
+                        continue
+                self.step()
+                steps += 1
+                if state.halted:
+                    status = "halted"
+                    break
+                if self.is_execution_suspended:
+                    status = "waiting"
+                    break
+        finally:
+            state.verbose = verbose
+            if self.observer is not None:
+                self.observer.flush()
+        self.run_pointer = 0
+        if status in ("paused", "reached"):
+            self.run_pointer = self.command_index_pointer
+        self.command_index_pointer = -1
+        self.is_execution_suspended = False
+        return status, steps
+
+    def fused_loops(self) -> Dict[int, FusedLoop]:
+        """
+        Fusable loops of the commands by head index, none while the trace output,
+        tracer, profiler, heatmap or sampler need to see every command
+        """
+        if (
+            not self.fusion
+            or self.state.verbose
+            or self.tracer is not None
+            or self.profiler is not None
+            or self.heatmap is not None
+            or self.sampler is not None
+        ):
+            return {}
+        commands = self.command_logs
+        scanned, length, loops = self.scanned_loops
+        if scanned is not commands or length != len(commands):
+            loops = find_loops(commands)
+            self.scanned_loops = (commands, len(commands), loops)
+        return loops
+
+    def fuse(self, loops: Dict[int, FusedLoop], max_steps: Optional[int] = None) -> int:
+        """
+        When the pointer is at the head of a fused loop, run as many of its iterations in one go
+        as max_steps, the watchdog's next check and limits and the next scheduled event allow.
+        Returns: Commands executed, 0 when the command at the pointer is to be stepped.
+        """
+        loop = loops.get(self.command_index_pointer)
+        if loop is None or self.state.halted:
+            return 0
+        state = self.state
+        remaining = loop.iterations(state)
+        iterations = remaining
+        if max_steps is not None:
+            iterations = min(iterations, max_steps // loop.size)
+        if self.watchdog is not None:
+            instructions, jumps = self.watchdog.allowance(loop.label)
+            iterations = min(iterations, instructions // loop.size)
+            if jumps is not None and jumps < min(iterations, remaining - 1):
+                iterations = jumps
+        if self.next_event_cycle != float("inf"):
+            # No command may end on or past the event, it's serviced after stepping to it
+            room = self.next_event_cycle - state.cycles - 1
+            iterations = min(iterations, int(room // loop.cycles_taken))
+        if iterations <= 0:
+            return 0
+        loop.execute(state, iterations, remaining)
+        finished = iterations == remaining
+        state.cycles += iterations * loop.cycles_taken
+        if finished:
+            state.cycles += loop.cycles_exit - loop.cycles_taken
+        commands = iterations * loop.size
+        if self.watchdog is not None:
+            self.watchdog.advance(commands, loop.label, iterations - finished)
+        if self.observer is not None:
+            self.observer.step(commands)
+        self.command_index_pointer = loop.head + loop.size if finished else loop.head
+        logger.debug(f"Fused {iterations} iterations of {loop}")
+        return commands
+
+    def abort_execution(self) -> None:
+        """
+        Drop whatever was running (after a guard tripped), the next command added executes normally
+        """
+        self.command_index_pointer = -1
+        self.run_pointer = 0
+        self.is_execution_suspended = False
+        self.waiting_label = ""
+
     def suspend_execution(self, label: str):
         """
         When a jump instruction referneces a label not yet defined. This function is called to suspend execution.
@@ -119,25 +336,131 @@ class Interpreter:
         self.waiting_label = label
         self.is_execution_suspended = True
 
-    def evaluate_command(self, command: Command) -> None:
+    def evaluate_command(self, command: Command, index: int) -> None:
         """
         Wrapper to command.eval function to interpret its return value.
         It then sets value of command_pointer, waiting_label and is_execution_suspended.
+        The caller (execute_next) carries on executing from the re-oriented pointer.
+        index: Position of the command in command_logs, for the trace.
         """
         if command.label:
-            print(f"\n\t{command.label}:")
-        label = command.eval()
+            self.state.echo(f"\n\t{command.label}:")
+        if self.tracer is not None:
+            self.tracer.before(self.state)
+        if self.heatmap is not None:
+            self.heatmap.record(command, self.state)
+        label = command.eval(self.state)
+        if self.tracer is not None:
+            self.tracer.record(index, command.name, self.state)
         logger.debug(f"Command '{command}' evaluation complete. Got '{label=}'")
-        if not label:
-            return
+        cycles = command.cycles if label is None else command.cycles_taken
+        self.state.cycles += cycles
+        if self.profiler is not None:
+            self.profiler.record(index, cycles, label is not None)
+        if self.sampler is not None:
+            self.sampler.record(index, command, label is not None, self.state)
+        if self.observer is not None:
+            self.observer.step()
 
-        if label in self.labels_map:
+        # RET gives back the index to resume at
+        if isinstance(label, int):
+            logger.debug(f"Returning to command at '{label}'")
+            self.command_index_pointer = label
+        elif label in self.labels_map:
             logger.debug(f"Jumping to '{label=}' at '{self.labels_map[label]}'")
             self.command_index_pointer = self.labels_map[label]
-            self.execute_next()
-        else:
+            if self.watchdog is not None:
+                self.watchdog.jump(label)
+        elif label:
             logger.debug(
                 f"Jumping failed to '{label=}', Suspending Execution until then.."
             )
             self.is_execution_suspended = True
             self.waiting_label = label
+
+        if (
+            self.state.cycles >= self.next_event_cycle
+            and not self.is_execution_suspended
+        ):
+            self.service_events()
+
+    def request_interrupt(self, name: str) -> None:
+        """
+        Raise an interrupt line, it's acknowledged after the current command
+        once enabled and unmasked (TRAP always is)
+        """
+        logger.debug(f"Interrupt '{name}' requested at cycle {self.state.cycles}")
+        self.state.pending_interrupts.add(name)
+        self.next_event_cycle = self.state.cycles
+
+    def service_events(self) -> None:
+        """
+        Fire the due scheduled events, then acknowledge the highest priority interrupt
+        """
+        self.scheduler.run_due()
+        state = self.state
+        for name in INTERRUPTS:
+            if name not in state.pending_interrupts:
+                continue
+            if name != "TRAP" and (
+                not state.interrupts_enabled or state.interrupt_masks[name]
+            ):
+                continue
+            state.pending_interrupts.discard(name)
+            if name not in self.labels_map:
+                logger.warning(
+                    f"Interrupt '{name}' ignored: no '{name}:' label defined"
+                )
+                continue
+            # Resume at the next command, in the repl that's the next one typed
+            resume_index = self.command_index_pointer
+            if resume_index == -1:
+                resume_index = len(self.command_logs)
+            state.return_stack.append(resume_index)
+            # An interrupt brings the processor out of HLT
+            state.halted = False
+            state.interrupts_enabled = False
+            state.cycles += INTERRUPT_ACK_CYCLES
+            self.command_index_pointer = self.labels_map[name]
+            state.echo(f"\n\t{name} acknowledged at cycle {state.cycles}")
+            break
+        self.scheduler.update_next_cycle()
+
+
+def cmd_preprocessor(cmd: str) -> Optional[Command]:
+    """
+    Convert tokens to types, Return a (shared) Command object.
+    """
+    # Preproces commas to space
+    cmd = cmd.replace(",", " ")
+
+    cmd_list = tuple([item.strip() for item in cmd.split(" ") if item])
+    logger.debug(f"Splitted commands: {cmd_list}")
+
+    # Preproces comments
+    cmd_list = process_comments(cmd_list)
+    if not cmd_list:
+        logger.debug(f"Statements composed of solely of comments, ending evaluation.")
+        return
+
+    # Preproces labels
+    label = ""
+    if is_label(cmd_list[0]):
+        label = cmd_list[0][:-1]
+        cmd_list = cmd_list[1:]
+
+    if not cmd_list:
+        logger.error(f"Command incomplete: only found label '{label}:'")
+        return
+
+    first, second = 0, 1
+    cmdname, cmdargs = cmd_list[first], cmd_list[second:]
+    if cmdname not in COMMANDS:
+        logger.error(f"Command '{cmdname}' not found.")
+        return None
+    p_cmdargs = process_instruction_args(cmdname, cmdargs)
+    if cmdargs and not p_cmdargs:
+        return None
+    else:
+        logger.debug(f"Command {cmdname} found.")
+        return Command.intern(cmdname, p_cmdargs, label=label)
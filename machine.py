@@ -0,0 +1,422 @@
+"""
+Headless 8085 machine to embed the interpreter in python programs.
+"""
+import functools
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, Optional, Union
+
+from loguru import logger
+
+from interpreter import Interpreter, cmd_preprocessor
+from guards import Watchdog, ExecutionLimitExceeded, COMPLETED
+from state_model import State
+from scheduler import EventScheduler
+from ports import PortDevice, PortMap, Port
+from tracer import TraceRecorder
+from profiler import Profiler
+from diagnostics import QueuedJsonWriter, Sampler
+from observers import StateObserver, Subscriber, FRAME, BATCH
+from heatmap import Heatmap
+from session import save_session, restore_session
+from dirty import Marker, Changes, mark, changes_since
+from memory_map import map_rom, map_device, unmap, format_regions
+from data import REGISTERS
+
+# Modules whose loguru records are switched off while running headless
+SIMULATOR_MODULES = (
+    "command_model",
+    "converter",
+    "custom_dictionaries",
+    "interpreter",
+    "machine",
+    "memory_map",
+    "ports",
+    "scheduler",
+    "session",
+    "state_model",
+    "tracer",
+)
+
+
+# Whether the simulator modules' records are switched on right now
+logging_enabled = True
+
+
+def set_logging(enabled: bool) -> None:
+    """
+    Switch the loguru records of the simulator modules on or off
+    """
+    global logging_enabled
+    logging_enabled = enabled
+    for module in SIMULATOR_MODULES:
+        if enabled:
+            logger.enable(module)
+        else:
+            logger.disable(module)
+
+
+@contextmanager
+def scoped_logging(enabled: bool) -> Iterator[None]:
+    """
+    The simulator modules' records on or off inside the with block only, as they were after
+    """
+    previous = logging_enabled
+    if enabled == previous:
+        yield
+        return
+    set_logging(enabled)
+    try:
+        yield
+    finally:
+        set_logging(previous)
+
+
+def logged(method: Callable) -> Callable:
+    """
+    Run a Machine (or MultiMachine) method with the records switched as its log option says
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with scoped_logging(self.log):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def snapshot(state: State, error: str = "") -> dict:
+    """
+    Plain ints/bools copy of the registers, flags and written memory of a state
+    error: Name of the exception that stopped the execution, if any
+    """
+    memory = state.memory
+    return {
+        "registers": {reg: int(state.registers[reg], 16) for reg in REGISTERS},
+        "flags": dict(state.flags),
+        "memory": {address: memory.buffer[address] for address in memory.written},
+        "error": error,
+    }
+
+
+class Machine:
+    """
+    Facade over Interpreter and State that never prints, logs or touches files unless asked.
+
+    Unlike the repl, load() only adds the program, nothing runs until run() or step().
+    The interpreter's command_index_pointer is used as the program counter here,
+    it starts at the first loaded command instead of following the latest one.
+    """
+
+    def __init__(self, verbose: bool = False, log: bool = False):
+        """
+        verbose : Print the usual instruction trace
+        log     : Keep the loguru records of the simulator modules while this machine runs,
+                  the other machines and the rest of the process keep their own setting
+        """
+        self.log = log
+        self.interpreter: Interpreter = Interpreter()
+        self.interpreter.command_index_pointer = 0
+        self.interpreter.state.verbose = verbose
+        # OUT to a port without a device is captured, see output()
+        self.interpreter.state.ports = PortMap(capture=True)
+        self.steps: int = 0
+        self.report: str = ""
+
+    @property
+    def state(self) -> State:
+        return self.interpreter.state
+
+    @property
+    def scheduler(self) -> EventScheduler:
+        return self.interpreter.scheduler
+
+    @property
+    def cycles(self) -> int:
+        return self.state.cycles
+
+    @logged
+    def load(self, source: Union[str, Iterable[str]]) -> int:
+        """
+        Parse the program (a string or lines) and append it to the loaded commands.
+        Returns: int: Number of commands added. Raises ValueError on an invalid line.
+        """
+        lines = source.splitlines() if isinstance(source, str) else source
+        added = 0
+        for line_no, line in enumerate(lines, start=1):
+            if not line.split(";")[0].strip():
+                continue
+            cmd = cmd_preprocessor(line)
+            if cmd is None or not cmd.is_valid:
+                raise ValueError(
+                    f"Invalid instruction at line {line_no}: '{line.strip()}'"
+                )
+            if not self.interpreter.add_command(cmd):
+                raise ValueError(f"Duplicate label at line {line_no}: '{cmd.label}'")
+            added += 1
+        return added
+
+    @property
+    def finished(self) -> bool:
+        """
+        True once the program counter has run past the last loaded command or HLT halted it
+        """
+        return self.state.halted or self.interpreter.command_index_pointer >= len(
+            self.interpreter.command_logs
+        )
+
+    @logged
+    def step(self) -> bool:
+        """
+        Execute the next command. Returns: bool: False when there was nothing left to execute.
+        """
+        if self.finished:
+            return False
+        self.interpreter.step()
+        self.steps += 1
+        if self.interpreter.is_execution_suspended:
+            label = self.interpreter.waiting_label
+            self.interpreter.is_execution_suspended = False
+            self.interpreter.command_index_pointer = len(self.interpreter.command_logs)
+            raise ValueError(f"Jump to undefined label '{label}'")
+        return True
+
+    @logged
+    def run(
+        self,
+        max_steps: Optional[int] = None,
+        timeout: Optional[float] = None,
+        max_memory_mb: Optional[float] = None,
+        max_loop_iterations: Optional[int] = None,
+    ) -> str:
+        """
+        Execute until the end of the program or until one of the guards trips.
+        Returns: str: guards.COMPLETED or the status of the limit that stopped the run,
+        self.report then tells why (with the hottest loop). A stopped run can be resumed.
+        """
+        self.report = ""
+        self.interpreter.watchdog = Watchdog(
+            max_steps, timeout, max_memory_mb, max_loop_iterations
+        )
+        # Countdown, fill and copy loops run in bulk, see fusion.py
+        loops = self.interpreter.fused_loops()
+        try:
+            while True:
+                fused = self.interpreter.fuse(loops) if loops else 0
+                if fused:
+                    self.steps += fused
+                elif not self.step():
+                    break
+        except ExecutionLimitExceeded as e:
+            self.report = str(e)
+            return e.status
+        finally:
+            self.interpreter.watchdog = None
+            self.state.ports.flush()
+            if self.interpreter.observer is not None:
+                self.interpreter.observer.flush()
+        return COMPLETED
+
+    @logged
+    def register(self, name: str) -> int:
+        return int(self.state.registers[name], 16)
+
+    @logged
+    def set_register(self, name: str, value: int) -> None:
+        self.state.registers[name] = f"0x{value & 0xFF:02x}"
+
+    @logged
+    def register_pair(self, name: str) -> int:
+        """
+        16-bit value held by register pair B (BC), D (DE) or H (HL)
+        """
+        return self.state.get_register_pair(name)
+
+    @property
+    @logged
+    def registers(self) -> Dict[str, int]:
+        return {name: self.register(name) for name in REGISTERS}
+
+    def flag(self, name: str) -> bool:
+        return self.state.flags[name]
+
+    @property
+    def flags(self) -> Dict[str, bool]:
+        return dict(self.state.flags)
+
+    @logged
+    def read_memory(self, address: int) -> int:
+        """
+        The byte a load from address gets: mapped devices and unmapped pages (FFH) included,
+        0 where nothing was written
+        """
+        value = self.state.memory.read_byte(address)
+        return 0 if value is None else value
+
+    @logged
+    def write_memory(self, address: int, value: int) -> None:
+        self.state.memory[f"0x{address:04x}"] = f"0x{value & 0xFF:02x}"
+
+    @logged
+    def load_memory(self, address: int, data: bytes) -> None:
+        self.state.load_memory(address, data)
+
+    @logged
+    def dump_memory(self, address: int, length: int) -> bytes:
+        return self.state.dump_memory(address, length)
+
+    @property
+    def memory(self) -> Dict[int, int]:
+        """
+        Written memory addresses and their values
+        """
+        buffer = self.state.memory.buffer
+        return {address: buffer[address] for address in self.state.memory.written}
+
+    def attach(self, port: Port, device: PortDevice) -> PortDevice:
+        """
+        Attach a device (ports.RingBuffer, FileSink, CallbackDevice, StdinSource ...) to a port
+        """
+        return self.state.ports.attach(port, device)
+
+    def output(self, port: Port) -> bytes:
+        """
+        Values written with OUT to a port (the last ports.FLUSH_SIZE of them)
+        """
+        return self.state.ports.output(port)
+
+    def mark(self) -> Marker:
+        """
+        Remember the current state, changes(marker) then tells what changed since
+        """
+        return mark(self.state)
+
+    def changes(self, marker: Marker) -> Changes:
+        """
+        Registers, flags and memory changed since the marker: name/address -> (old, new)
+        """
+        return changes_since(self.state, marker)
+
+    def start_trace(self, filename: str) -> None:
+        """
+        Record every executed instruction to a binary trace file, see tracer.read_trace
+        """
+        self.stop_trace()
+        self.interpreter.tracer = TraceRecorder(filename)
+
+    def stop_trace(self) -> None:
+        if self.interpreter.tracer is not None:
+            self.interpreter.tracer.close()
+            self.interpreter.tracer = None
+
+    def start_sampling(
+        self, filename: str, every: int = 0, jumps: bool = False, flags: bool = False
+    ) -> None:
+        """
+        Append JSON records of every Nth instruction, jumps taken and flag changes to a file,
+        written by a background thread, see diagnostics.Sampler
+        """
+        self.stop_sampling()
+        writer = QueuedJsonWriter(filename)
+        self.interpreter.sampler = Sampler(writer, every, jumps, flags)
+
+    def stop_sampling(self) -> None:
+        if self.interpreter.sampler is not None:
+            self.interpreter.sampler.writer.close()
+            self.interpreter.sampler = None
+
+    def observe(
+        self, subscriber: Subscriber, frame: float = FRAME, batch: int = BATCH
+    ) -> StateObserver:
+        """
+        Send subscriber the register, flag, memory and port output changes,
+        coalesced to one update per frame seconds, see observers.StateObserver
+        """
+        if self.interpreter.observer is None:
+            self.interpreter.observer = StateObserver(self.state, frame, batch)
+        self.interpreter.observer.subscribe(subscriber)
+        return self.interpreter.observer
+
+    def stop_observing(self) -> None:
+        if self.interpreter.observer is not None:
+            self.interpreter.observer.close()
+            self.interpreter.observer = None
+
+    def start_profile(self) -> Profiler:
+        """
+        Count executions, T-states and jumps taken of every loaded command from now on
+        """
+        self.interpreter.profiler = Profiler(len(self.interpreter.command_logs) + 1)
+        return self.interpreter.profiler
+
+    def stop_profile(self) -> None:
+        self.interpreter.profiler = None
+
+    def profile_report(self) -> str:
+        """
+        Annotated listing of the program with its hot lines and loops
+        """
+        if self.interpreter.profiler is None:
+            return ""
+        return self.interpreter.profiler.annotate(
+            self.interpreter.command_logs, self.interpreter.labels_map
+        )
+
+    def start_heatmap(self) -> Heatmap:
+        """
+        Count memory reads and writes per address from now on, see heatmap.Heatmap
+        """
+        self.interpreter.heatmap = Heatmap()
+        return self.interpreter.heatmap
+
+    def stop_heatmap(self) -> None:
+        self.interpreter.heatmap = None
+
+    @logged
+    def save(self, file_db: str) -> None:
+        self.state.save(file_db)
+
+    @logged
+    def restore(self, file_db: str) -> None:
+        self.state.restore(file_db)
+
+    @logged
+    def save_image(self, filename: str) -> None:
+        """
+        Save the whole session (state, program and position in it) to a single file
+        """
+        save_session(self.interpreter, filename)
+
+    @logged
+    def restore_image(self, filename: str) -> None:
+        restore_session(self.interpreter, filename)
+
+    @logged
+    def map_rom(self, address: int, data: bytes) -> None:
+        """
+        Load data at address as ROM, writes to its pages are rejected
+        """
+        map_rom(self.state.memory, address, data)
+
+    @logged
+    def map_device(
+        self,
+        address: int,
+        size: int,
+        read: Callable[[int], int],
+        write: Callable[[int, int], None],
+    ) -> None:
+        """
+        Memory mapped device on the pages of address..address+size,
+        read(offset) -> byte and write(offset, byte) get the offset into the window
+        """
+        map_device(self.state.memory, address, size, read, write)
+
+    @logged
+    def unmap(self, address: int, size: int) -> None:
+        """
+        Leave the pages of a range unmapped: reads FFH, writes dropped
+        """
+        unmap(self.state.memory, address, size)
+
+    def memory_map(self) -> str:
+        return format_regions(self.state.memory)
@@ -1,29 +1,72 @@
 """
 An 8085 interpreter written in Python.
 """
+import os
 import sys
 import readline
-from typing import Optional
+from typing import Dict, List, Optional, Union
 
 from loguru import logger
 
-from command_model import Command
 from state_model import State
-from interpreter import Interpreter
-from data import COMMANDS
+from interpreter import Interpreter, cmd_preprocessor
+from command_model import Command
+from data import REPL_COMMANDS, SESSION_IMAGE_EXTENSION
 from messages import msg_welcome, msg_help
-from converter import (
-    process_instruction_args,
-    is_label,
-    process_cmd_line_args,
-    process_comments,
-)
+from converter import process_cmd_line_args, process_hex, hex_to_simple
+from guards import Watchdog, ExecutionLimitExceeded
+from tracer import TraceRecorder
+from profiler import Profiler
+from diagnostics import Sampler, split_spec
+from history import History
+from host_profile import host_profile, MODES as PROFILE_MODES
+from heatmap import Heatmap
+from session import save_session, restore_session
+from dirty import mark, changes_since, format_changes
+from ports import RingBuffer, ConsoleSink, StdinSource, FileSink, port_key
 
+# OUT values per port shown in a run summary, the latest ones
+OUT_SHOWN = 16
 
-def main(commands: tuple = tuple(), file_db: str = "", indirect_mode: bool = False):
+
+def main(
+    commands: tuple = tuple(),
+    file_db: str = "",
+    indirect_mode: bool = False,
+    watchdog: Optional[Watchdog] = None,
+    trace_file: str = "",
+    sampler: Optional[Sampler] = None,
+    history: Optional[History] = None,
+):
     interpreter = Interpreter()
+    interpreter.watchdog = watchdog
+    interpreter.sampler = sampler
+    interpreter.history = history
+    interpreter.diff_marker = mark(interpreter.state)
+    if trace_file:
+        interpreter.tracer = TraceRecorder(trace_file)
+    if file_db.endswith(SESSION_IMAGE_EXTENSION) and os.path.exists(file_db):
+        try:
+            restore_session(interpreter, file_db)
+        except (OSError, ValueError) as e:
+            logger.error(e)
+            exit(1)
+    try:
+        run_session(interpreter, commands, file_db, indirect_mode)
+    finally:
+        if interpreter.tracer is not None:
+            interpreter.tracer.close()
+
+
+def run_session(
+    interpreter: Interpreter, commands: tuple, file_db: str, indirect_mode: bool
+):
     for command in commands:
-        process_command(command, interpreter, file_db)
+        try:
+            process_command(command, interpreter, file_db)
+        except ExecutionLimitExceeded as e:
+            # In batch mode a runaway program ends the run with the limit's exit code
+            exit(e.exit_code)
 
     if not commands:
         if not indirect_mode:
@@ -33,79 +76,346 @@ def main(commands: tuple = tuple(), file_db: str = "", indirect_mode: bool = Fal
                 command = input(">>> ") if not indirect_mode else input("")
                 process_command(command, interpreter, file_db)
                 readline.add_history(command)
+            except ExecutionLimitExceeded:
+                readline.add_history(command)
             except EOFError:
                 return
 
 
-def process_command(command: str, interpreter: Interpreter, file_db: str):
+def process_command(
+    command: Union[str, Command], interpreter: Interpreter, file_db: str
+):
     """
     Interface to fork between 8085 commands and special repl commands
     For 8085 commands, calls preprocessor and interpreter add to list command
     """
-    interpreter.state.restore(file_db)
+    if not file_db.endswith(SESSION_IMAGE_EXTENSION):
+        interpreter.state.restore(file_db)
     logger.debug(f"Command received: {command}")
-    if command == "help":
+    if isinstance(command, Command):
+        # Decoded ahead from the program cache (-f), skips the preprocessor
+        add_and_execute(command, interpreter, file_db)
+    elif command == "help":
         msg_help()
     elif command == "quit":
+        interpreter.state.ports.close()
         exit(0)
     elif command == "inspect":
         interpreter.state.inspect()
+    elif command == "diff":
+        print(format_changes(changes_since(interpreter.state, interpreter.diff_marker)))
+        interpreter.diff_marker = mark(interpreter.state)
     elif command.strip() == "":
         return
+    elif command.split()[0] in ("load", "dump"):
+        process_memory_command(command, interpreter.state)
+    elif command.split()[0] == "port":
+        process_port_command(command, interpreter.state)
+    elif command.split()[0] == "profile":
+        process_profile_command(command, interpreter)
+    elif command.split()[0] == "heatmap":
+        process_heatmap_command(command, interpreter)
+    elif command.split()[0] in ("run", "until"):
+        process_run_command(command, interpreter, file_db)
     else:
-        cmd = cmd_preprocessor(command, interpreter.state)
+        cmd = cmd_preprocessor(command)
         if cmd and cmd.is_valid:
-            if interpreter.add_command(cmd):
-                interpreter.execute_next()
-    interpreter.state.save(file_db)
+            add_and_execute(cmd, interpreter, file_db)
+    save_file_db(interpreter, file_db)
+
+
+def add_and_execute(command: Command, interpreter: Interpreter, file_db: str) -> None:
+    if interpreter.add_command(command):
+        try:
+            execute_guarded(interpreter, file_db)
+        finally:
+            # Port output of the whole run goes out in one batch
+            interpreter.state.ports.flush()
+            interpreter.compact_history()
 
 
-def cmd_preprocessor(cmd: str, state: State) -> Optional[Command]:
+def save_file_db(interpreter: Interpreter, file_db: str) -> None:
     """
-    Convert tokens to types, Return a Command object.
+    Save the registers and memory to a json file db, or the whole session to a .img one
     """
-    # Preproces commas to space
-    cmd = cmd.replace(",", " ")
+    if file_db.endswith(SESSION_IMAGE_EXTENSION):
+        save_session(interpreter, file_db)
+    else:
+        interpreter.state.save(file_db)
+
 
-    cmd_list = tuple([item.strip() for item in cmd.split(" ") if item])
-    logger.debug(f"Splitted commands: {cmd_list}")
+def execute_guarded(interpreter: Interpreter, file_db: str) -> None:
+    """
+    Execute the latest command, the watchdog limits apply to each command entered.
+    When a limit trips, report it, drop the running loop and keep the state reached.
+    """
+    if interpreter.watchdog is not None:
+        interpreter.watchdog.start()
+    try:
+        interpreter.execute_next()
+    except ExecutionLimitExceeded as e:
+        logger.error(e)
+        interpreter.abort_execution()
+        save_file_db(interpreter, file_db)
+        raise
+    finally:
+        if interpreter.observer is not None:
+            interpreter.observer.flush()
 
-    # Preproces comments
-    cmd_list = process_comments(cmd_list)
-    if not cmd_list:
-        logger.debug(f"Statements composed of solely of comments, ending evaluation.")
+
+def process_run_command(command: str, interpreter: Interpreter, file_db: str) -> None:
+    """
+    Full speed run repl commands, the trace is off and a summary is printed at the end
+    run           : Run the commands entered so far, from the start (or where a run paused)
+    run <N>       : Run N commands and pause
+    until <LABEL> : Run until reaching the label
+    """
+    name, *cmdargs = command.split()
+    max_steps, until = None, ""
+    if name == "until":
+        if len(cmdargs) != 1:
+            logger.error(
+                f"Invalid number of arguments for 'until': {REPL_COMMANDS[name]}"
+            )
+            return
+        until = cmdargs[0]
+        if until not in interpreter.labels_map:
+            logger.error(f"No label '{until}' defined")
+            return
+    elif len(cmdargs) > 1 or (cmdargs and not cmdargs[0].isdigit()):
+        logger.error(f"Invalid argument for 'run': {REPL_COMMANDS[name]}")
         return
+    elif cmdargs:
+        max_steps = int(cmdargs[0])
 
-    # Preproces labels
-    label = ""
-    if is_label(cmd_list[0]):
-        label = cmd_list[0][:-1]
-        cmd_list = cmd_list[1:]
+    ports = interpreter.state.ports
+    ports.recorded = {}
+    cycles = interpreter.state.cycles
+    if interpreter.watchdog is not None:
+        interpreter.watchdog.start()
+    try:
+        status, steps = interpreter.run(max_steps, until)
+    except ExecutionLimitExceeded as e:
+        logger.error(e)
+        interpreter.abort_execution()
+        save_file_db(interpreter, file_db)
+        raise
+    finally:
+        recorded, ports.recorded = ports.recorded, None
+        ports.flush()
+    print(
+        format_run_summary(
+            interpreter, status, steps, interpreter.state.cycles - cycles, recorded
+        )
+    )
+
+
+def format_run_summary(
+    interpreter: Interpreter,
+    status: str,
+    steps: int,
+    cycles: int,
+    recorded: Dict[str, List[int]],
+) -> str:
+    """
+    What a run did: why it stopped, commands and T-states, registers, flags and OUT values
+    """
+    state = interpreter.state
+    if status == "halted":
+        headline = "Halted"
+    elif status == "completed":
+        headline = "Ran to the end of the program"
+    elif status == "waiting":
+        headline = f"Stopped: jump to undefined label '{interpreter.waiting_label}'"
+    else:
+        command = interpreter.command_logs[interpreter.run_pointer]
+        headline = f"Paused before '{command}' ('run' continues)"
+    registers = " ".join(
+        f"{reg}: {hex_to_simple(value)}" for reg, value in state.registers.items()
+    )
+    flags = state.flags
+    lines = [
+        f"{headline} after {steps} commands, {cycles} T-states",
+        registers,
+        f"FLAGS: CY->{int(flags['carry'])}, S->{int(flags['sign'])}, Z->{int(flags['zero'])}",
+    ]
+    for port, values in recorded.items():
+        shown = " ".join(f"{value:02X}H" for value in values[-OUT_SHOWN:])
+        more = (
+            f" (last {OUT_SHOWN} of {len(values)})" if len(values) > OUT_SHOWN else ""
+        )
+        lines.append(f"{port}: {shown}{more}")
+    return "\n".join(lines)
 
-    if not cmd_list:
-        logger.error(f"Command incomplete: only found label '{label}:'")
+
+def process_memory_command(command: str, state: State) -> None:
+    """
+    Bulk memory repl commands
+    load <FILENAME> <ADDRESS>          : Load binary/hex text file to memory at address
+    dump <FILENAME> <ADDRESS> <LENGTH> : Dump memory range to binary/hex text file
+    """
+    name, *cmdargs = command.split()
+    expected_args = 2 if name == "load" else 3
+    if len(cmdargs) != expected_args:
+        logger.error(f"Invalid number of arguments for '{name}': {REPL_COMMANDS[name]}")
+        return
+    filename, numbers = cmdargs[0], [process_hex(arg) for arg in cmdargs[1:]]
+    if not all(numbers):
         return
+    address, *length = [int(number, 16) for number in numbers]
+    try:
+        if name == "load":
+            loaded = state.load_memory_file(filename, address)
+            if loaded is not None:
+                print(f"Loaded {loaded} bytes to {address:04X}H")
+        else:
+            state.dump_memory_file(filename, address, length[0])
+            print(f"Dumped {length[0]} bytes from {address:04X}H to {filename}")
+    except (IndexError, OSError) as e:
+        logger.error(e)
 
-    first, second = 0, 1
-    cmdname, cmdargs = cmd_list[first], cmd_list[second:]
-    if cmdname not in COMMANDS:
-        logger.error(f"Command '{cmdname}' not found.")
-        return None
-    p_cmdargs = process_instruction_args(cmdname, cmdargs)
-    if cmdargs and not p_cmdargs:
-        return None
+
+def process_port_command(command: str, state: State) -> None:
+    """
+    I/O port repl command
+    port                   : Show the devices attached to the ports
+    port <PORT>            : Show the values captured on a port (ring)
+    port <PORT> <DEVICE>   : Attach ring, console, stdin or a file sink (FILENAME), off detaches
+    """
+    _, *cmdargs = command.split()
+    ports = state.ports
+    if not cmdargs:
+        for port, device in ports.devices.items():
+            print(f"{port}: {device}")
+        return
+    if len(cmdargs) > 2:
+        logger.error(f"Invalid number of arguments for 'port': {REPL_COMMANDS['port']}")
+        return
+    port = port_key(cmdargs[0])
+    if len(cmdargs) == 1:
+        if not isinstance(ports.devices.get(port), RingBuffer):
+            logger.error(f"No ring buffer attached to '{port}'")
+            return
+        print(f"{port}: {' '.join(f'{value:02X}H' for value in ports.output(port))}")
+        return
+
+    device = cmdargs[1]
+    if device == "off":
+        ports.detach(port)
+        print(f"Detached '{port}'")
+        return
+    devices = {"ring": RingBuffer, "console": ConsoleSink, "stdin": StdinSource}
+    try:
+        attached = ports.attach(
+            port, devices[device]() if device in devices else FileSink(device)
+        )
+    except OSError as e:
+        logger.error(e)
+        return
+    print(f"Attached {attached} to '{port}'")
+
+
+def process_profile_command(command: str, interpreter: Interpreter) -> None:
+    """
+    Source profiler repl command
+    profile     : Show the annotated listing of the commands entered so far
+    profile on  : Start counting (from zero), off stops
+    """
+    _, *cmdargs = command.split()
+    if cmdargs == ["on"]:
+        interpreter.profiler = Profiler()
+        print("Profiling on")
+    elif cmdargs == ["off"]:
+        interpreter.profiler = None
+        print("Profiling off")
+    elif cmdargs:
+        logger.error(f"Invalid argument for 'profile': {REPL_COMMANDS['profile']}")
+    elif interpreter.profiler is None:
+        logger.error("Profiling is off: Use 'profile on' first")
     else:
-        logger.debug(f"Command {cmdname} found.")
-        return Command(cmdname, p_cmdargs, state, label=label)
+        print(
+            interpreter.profiler.annotate(
+                interpreter.command_logs, interpreter.labels_map
+            )
+        )
 
 
-if __name__ == "__main__":
-    args = tuple(sys.argv[1:])
-    args, commands, file_db, indirect_mode = process_cmd_line_args(args, logger)
+def process_heatmap_command(command: str, interpreter: Interpreter) -> None:
+    """
+    Memory heatmap repl command
+    heatmap                 : Report the hot addresses and touched ranges
+    heatmap on/off          : Start counting (from zero) / stop
+    heatmap csv <FILENAME>  : Export address,reads,writes of the touched addresses
+    heatmap grid <FILENAME> : Export the 256x256 grid of accesses
+    """
+    _, *cmdargs = command.split()
+    if cmdargs == ["on"]:
+        interpreter.heatmap = Heatmap()
+        print("Heatmap on")
+        return
+    if cmdargs == ["off"]:
+        interpreter.heatmap = None
+        print("Heatmap off")
+        return
+    heatmap = interpreter.heatmap
+    if len(cmdargs) not in (0, 2) or (cmdargs and cmdargs[0] not in ("csv", "grid")):
+        logger.error(f"Invalid arguments for 'heatmap': {REPL_COMMANDS['heatmap']}")
+    elif heatmap is None:
+        logger.error("Heatmap is off: Use 'heatmap on' first")
+    elif not cmdargs:
+        print(heatmap.report())
+    else:
+        kind, filename = cmdargs
+        try:
+            if kind == "csv":
+                heatmap.export_csv(filename)
+            else:
+                heatmap.export_grid(filename)
+        except OSError as e:
+            logger.error(e)
+            return
+        print(f"Exported heatmap {kind} to {filename}")
+
+
+def run_cli(args: tuple) -> None:
+    (
+        args,
+        commands,
+        file_db,
+        indirect_mode,
+        watchdog,
+        trace_file,
+        sampler,
+        history,
+    ) = process_cmd_line_args(args, logger)
     if args:
         logger.error(
             f"""Invalid argument "{' '.join(args)}": Use "-h" option for help"""
         )
         exit(1)
     logger.debug(f"Got commands {commands} and db file {file_db}")
-    main(commands, file_db, indirect_mode)
+    main(commands, file_db, indirect_mode, watchdog, trace_file, sampler, history)
+
+
+def cli(args: tuple) -> None:
+    """
+    Everything main.py does with its command line, the warm daemon (daemon.py) runs it too
+    """
+    if len(args) > 1 and args[0] == "--profile":
+        # The whole run, argument parsing included, see host_profile.py
+        prefix, mode = split_spec(args[1])
+        mode = mode or "cprofile"
+        if mode not in PROFILE_MODES:
+            print(f"Invalid profile mode '{mode}': Use \"-h\" option for help")
+            exit(1)
+        try:
+            with host_profile(prefix, mode) as profile:
+                run_cli(args[2:])
+        finally:
+            print(profile.report(), file=sys.stderr)
+    else:
+        run_cli(args)
+
+
+if __name__ == "__main__":
+    cli(tuple(sys.argv[1:]))
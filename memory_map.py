@@ -0,0 +1,93 @@
+"""
+Address space layout on top of the MemoryDict page table: ROM, memory mapped device
+windows and unmapped ranges, in whole 256 byte pages. Everything else is RAM.
+
+ROM reads come straight from memory (only writes are checked), device windows send
+both reads and writes to the device, unmapped pages read FFH and drop writes.
+bulk load/dump work on the bytes under the map, that is how a ROM image gets in.
+The map belongs to the memory, it isn't part of a saved state or session image.
+"""
+from typing import Callable, List, Tuple
+
+from loguru import logger
+
+from custom_dictionaries import MemoryDict
+
+# Value read from an unmapped address, nothing drives the data bus
+OPEN_BUS = 0xFF
+
+
+def map_rom(memory: MemoryDict, address: int, data: bytes) -> None:
+    """
+    Load data at address as read only memory, the pages it covers become ROM
+    """
+    memory.load(address, data)
+    page_size = 1 << MemoryDict.PAGE_SHIFT
+    size = -(-len(data) // page_size) * page_size
+
+    def write(address: int, value: int) -> None:
+        # Rewriting the same value (M following HL, restoring a db) isn't an error
+        if value != memory.buffer[address]:
+            logger.error(f"Write of {value:02X}H to ROM at {address:04X}H ignored")
+
+    memory.map_pages(address, size, write=write, kind="rom")
+
+
+def map_device(
+    memory: MemoryDict,
+    address: int,
+    size: int,
+    read: Callable[[int], int],
+    write: Callable[[int, int], None],
+) -> None:
+    """
+    Memory mapped device window, read(offset) -> byte and write(offset, byte)
+    get the offset of the access from address
+    """
+
+    def read_window(accessed: int) -> int:
+        return read(accessed - address)
+
+    def write_window(accessed: int, value: int) -> None:
+        write(accessed - address, value)
+
+    memory.map_pages(address, size, read_window, write_window, kind="device")
+
+
+def unmap(memory: MemoryDict, address: int, size: int) -> None:
+    """
+    Leave a range unmapped, reads return FFH and writes are dropped
+    """
+
+    def write(address: int, value: int) -> None:
+        logger.error(f"Write of {value:02X}H to unmapped {address:04X}H ignored")
+
+    memory.map_pages(address, size, lambda address: OPEN_BUS, write, kind="unmapped")
+
+
+def map_ram(memory: MemoryDict, address: int, size: int) -> None:
+    """
+    Make a range plain RAM again
+    """
+    memory.map_pages(address, size)
+
+
+def regions(memory: MemoryDict) -> List[Tuple[int, int, str]]:
+    """
+    The layout as (first address, last address, kind) ranges
+    """
+    layout: List[Tuple[int, int, str]] = []
+    for page, kind in enumerate(memory.page_kinds):
+        start = page << MemoryDict.PAGE_SHIFT
+        end = start + (1 << MemoryDict.PAGE_SHIFT) - 1
+        if layout and layout[-1][2] == kind:
+            layout[-1] = (layout[-1][0], end, kind)
+        else:
+            layout.append((start, end, kind))
+    return layout
+
+
+def format_regions(memory: MemoryDict) -> str:
+    return "\n".join(
+        f"{start:04X}H-{end:04X}H {kind}" for start, end, kind in regions(memory)
+    )
@@ -1,6 +1,6 @@
 from rich import print
 
-from data import COMMANDS
+from data import COMMANDS, REPL_COMMANDS
 
 
 def msg_welcome():
@@ -14,6 +14,9 @@ def msg_help():
     """
     for cmdname, cmd in COMMANDS.items():
         print(cmdname + " - " + cmd["description"])
+    print("\nREPL commands:")
+    for cmdname, description in REPL_COMMANDS.items():
+        print(cmdname + " - " + description)
 
 
 def msg_cli_help():
@@ -23,8 +26,13 @@ def msg_cli_help():
     options = [
         ":8085 Interpreter:\n",
         "help | --help | -h: Display this message",
+        "--profile <PREFIX>: Profile the simulator, writes PREFIX.pstats and PREFIX.collapsed, PREFIX:sample to sample",
         "-i                : Run in indirect mode, dont display welcome msg and >>> prompt",
         "-v <d/i/w/e>      : Verbosity option use (d,i,w,e) for (DEBUG, INFO, WARNING, ERROR) resp.",
+        "-w <LIMITS>       : Stop runaway programs, limits per command: steps=N,time=SECONDS,memory=MB,loop=N",
+        "-t <FILENAME>     : Record a binary trace of every executed instruction, read it with tracer.py",
+        "-l <FILE:OPTIONS> : Queued JSON log instead of debug.log, options: every=N,jumps,flags,level=L,MODULE=L",
+        "-H <N>            : Keep at most N commands of history, dropping the ones that can't run again",
         "-db <FILENAME>    : Run in file db mode save and restore after each cmd from file",
         "-f <FILENAME>     : Read command/commands from file",
         '-c "cmd1;cmd2"    : Run cmd directly, separate with ";" for more than one commands',
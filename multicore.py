@@ -0,0 +1,213 @@
+"""
+Several 8085 cores sharing one memory, for shared memory algorithms (mutual exclusion,
+producer/consumer, barriers) and for stress testing them under different interleavings.
+
+Every core is a Machine with its own program, registers, flags, T-states, ports and
+scheduler. Their States use the same MemoryDict, so a store by one core is seen by the
+next load of another, memory mapped devices included. The cores take turns: each runs
+up to quantum instructions (1 interleaves instruction by instruction), round after round.
+
+Bus contention (optional): a data memory access (M operands, LDA/STA, LDAX/STAX) holds
+the bus for a machine cycle (BUS_CYCLE T-states). After every round, a core that made
+memory accesses waits one machine cycle for each access the other cores made in the
+round, up to its own number, and the wait states are added to its T-states.
+
+multi = MultiMachine(cores=4, quantum=10, contention=True)
+multi.load(0, "MVI A 01H\\nSTA 2050H\\nHLT")
+multi.load(1, "WAIT: LDA 2050H\\nCPI 01H\\nJNZ WAIT\\nHLT")
+multi.run(max_steps=100_000)    # -> 'completed'
+"""
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from machine import Machine, logged
+from interpreter import Interpreter
+from command_model import Command
+from custom_dictionaries import MemoryDict
+from fusion import FusedLoop
+from guards import COMPLETED, INSTRUCTION_LIMIT
+
+# T-states of one memory read or write machine cycle
+BUS_CYCLE = 3
+# Data memory accesses of the instructions addressing memory directly or through a pair
+PAIR_ACCESSES = {"LDA": 1, "STA": 1, "LDAX": 1, "STAX": 1}
+
+
+def data_accesses(command: Command) -> int:
+    """
+    Memory reads and writes of an instruction, besides fetching it (INR M/DCR M do both)
+    """
+    if command.name in PAIR_ACCESSES:
+        return PAIR_ACCESSES[command.name]
+    if "M" not in command.args:
+        return 0
+    return 2 if command.name in ("INR", "DCR") else 1
+
+
+class MultiMachine:
+    """
+    cores: Number of cores, more are added with add_core()
+    quantum: Instructions a core runs in its turn
+    contention: Add bus wait states to the T-states of the cores
+    log: Keep the loguru records of the simulator modules while the cores run
+    """
+
+    def __init__(
+        self,
+        cores: int = 2,
+        quantum: int = 1,
+        contention: bool = False,
+        log: bool = False,
+    ):
+        if quantum < 1:
+            raise ValueError(f"Invalid quantum {quantum}: At least one instruction")
+        self.quantum = quantum
+        self.contention = contention
+        self.log = log
+        self.cores: List[Machine] = []
+        # Wait states and data memory accesses per core
+        self.stalls: List[int] = []
+        self.accesses: List[int] = []
+        self.steps: int = 0
+        self.report: str = ""
+        for _ in range(cores):
+            self.add_core()
+
+    @property
+    def memory(self) -> MemoryDict:
+        return self.cores[0].state.memory
+
+    def add_core(self) -> Machine:
+        """
+        A new core on the shared memory
+        """
+        core = Machine(log=self.log)
+        if self.cores:
+            core.state.memory = self.memory
+        self.cores.append(core)
+        self.stalls.append(0)
+        self.accesses.append(0)
+        return core
+
+    def load(self, core: int, source: Union[str, Iterable[str]]) -> int:
+        """
+        Add a program to a core, see Machine.load
+        """
+        return self.cores[core].load(source)
+
+    @property
+    def finished(self) -> bool:
+        return all(core.finished for core in self.cores)
+
+    @logged
+    def run(self, max_steps: Optional[int] = None) -> str:
+        """
+        Run the cores in turns until all of them finished (ran past their program or
+        halted), or max_steps instructions of all cores together ran in this call.
+        Returns: guards.COMPLETED or guards.INSTRUCTION_LIMIT, self.report tells which cores were left
+        """
+        self.report = ""
+        quantum = self.quantum
+        # Per core: its interpreter, fused loops and data accesses by command index
+        contexts = []
+        for core in self.cores:
+            interpreter = core.interpreter
+            accesses = [data_accesses(command) for command in interpreter.command_logs]
+            loops = interpreter.fused_loops()
+            loop_accesses = {
+                head: sum(accesses[head : head + loop.size])
+                for head, loop in loops.items()
+            }
+            contexts.append((core, interpreter, accesses, loops, loop_accesses))
+        round_accesses = [0] * len(self.cores)
+        start = self.steps
+        try:
+            while True:
+                # The budget first: with none left nothing runs, like Machine.run
+                if max_steps is not None and self.steps - start >= max_steps:
+                    if self.finished:
+                        break
+                    running = [
+                        str(index)
+                        for index, core in enumerate(self.cores)
+                        if not core.finished
+                    ]
+                    self.report = (
+                        f"Execution stopped after {self.steps - start} instructions: "
+                        f"instruction limit of {max_steps} reached, "
+                        f"cores {', '.join(running)} running"
+                    )
+                    return INSTRUCTION_LIMIT
+                ran = 0
+                for index, context in enumerate(contexts):
+                    core, interpreter, accesses, loops, loop_accesses = context
+                    turn = quantum
+                    if max_steps is not None:
+                        turn = min(turn, max_steps - (self.steps - start) - ran)
+                    executed, bus = self.run_turn(
+                        core, interpreter, accesses, loops, loop_accesses, turn
+                    )
+                    ran += executed
+                    round_accesses[index] = bus
+                self.steps += ran
+                self.account(round_accesses)
+                if not ran:
+                    break
+        finally:
+            for core in self.cores:
+                core.state.ports.flush()
+        return COMPLETED
+
+    def run_turn(
+        self,
+        core: Machine,
+        interpreter: Interpreter,
+        accesses: List[int],
+        loops: Dict[int, FusedLoop],
+        loop_accesses: Dict[int, int],
+        turn: int,
+    ) -> Tuple[int, int]:
+        """
+        Run up to turn instructions of a core. Returns: (instructions, data memory accesses)
+        """
+        executed = bus = 0
+        while executed < turn and not core.finished:
+            pointer = interpreter.command_index_pointer
+            if pointer in loops:
+                fused = interpreter.fuse(loops, turn - executed)
+                if fused:
+                    bus += fused // loops[pointer].size * loop_accesses[pointer]
+                    core.steps += fused
+                    executed += fused
+                    continue
+            bus += accesses[pointer]
+            core.step()
+            executed += 1
+        return executed, bus
+
+    def account(self, round_accesses: List[int]) -> None:
+        """
+        Bus wait states of a round, see the module docstring
+        """
+        total = sum(round_accesses)
+        for index, own in enumerate(round_accesses):
+            self.accesses[index] += own
+            if not self.contention or not own:
+                continue
+            stall = min(own, total - own) * BUS_CYCLE
+            self.stalls[index] += stall
+            self.cores[index].state.cycles += stall
+
+    def summary(self) -> str:
+        """
+        Instructions, T-states, memory accesses and wait states per core
+        """
+        lines = [f"{self.steps} instructions on {len(self.cores)} cores"]
+        for index, core in enumerate(self.cores):
+            state = "halted" if core.state.halted else "finished"
+            if not core.finished:
+                state = "running"
+            lines.append(
+                f"  core {index}: {core.steps} instructions, {core.cycles} T-states, "
+                f"{self.accesses[index]} memory accesses, {self.stalls[index]} wait states ({state})"
+            )
+        return "\n".join(lines)
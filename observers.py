@@ -0,0 +1,94 @@
+"""
+Coalesced change events for front-ends (GUIs, web views) that show a running State.
+
+Instead of a callback per register write, subscribers get one update per display frame:
+what changed since the previous update, in the dirty.changes_since format, plus the
+values written to every port (OUT) in between. The interpreter only counts the executed
+commands, the clock is looked at every batch commands and an update is made once a frame
+has passed, so a tight loop costs a counter increment per command.
+The end of a run (and every command typed in the repl) also sends what's pending.
+
+observer = machine.observe(lambda update: view.refresh(update), frame=1 / 30)
+machine.run()
+# update: {"registers": {"A": (0, 5)}, "flags": {"zero": (False, True)},
+#          "memory": {0x2050: (None, 5)}, "ports": {"01H": [1, 2]}, "steps": 1024, "cycles": 7168}
+"""
+import time
+from typing import Callable, Dict, List
+
+from dirty import Changes, mark, changes_since
+from ports import port_key, Port
+from state_model import State
+
+# Seconds between two updates, a 60 Hz display
+FRAME = 1 / 60
+# Commands between two looks at the clock
+BATCH = 1024
+
+Subscriber = Callable[[Changes], None]
+
+
+class StateObserver:
+    """
+    Subscribers get the changes of the state, at most once per frame seconds
+    """
+
+    def __init__(self, state: State, frame: float = FRAME, batch: int = BATCH):
+        self.state = state
+        self.frame = frame
+        self.batch = batch
+        self.subscribers: List[Subscriber] = []
+        self.marker = mark(state)
+        self.ports: Dict[str, List[int]] = {}
+        self.steps = 0
+        self.next_check = batch
+        self.next_frame = time.monotonic() + frame
+        self.cycles = state.cycles
+        state.ports.listeners.append(self.port_written)
+
+    def subscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.remove(subscriber)
+
+    def close(self) -> None:
+        """
+        Send what's pending and stop listening to the ports
+        """
+        self.flush()
+        if self.port_written in self.state.ports.listeners:
+            self.state.ports.listeners.remove(self.port_written)
+
+    def port_written(self, port: Port, value: int) -> None:
+        self.ports.setdefault(port_key(port), []).append(value)
+
+    def step(self, commands: int = 1) -> None:
+        """
+        Count executed commands, update the subscribers once a frame has passed
+        """
+        self.steps += commands
+        if self.steps < self.next_check:
+            return
+        self.next_check = self.steps + self.batch
+        if time.monotonic() >= self.next_frame:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Send the changes since the previous update, if there are any
+        """
+        state = self.state
+        changes = changes_since(state, self.marker)
+        if self.ports or any(changes.values()):
+            changes["ports"] = self.ports
+            changes["steps"] = self.steps
+            changes["cycles"] = state.cycles - self.cycles
+            for subscriber in self.subscribers:
+                subscriber(changes)
+        self.marker = mark(state)
+        self.ports = {}
+        self.steps = 0
+        self.next_check = self.batch
+        self.cycles = state.cycles
+        self.next_frame = time.monotonic() + self.frame
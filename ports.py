@@ -0,0 +1,274 @@
+"""
+I/O port map of the 8085, OUT writes to and IN reads from the device attached to a port.
+
+Ports are named like in the programs: PORT0, PORT1 or a hex port number (05H).
+Sinks batch their writes, a high rate OUT loop reaches the terminal or the file
+once per flush() instead of once per byte.
+
+ports = state.ports
+ports.attach("PORT0", RingBuffer())
+ports.attach(0x05, FileSink("out.bin"))
+ports.attach("PORT1", StdinSource())    # IN PORT1 asks for a byte
+"""
+import sys
+from collections import deque
+from typing import Callable, Dict, List, Optional, TextIO, Union
+
+from loguru import logger
+
+Port = Union[str, int]
+
+# Values buffered by the sinks before they write through
+FLUSH_SIZE = 4096
+
+
+def port_key(port: Port) -> str:
+    """
+    Normalized port name: 5, '5', '5H', '05h' -> '05H', 'port0' -> 'PORT0'
+    Only tokens starting with a digit are port numbers, 'A' stays a name.
+    """
+    if isinstance(port, int):
+        return f"{port & 0xFF:02X}H"
+    port = port.upper()
+    if port[:1].isdigit():
+        try:
+            return f"{int(port[:-1] if port.endswith('H') else port, 16) & 0xFF:02X}H"
+        except ValueError:
+            pass
+    return port
+
+
+class PortDevice:
+    """
+    Base device, sinks implement write() and sources read()
+    """
+
+    def write(self, port: str, value: int) -> None:
+        logger.error(f"OUT: Device on '{port}' is input only")
+
+    def read(self, port: str) -> Optional[int]:
+        logger.error(f"IN: Device on '{port}' is output only")
+        return None
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class RingBuffer(PortDevice):
+    """
+    Keeps the last size values written, for tests and graders to inspect
+    """
+
+    def __init__(self, size: int = FLUSH_SIZE):
+        self.values: deque = deque(maxlen=size)
+
+    def write(self, port: str, value: int) -> None:
+        self.values.append(value)
+
+    def getvalue(self) -> bytes:
+        return bytes(self.values)
+
+    def clear(self) -> None:
+        self.values.clear()
+
+    def __repr__(self) -> str:
+        return f"RingBuffer({len(self.values)}/{self.values.maxlen})"
+
+
+class FileSink(PortDevice):
+    """
+    Appends the raw bytes written to a file, one write per batch
+    """
+
+    def __init__(self, filename: str, batch: int = FLUSH_SIZE):
+        self.filename = filename
+        self.batch = batch
+        self.pending = bytearray()
+        self.file = open(filename, "ab")
+
+    def write(self, port: str, value: int) -> None:
+        self.pending.append(value)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.pending:
+            self.file.write(self.pending)
+            self.file.flush()
+            self.pending.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+    def __repr__(self) -> str:
+        return f"FileSink('{self.filename}')"
+
+
+class ConsoleSink(PortDevice):
+    """
+    Prints 'PORT: value' lines, joined into one terminal write per batch
+    (to sys.stdout as it is when flushing, without a stream)
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, batch: int = 256):
+        self.stream = stream
+        self.batch = batch
+        self.lines = []
+
+    def write(self, port: str, value: int) -> None:
+        self.lines.append(f"{port}: {value:02X}H\n")
+        if len(self.lines) >= self.batch:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.lines:
+            stream = self.stream or sys.stdout
+            stream.write("".join(self.lines))
+            stream.flush()
+            self.lines.clear()
+
+    def __repr__(self) -> str:
+        return "ConsoleSink()"
+
+
+class CallbackDevice(PortDevice):
+    """
+    Hands every OUT value to on_write(port, value), IN takes its value from on_read(port)
+    """
+
+    def __init__(
+        self,
+        on_write: Optional[Callable[[str, int], None]] = None,
+        on_read: Optional[Callable[[str], int]] = None,
+    ):
+        self.on_write = on_write
+        self.on_read = on_read
+
+    def write(self, port: str, value: int) -> None:
+        if self.on_write is None:
+            return super().write(port, value)
+        self.on_write(port, value)
+
+    def read(self, port: str) -> Optional[int]:
+        if self.on_read is None:
+            return super().read(port)
+        return self.on_read(port) & 0xFF
+
+    def __repr__(self) -> str:
+        return f"CallbackDevice({self.on_write}, {self.on_read})"
+
+
+class StdinSource(PortDevice):
+    """
+    IN reads a hex byte (05H, 5) per line from a stream, asking for it on a terminal
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None):
+        self.stream = stream
+
+    def read(self, port: str) -> Optional[int]:
+        stream = self.stream or sys.stdin
+        if stream.isatty():
+            print(f"{port} <- ", end="", flush=True)
+        line = stream.readline()
+        if not line:
+            logger.error(f"IN: No more input for '{port}'")
+            return None
+        token = line.strip().upper()
+        if token.endswith("H"):
+            token = token[:-1]
+        try:
+            value = int(token, 16)
+        except ValueError:
+            logger.error(
+                f"IN: Invalid input for '{port}', expected hex byte got '{token}'"
+            )
+            return None
+        if value > 0xFF:
+            logger.error(f"IN: Input for '{port}' doesn't fit a byte: '{token}H'")
+            return None
+        return value
+
+    def __repr__(self) -> str:
+        return "StdinSource()"
+
+
+class PortMap:
+    """
+    Devices attached per port. With capture, OUT to a port without a device
+    is kept in a RingBuffer created for it, so the output can be read back later.
+    console: Where the repl trace shows OUT to a port without a device, batched like the sinks.
+    """
+
+    def __init__(self, capture: bool = False):
+        self.devices: Dict[str, PortDevice] = {}
+        self.capture = capture
+        # Port -> values written, while a run records them for its summary
+        self.recorded: Optional[Dict[str, List[int]]] = None
+        # Called with (port, value) on every write, see observers.StateObserver
+        self.listeners: List[Callable[[str, int], None]] = []
+        self.console: ConsoleSink = ConsoleSink()
+
+    def attach(self, port: Port, device: PortDevice) -> PortDevice:
+        key = port_key(port)
+        self.detach(key)
+        self.devices[key] = device
+        logger.debug(f"Attached {device} to '{key}'")
+        return device
+
+    def detach(self, port: Port) -> Optional[PortDevice]:
+        device = self.devices.pop(port_key(port), None)
+        if device is not None:
+            device.close()
+        return device
+
+    def write(self, port: Port, value: int) -> None:
+        key = port_key(port)
+        if self.recorded is not None:
+            self.recorded.setdefault(key, []).append(value)
+        for listener in self.listeners:
+            listener(key, value)
+        device = self.devices.get(key)
+        if device is None:
+            if not self.capture:
+                return
+            device = self.devices[key] = RingBuffer()
+        device.write(key, value)
+
+    def attached(self, port: Port) -> bool:
+        return port_key(port) in self.devices
+
+    def read(self, port: Port) -> Optional[int]:
+        """
+        Returns: int/None: Byte from the device on the port, None if there's none
+        """
+        key = port_key(port)
+        device = self.devices.get(key)
+        if device is None:
+            logger.error(f"IN: No input device attached to '{key}'")
+            return None
+        return device.read(key)
+
+    def output(self, port: Port) -> bytes:
+        """
+        Values captured by the RingBuffer on a port
+        """
+        device = self.devices.get(port_key(port))
+        if not isinstance(device, RingBuffer):
+            return b""
+        return device.getvalue()
+
+    def flush(self) -> None:
+        self.console.flush()
+        for device in self.devices.values():
+            device.flush()
+
+    def close(self) -> None:
+        self.console.flush()
+        for device in self.devices.values():
+            device.close()
+        self.devices.clear()
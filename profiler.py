@@ -0,0 +1,139 @@
+"""
+Per command execution profile of an 8085 program: executions, T-states and jumps taken.
+
+The counters are lists indexed like Interpreter.command_logs, preallocated and grown
+in blocks, so recording a step is three list updates.
+
+python profiler.py program.txt
+"""
+import sys
+import argparse
+from typing import Dict, List, Tuple
+
+from command_model import Command
+from data import COMMANDS
+
+# Counters are (re)allocated in blocks of this many commands
+BLOCK_SIZE = 1024
+# Share of the T-states marking a line as hot in the listing
+HOT_SHARE = 0.1
+
+
+class Profiler:
+    def __init__(self, size: int = BLOCK_SIZE):
+        self.counts: List[int] = [0] * size
+        self.cycles: List[int] = [0] * size
+        self.taken: List[int] = [0] * size
+
+    def record(self, index: int, cycles: int, taken: bool) -> None:
+        """
+        Count one execution of command_logs[index], taken: a jump was taken
+        """
+        if index >= len(self.counts):
+            self.grow(index + 1)
+        self.counts[index] += 1
+        self.cycles[index] += cycles
+        if taken:
+            self.taken[index] += 1
+
+    def grow(self, size: int) -> None:
+        """
+        Counters for at least size commands, the ones entered after profiling started too
+        """
+        if size <= len(self.counts):
+            return
+        extra = [0] * (-(-size // BLOCK_SIZE) * BLOCK_SIZE - len(self.counts))
+        self.counts += extra
+        self.cycles += extra
+        self.taken += extra
+
+    def compact(self, keep: List[bool]) -> None:
+        """
+        Drop the counters of the commands the history compaction dropped, see history.py
+        """
+        for name in ("counts", "cycles", "taken"):
+            counters = getattr(self, name)
+            kept = [counter for counter, flag in zip(counters, keep) if flag]
+            setattr(self, name, kept + [0] * (len(counters) - len(kept)))
+
+    def reset(self) -> None:
+        size = len(self.counts)
+        self.counts, self.cycles, self.taken = [0] * size, [0] * size, [0] * size
+
+    def loops(
+        self, commands: List[Command], labels_map: Dict[str, int]
+    ) -> List[Tuple[str, int, int, int, int]]:
+        """
+        Backward jumps, hottest first. Returns: (label, first index, jump index, T-states, times taken)
+        """
+        self.grow(len(commands))
+        loops = []
+        for index, command in enumerate(commands):
+            if (
+                not command.args
+                or "label" not in COMMANDS[command.name]["parameters"].values()
+            ):
+                continue
+            start = labels_map.get(command.args[0])
+            if start is None or start > index or not self.taken[index]:
+                continue
+            cycles = sum(self.cycles[start : index + 1])
+            loops.append((command.args[0], start, index, cycles, self.taken[index]))
+        return sorted(loops, key=lambda loop: loop[3], reverse=True)
+
+    def annotate(self, commands: List[Command], labels_map: Dict[str, int]) -> str:
+        """
+        The program listing with the share of T-states, executions, T-states and
+        jump taken ratio of every command, like perf annotate. Hot lines get a '>'.
+        """
+        size = len(commands)
+        self.grow(size)
+        total = sum(self.cycles[:size]) or 1
+        steps = sum(self.counts[:size])
+        lines = [
+            f"{steps} instructions, {sum(self.cycles[:size])} T-states",
+            "",
+            f"  {'Percent':>7} {'Count':>9} {'T-states':>10} {'Taken':>6}  Source",
+        ]
+        for index, command in enumerate(commands):
+            count, cycles = self.counts[index], self.cycles[index]
+            share = cycles / total
+            taken = ""
+            if count and COMMANDS[command.name].get("cycles_taken"):
+                taken = f"{self.taken[index] / count:.0%}"
+            percent = f"{share:.1%}" if count else ""
+            marker = ">" if share >= HOT_SHARE else " "
+            lines.append(
+                f"{marker} {percent:>7} {count or '':>9} {cycles or '':>10} {taken:>6}  {command}"
+            )
+        loops = self.loops(commands, labels_map)
+        if loops:
+            lines += ["", "Loops:"]
+        for label, start, end, cycles, taken in loops:
+            lines.append(
+                f"  {label}: commands {start}-{end}, {taken} jumps back, "
+                f"{cycles} T-states ({cycles / total:.1%})"
+            )
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from machine import Machine
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("filename", help="Program, one instruction per line")
+    parser.add_argument("--max-steps", type=int, default=10_000_000)
+    args = parser.parse_args()
+    machine = Machine()
+    try:
+        with open(args.filename) as rf:
+            machine.load(rf.read())
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+    machine.start_profile()
+    status = machine.run(max_steps=args.max_steps)
+    if machine.report:
+        print(machine.report)
+    print(machine.profile_report())
+    sys.exit(0 if status == "completed" else 1)
@@ -0,0 +1,149 @@
+"""
+On disk cache of decoded -f programs, like __pycache__ for python files.
+
+The Commands of a source file are saved in a __8085cache__ directory next to it,
+keyed by the hash of the source, the simulator version and the python (marshal can
+differ between pythons, data.MARSHAL_TAG), so later runs of an unchanged file skip
+tokenizing, validating and building the Commands.
+A source that changed overwrites its entry, entries of other simulator versions
+and of deleted sources are removed when an entry is written.
+
+Layout: MAGIC, then the marshalled (format, version, python, source hash, lines) where a
+line is (name, args, label) for a valid instruction and None for anything else.
+"""
+import os
+import hashlib
+import marshal
+from typing import List, Optional, Tuple
+
+from loguru import logger
+
+from data import VERSION, MARSHAL_TAG, PROGRAM_CACHE_DIR
+from command_model import Command
+from converter import is_repl_command
+from interpreter import cmd_preprocessor
+
+MAGIC = b"8085PRG\x00"
+FORMAT = 2
+EXTENSION = ".prg"
+
+# (name, args, label) of a valid instruction, None for lines run as they are
+Entry = Optional[Tuple[str, tuple, str]]
+
+
+def cache_path(filename: str) -> str:
+    """
+    dir/program.asm -> dir/__8085cache__/program.asm.v0.1.0.cpython-38.prg
+    """
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(
+        directory, PROGRAM_CACHE_DIR, f"{name}.v{VERSION}.{MARSHAL_TAG}{EXTENSION}"
+    )
+
+
+def source_hash(lines: tuple) -> bytes:
+    return hashlib.sha256("\n".join(lines).encode("utf-8")).digest()
+
+
+def compile_lines(lines: tuple) -> List[Entry]:
+    """
+    Decode the instruction lines, the rest (repl commands, invalid lines) run as text
+    and report their errors when they are run
+    """
+    entries: List[Entry] = []
+    modules = ("command_model", "converter", "interpreter")
+    for module in modules:
+        logger.disable(module)
+    try:
+        for line in lines:
+            command = None
+            if line.strip() and not is_repl_command(line):
+                command = cmd_preprocessor(line)
+            if command and command.is_valid:
+                entries.append((command.name, command.args, command.label))
+            else:
+                entries.append(None)
+    finally:
+        for module in modules:
+            logger.enable(module)
+    return entries
+
+
+def read_entries(path: str, digest: bytes, size: int) -> Optional[List[Entry]]:
+    """
+    Entries of a cache file, None if missing or stale
+    """
+    try:
+        with open(path, "rb") as rf:
+            data = rf.read()
+    except OSError:
+        return None
+    if not data.startswith(MAGIC):
+        return None
+    try:
+        cache_format, version, python, cached_digest, entries = marshal.loads(
+            data[len(MAGIC) :]
+        )
+    except (EOFError, ValueError, TypeError):
+        return None
+    key = (cache_format, version, python, cached_digest)
+    if key != (FORMAT, VERSION, MARSHAL_TAG, digest):
+        return None
+    if len(entries) != size:
+        return None
+    return entries
+
+
+def write_entries(path: str, digest: bytes, entries: List[Entry]) -> None:
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside and renamed, so a concurrent run never reads half a file
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as wf:
+            wf.write(
+                MAGIC + marshal.dumps((FORMAT, VERSION, MARSHAL_TAG, digest, entries))
+            )
+        os.replace(temporary, path)
+    except OSError as e:
+        logger.debug(f"Program cache not written: {e}")
+        return
+    evict(os.path.dirname(path))
+
+
+def evict(directory: str) -> None:
+    """
+    Remove the entries of other simulator versions and of sources that no longer exist,
+    the ones of other pythons are kept for them
+    """
+    source_directory = os.path.dirname(directory)
+    for name in os.listdir(directory):
+        if not name.endswith(EXTENSION):
+            continue
+        source, version, _ = name.rpartition(f".v{VERSION}.")
+        if version and os.path.exists(os.path.join(source_directory, source)):
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+            logger.debug(f"Evicted program cache entry {name}")
+        except OSError:
+            pass
+
+
+def load_program(filename: str, lines: tuple) -> tuple:
+    """
+    The lines of a -f program with the instructions replaced by their (shared) Commands,
+    decoded from the cache when the file is unchanged
+    """
+    digest = source_hash(lines)
+    path = cache_path(filename)
+    entries = read_entries(path, digest, len(lines))
+    if entries is None:
+        logger.debug(f"Program cache miss for {filename}")
+        entries = compile_lines(lines)
+        write_entries(path, digest, entries)
+    return tuple(
+        line
+        if entry is None
+        else Command.intern(entry[0], tuple(entry[1]), label=entry[2], is_valid=True)
+        for line, entry in zip(lines, entries)
+    )
@@ -0,0 +1,124 @@
+"""
+Cycle driven event scheduler for timed interrupts and peripherals.
+
+Events are kept in a heap ordered by the T-state count they are due at, so the
+interpreter only compares its cycle counter against the earliest one after each
+instruction instead of polling every device.
+
+scheduler = interpreter.scheduler
+scheduler.schedule_interrupt(1000, "RST7.5", period=1000)  # a 1000 T-state timer tick
+"""
+import heapq
+import itertools
+from typing import Callable, List, Optional, Tuple, TYPE_CHECKING
+
+from loguru import logger
+
+from data import INTERRUPTS
+
+if TYPE_CHECKING:
+    from interpreter import Interpreter
+
+# (due cycle, sequence number, event), the sequence keeps same cycle events in scheduling order
+Entry = Tuple[int, int, "Event"]
+
+
+class Event:
+    """
+    A callback due at a cycle count, rescheduled every period T-states when periodic
+    """
+
+    __slots__ = ("due", "callback", "period", "cancelled")
+
+    def __init__(self, due: int, callback: Callable[[], None], period: Optional[int]):
+        self.due = due
+        self.callback = callback
+        self.period = period
+        self.cancelled = False
+
+    def __repr__(self) -> str:
+        return f"Event(due={self.due}, period={self.period}, callback={self.callback})"
+
+
+class EventScheduler:
+    def __init__(self, interpreter: "Interpreter"):
+        """
+        Scheduler bound to an interpreter, its state.cycles is the clock.
+        It keeps interpreter.next_event_cycle at the cycle the interpreter must call back at.
+        """
+        self.interpreter = interpreter
+        self.queue: List[Entry] = []
+        self.counter = itertools.count()
+
+    @property
+    def now(self) -> int:
+        return self.interpreter.state.cycles
+
+    def schedule(
+        self,
+        delay: int,
+        callback: Callable[[], None],
+        period: Optional[int] = None,
+    ) -> Event:
+        """
+        Run callback once delay T-states from now, then every period T-states if given.
+        Returns: Event: Handle to cancel() it.
+        """
+        if delay < 0 or (period is not None and period <= 0):
+            raise ValueError(f"Invalid event timing: {delay=}, {period=}")
+        event = Event(self.now + delay, callback, period)
+        heapq.heappush(self.queue, (event.due, next(self.counter), event))
+        logger.debug(f"Scheduled {event}")
+        self.update_next_cycle()
+        return event
+
+    def schedule_interrupt(
+        self, delay: int, name: str, period: Optional[int] = None
+    ) -> Event:
+        """
+        Raise interrupt name (TRAP, RST7.5, RST6.5, RST5.5) after delay T-states
+        """
+        if name not in INTERRUPTS:
+            raise ValueError(
+                f"Unknown interrupt '{name}', expected one of {INTERRUPTS}"
+            )
+        return self.schedule(
+            delay, lambda: self.interpreter.request_interrupt(name), period
+        )
+
+    def cancel(self, event: Event) -> None:
+        """
+        Drop an event, it's skipped when it comes out of the heap
+        """
+        event.cancelled = True
+
+    def run_due(self) -> None:
+        """
+        Fire every event due at the current cycle count, periodic ones go back in the heap
+        """
+        now = self.now
+        while self.queue and self.queue[0][0] <= now:
+            _, _, event = heapq.heappop(self.queue)
+            if event.cancelled:
+                continue
+            logger.debug(f"Firing {event} at cycle {now}")
+            if event.period is not None:
+                event.due += event.period
+                heapq.heappush(self.queue, (event.due, next(self.counter), event))
+            event.callback()
+        self.update_next_cycle()
+
+    def update_next_cycle(self) -> None:
+        """
+        Earliest cycle the interpreter has to service events at.
+        While interrupts are pending (masked or disabled) it checks after every instruction.
+        """
+        if self.interpreter.state.pending_interrupts:
+            self.interpreter.next_event_cycle = self.now
+        elif self.queue:
+            self.interpreter.next_event_cycle = self.queue[0][0]
+        else:
+            self.interpreter.next_event_cycle = float("inf")
+
+    def __len__(self) -> int:
+        return sum(not event.cancelled for _, _, event in self.queue)
@@ -0,0 +1,113 @@
+"""
+Single file image of a whole session: machine state, the parsed program and where
+the interpreter is in it, so a session resumes without replaying its commands.
+
+Layout: MAGIC, header (format version, python tag length, metadata length), the python tag
+(data.MARSHAL_TAG), the marshalled metadata (plain python values) then the 64 KiB memory
+buffer as raw bytes. Marshal isn't stable across pythons, an image from another one is rejected.
+Port devices, scheduled events, the memory map and the watchdog aren't part of the image.
+"""
+import marshal
+import struct
+
+from loguru import logger
+
+from command_model import Command
+from interpreter import Interpreter
+from custom_dictionaries import MemoryDict
+from data import MARSHAL_TAG
+
+MAGIC = b"8085IMG\x00"
+VERSION = 2
+HEADER = struct.Struct("<HBI")
+
+
+def save_session(interpreter: Interpreter, filename: str) -> None:
+    state = interpreter.state
+    metadata = marshal.dumps(
+        {
+            "registers": dict(state.registers.data),
+            "flags": dict(state.flags),
+            "written": list(state.memory.written),
+            "cycles": state.cycles,
+            "halted": state.halted,
+            "interrupts_enabled": state.interrupts_enabled,
+            "interrupt_masks": dict(state.interrupt_masks),
+            "pending_interrupts": sorted(state.pending_interrupts),
+            "return_stack": list(state.return_stack),
+            "program": [
+                (command.name, command.args, command.label)
+                for command in interpreter.command_logs
+            ],
+            "labels_map": dict(interpreter.labels_map),
+            "command_index_pointer": interpreter.command_index_pointer,
+            "is_execution_suspended": interpreter.is_execution_suspended,
+            "waiting_label": interpreter.waiting_label,
+            "run_pointer": interpreter.run_pointer,
+        }
+    )
+    with open(filename, "wb") as wf:
+        tag = MARSHAL_TAG.encode()
+        wf.write(MAGIC + HEADER.pack(VERSION, len(tag), len(metadata)))
+        wf.write(tag + metadata)
+        wf.write(state.memory.buffer)
+    logger.debug(f"Saved session image to {filename}")
+
+
+def restore_session(interpreter: Interpreter, filename: str) -> None:
+    """
+    Load the image into interpreter (and its state) in place.
+    Raises ValueError for a file that isn't a session image of this version and python.
+    """
+    with open(filename, "rb") as rf:
+        image = rf.read()
+    if not image.startswith(MAGIC):
+        raise ValueError(f"Not a session image: '{filename}'")
+    version, tag_size, metadata_size = HEADER.unpack_from(image, len(MAGIC))
+    if version != VERSION:
+        raise ValueError(f"Unsupported session image version {version}: '{filename}'")
+    offset = len(MAGIC) + HEADER.size
+    tag = image[offset : offset + tag_size].decode(errors="replace")
+    if tag != MARSHAL_TAG:
+        raise ValueError(
+            f"Session image saved by {tag}, this is {MARSHAL_TAG}: '{filename}'"
+        )
+    offset += tag_size
+    metadata = marshal.loads(image[offset : offset + metadata_size])
+    buffer = image[offset + metadata_size :]
+    if len(buffer) != MemoryDict.SIZE:
+        raise ValueError(f"Truncated session image: '{filename}'")
+
+    state = interpreter.state
+    memory = MemoryDict()
+    memory.buffer[:] = buffer
+    memory.written = dict.fromkeys(metadata["written"])
+    memory.take_map(state.memory)
+    state.memory = memory
+    state.registers.data = metadata["registers"]
+    state.flags = metadata["flags"]
+    state.cycles = metadata["cycles"]
+    state.halted = metadata["halted"]
+    state.interrupts_enabled = metadata["interrupts_enabled"]
+    state.interrupt_masks = metadata["interrupt_masks"]
+    state.pending_interrupts = set(metadata["pending_interrupts"])
+    state.return_stack = metadata["return_stack"]
+
+    # The program was validated when it was entered, interning only rebuilds the objects
+    interpreter.command_logs = [
+        Command.intern(name, tuple(args), label=label, is_valid=True)
+        for name, args, label in metadata["program"]
+    ]
+    interpreter.labels_map = metadata["labels_map"]
+    interpreter.command_index_pointer = metadata["command_index_pointer"]
+    interpreter.is_execution_suspended = metadata["is_execution_suspended"]
+    interpreter.waiting_label = metadata["waiting_label"]
+    interpreter.run_pointer = metadata["run_pointer"]
+    # What was derived from the replaced program: its loops and profile counters
+    interpreter.scanned_loops = (None, 0, {})
+    if interpreter.profiler is not None:
+        interpreter.profiler.reset()
+    interpreter.scheduler.update_next_cycle()
+    logger.debug(
+        f"Restored session image {filename}: {len(interpreter.command_logs)} commands"
+    )
@@ -3,12 +3,14 @@ State of Registers and Memory of 8085.
 """
 import os
 import json
-from typing import Dict
+from typing import Dict, List, Optional, Set
 
 from loguru import logger
 
-from data import REGISTER_PAIRS
+from data import REGISTER_PAIRS, INTERRUPTS
 from custom_dictionaries import RegisterDict, MemoryDict
+from converter import read_memory_file, write_memory_file
+from ports import PortMap
 
 
 class State:
@@ -46,6 +48,29 @@ class State:
             "zero": False,
             "sign": False,
         }
+        # T-states executed since the start
+        self.cycles: int = 0
+        # Set by HLT, entered commands are only added until the program is run again
+        self.halted: bool = False
+        # Interrupt state, like after a reset: disabled and the RST lines masked (TRAP can't be)
+        self.interrupts_enabled: bool = False
+        self.interrupt_masks: Dict[str, bool] = {
+            name: True for name in INTERRUPTS if name != "TRAP"
+        }
+        self.pending_interrupts: Set[str] = set()
+        # Command indexes to resume at after the service routines (RET pops)
+        self.return_stack: List[int] = []
+        # Devices attached to the I/O ports (OUT/IN), not part of the saved state
+        self.ports: PortMap = PortMap()
+        # Print the trace of each executed instruction, turned off for headless use
+        self.verbose: bool = True
+
+    def echo(self, *args) -> None:
+        """
+        Print the trace output of an instruction unless running silently
+        """
+        if self.verbose:
+            print(*args)
 
     def get_mem_addr_register_pair(self, register: str) -> str:
         """
@@ -77,18 +102,48 @@ class State:
         """
         Takes a 16 bit value and splits it between register pairs
         """
-        REG1, REG2 = REGISTER_PAIRS[register]
-        # Distribute the 16-bit hex in value literally half half to H and L
-        # value -> 5533H --> '0x5533' -> [-2:] -> '0x55', '33' -> '0x' + '33'
         assert len(value) == 6
-        # value -> '0x5455', first_hex = 0x54 second = '0x' + 55
-        first_hex, second_hex = value[:-2], "0x" + value[-2:]
-        self.registers[REG1] = first_hex
-        self.registers[REG2] = second_hex
-        # Special case for M register
-        if register == "H":
-            self.registers["M"] = self.get_register_pair_value("H")
-        logger.debug(f"Pair {REG1}{REG2} Loaded: {first_hex}, {second_hex}")
+        self.set_register_pair(register, int(value, 16))
+        logger.debug(f"Pair {register} Loaded: {value}")
+
+    def get_register(self, register: str) -> int:
+        """
+        Value of a register as an int, M reads the byte at HL (0 if never written)
+        """
+        if register == "M":
+            value = self.memory.read_byte(self.get_register_pair("H"))
+            return 0 if value is None else value
+        return int(self.registers.data[register], 16)
+
+    def set_register(self, register: str, value: int) -> None:
+        # M goes through the register dict, which stores it to memory at HL
+        if register == "M":
+            self.registers["M"] = f"0x{value:02x}"
+        else:
+            self.registers.data[register] = f"0x{value:02x}"
+
+    def get_register_pair(self, register: str) -> int:
+        """
+        The memory address held by a register pair as an int, same as
+        int(get_mem_addr_register_pair(register), 16)
+        """
+        REG1, REG2 = REGISTER_PAIRS[register]
+        high = int(self.registers.data[REG1], 16)
+        low = int(self.registers.data[REG2], 16)
+        # The pair is the two hex strings joined, a low register above FF takes more digits
+        return high << 4 * len(f"{low:02x}") | low
+
+    def set_register_pair(self, register: str, value: int) -> None:
+        """
+        Takes a 16 bit value and splits it between register pairs
+        """
+        assert value <= 0xFFFF
+        REG1, REG2 = REGISTER_PAIRS[register]
+        self.registers.data[REG1] = f"0x{value >> 8:02x}"
+        self.registers.data[REG2] = f"0x{value & 0xFF:02x}"
+        # Special case for M register, ROM and device pages aren't touched by moving HL
+        if register == "H" and not self.memory.is_mapped(value):
+            self.set_register("M", self.get_register("M"))
 
     @property
     def accumulator(self) -> str:
@@ -107,6 +162,36 @@ class State:
         formatted_value = f"0x{int(value, 16):02x}"
         self.registers["A"] = formatted_value
 
+    def load_memory(self, address: int, data: bytes) -> None:
+        """
+        Bulk load a block of bytes into memory starting at address
+        """
+        self.memory.load(address, data)
+        logger.debug(f"Loaded {len(data)} bytes to memory at 0x{address:04x}")
+
+    def dump_memory(self, address: int, length: int) -> bytes:
+        """
+        Bulk read length bytes of memory starting at address
+        """
+        return self.memory.dump(address, length)
+
+    def load_memory_file(self, filename: str, address: int) -> Optional[int]:
+        """
+        Load a binary or hex text file into memory at address
+        Returns: int/None: No of bytes loaded, None (error logged) if the file couldn't be read
+        """
+        data = read_memory_file(filename)
+        if data is None:
+            return None
+        self.load_memory(address, data)
+        return len(data)
+
+    def dump_memory_file(self, filename: str, address: int, length: int) -> None:
+        """
+        Dump a memory range to a binary or hex text file
+        """
+        write_memory_file(filename, self.dump_memory(address, length))
+
     def inspect(self) -> None:
         """
         Inspect the State of Registers and Memory
@@ -136,8 +221,10 @@ class State:
         with open(file_db, "r") as rf:
             state_data = json.load(rf)
 
-        self.memory = MemoryDict()
-        self.memory.update(state_data["memory"])
+        memory = MemoryDict()
+        memory.update(state_data["memory"])
+        memory.take_map(self.memory)
+        self.memory = memory
         self.registers = RegisterDict(self)
         self.registers.update(state_data["registers"])
 
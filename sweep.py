@@ -0,0 +1,394 @@
+"""
+Lockstep execution of many machine instances with NumPy, for sweeping a program over inputs.
+
+All instances run the same program, each with its own registers, flags and memory:
+registers : N x 8 (A, B, C, D, E, H, L, M), M is only filled in at the end
+flags     : N x 4 (carry, auxillary_carry, zero, sign)
+memory    : N x 256 arrays, only for the pages that get touched
+
+Instances sitting at the same command execute it together, so diverging branches are
+handled by masking: every round runs the lowest pending command for the instances at it.
+The semantics follow command_model.Command exactly. An instance about to leave the 8-bit
+world (INR of FFH, MVI of a word ...) or to raise is handed over to a scalar Machine
+which finishes it, so the results always match the reference engine.
+
+    from sweep import sweep, product
+    result = sweep("ADI 05H\\nSTA 2060H", {"A": range(256)})
+    result.memory(0x2060)    # -> array of 256 sums
+"""
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from data import REGISTERS, REGISTER_PAIRS
+from custom_dictionaries import MemoryDict
+from machine import Machine, snapshot
+
+FLAGS = ("carry", "auxillary_carry", "zero", "sign")
+CARRY, AUX, ZERO, SIGN = range(4)
+REG_INDEX = {reg: index for index, reg in enumerate(REGISTERS)}
+M = REG_INDEX["M"]
+
+# Registers and flags of a fresh State, its constructor also writes these memory locations
+INITIAL_MEMORY = {0x1000: 0x2B, 0x1001: 0x34, 0x0000: 0x00}
+
+InputKey = Union[str, int]
+
+
+def product(inputs: Dict[InputKey, range]) -> Dict[InputKey, np.ndarray]:
+    """
+    Every combination of the given input values
+    {"B": range(256), 0x2050: range(256)} -> 65536 instances
+    """
+    grids = np.meshgrid(
+        *[np.asarray(values) for values in inputs.values()], indexing="ij"
+    )
+    return {key: grid.ravel() for key, grid in zip(inputs, grids)}
+
+
+class SweepResult:
+    """
+    Final states of all instances of a sweep
+    """
+
+    def __init__(self, engine: "LockstepEngine"):
+        self.engine = engine
+        self.registers: np.ndarray = engine.regs
+        self.flags: np.ndarray = engine.flags
+        self.errors: List[str] = engine.errors
+        self.steps: np.ndarray = engine.steps
+
+    def __len__(self) -> int:
+        return len(self.registers)
+
+    def register(self, name: str) -> np.ndarray:
+        return self.registers[:, REG_INDEX[name]]
+
+    def flag(self, name: str) -> np.ndarray:
+        return self.flags[:, FLAGS.index(name)]
+
+    def memory(self, address: int) -> np.ndarray:
+        """
+        Value at address for every instance (0 where never written)
+        """
+        everyone = np.arange(len(self))
+        return self.engine.read(everyone, np.full(len(self), address))
+
+    def state(self, index: int) -> dict:
+        """
+        Final state of one instance, in the same form as machine.snapshot
+        """
+        engine = self.engine
+        memory = {}
+        for page in sorted(engine.pages):
+            offsets = np.flatnonzero(engine.touched[page][index])
+            for offset in offsets:
+                memory[page << 8 | int(offset)] = int(engine.pages[page][index, offset])
+        return {
+            "registers": {
+                reg: int(self.registers[index, col]) for reg, col in REG_INDEX.items()
+            },
+            "flags": {
+                flag: bool(self.flags[index, col]) for col, flag in enumerate(FLAGS)
+            },
+            "memory": memory,
+            "error": self.errors[index],
+        }
+
+
+class LockstepEngine:
+    def __init__(self, source: str, count: int, max_steps: int):
+        template = Machine()
+        template.load(source)
+        self.labels_map: Dict[str, int] = template.interpreter.labels_map
+        self.commands = template.interpreter.command_logs
+        self.program = [
+            (command.name, command.operands)
+            for command in template.interpreter.command_logs
+        ]
+        self.count = count
+        self.max_steps = max_steps
+        self.regs = np.zeros((count, len(REGISTERS)), dtype=np.int64)
+        self.flags = np.zeros((count, len(FLAGS)), dtype=bool)
+        self.pages: Dict[int, np.ndarray] = {}
+        self.touched: Dict[int, np.ndarray] = {}
+        self.pc = np.zeros(count, dtype=np.int64)
+        self.steps = np.zeros(count, dtype=np.int64)
+        self.active = np.full(count, bool(self.program))
+        # Instances finished by a scalar Machine
+        self.scalar = np.zeros(count, dtype=bool)
+        self.errors: List[str] = [""] * count
+        everyone = np.arange(count)
+        for address, value in INITIAL_MEMORY.items():
+            self.write(everyone, np.full(count, address), np.full(count, value))
+
+    # Memory
+    def page(self, page: int):
+        if page not in self.pages:
+            self.pages[page] = np.zeros((self.count, 256), dtype=np.uint8)
+            self.touched[page] = np.zeros((self.count, 256), dtype=bool)
+        return self.pages[page], self.touched[page]
+
+    def read(self, idx: np.ndarray, addr: np.ndarray) -> np.ndarray:
+        """
+        memory.get(addr, 0) per instance, doesn't mark anything as written
+        """
+        values = np.zeros(len(idx), dtype=np.int64)
+        pages = addr >> 8
+        for page in np.unique(pages):
+            if page in self.pages:
+                sel = pages == page
+                values[sel] = self.pages[page][idx[sel], addr[sel] & 0xFF]
+        return values
+
+    def write(self, idx: np.ndarray, addr: np.ndarray, values=None) -> None:
+        """
+        Write values per instance, without values only mark the addresses as written
+        (the reference writes back the value already there, or 0 when untouched)
+        """
+        pages = addr >> 8
+        for page in np.unique(pages):
+            data, touched = self.page(int(page))
+            sel = pages == page
+            if values is not None:
+                data[idx[sel], addr[sel] & 0xFF] = values[sel]
+            touched[idx[sel], addr[sel] & 0xFF] = True
+
+    # Registers
+    def pair(self, idx: np.ndarray, name: str) -> np.ndarray:
+        high, low = (REG_INDEX[reg] for reg in REGISTER_PAIRS[name])
+        return self.regs[idx, high] << 8 | self.regs[idx, low]
+
+    def set_pair(self, idx: np.ndarray, name: str, values: np.ndarray) -> None:
+        high, low = (REG_INDEX[reg] for reg in REGISTER_PAIRS[name])
+        self.regs[idx, high] = values >> 8
+        self.regs[idx, low] = values & 0xFF
+        # State.set_register_pair_value refreshes M, writing memory at the new HL
+        if name == "H":
+            self.write(idx, values)
+
+    def get(self, idx: np.ndarray, reg: str) -> np.ndarray:
+        if reg == "M":
+            return self.read(idx, self.pair(idx, "H"))
+        return self.regs[idx, REG_INDEX[reg]]
+
+    def set(self, idx: np.ndarray, reg: str, values: np.ndarray) -> None:
+        if reg == "M":
+            self.write(idx, self.pair(idx, "H"), values)
+        else:
+            self.regs[idx, REG_INDEX[reg]] = values
+
+    def set_sub_flags(self, idx: np.ndarray, result: np.ndarray) -> None:
+        negative = result < 0
+        self.flags[idx, CARRY] = negative
+        self.flags[idx, SIGN] = negative
+        self.flags[idx, ZERO] = result == 0
+
+    # Execution
+    def hand_over(self, idx: np.ndarray) -> None:
+        """
+        Finish these instances on a scalar Machine from their current command
+        """
+        for index in idx:
+            machine = Machine()
+            # Commands hold no state, so every machine can share the parsed program
+            machine.interpreter.command_logs = self.commands
+            machine.interpreter.labels_map = self.labels_map
+            state = machine.state
+            state.memory = MemoryDict()
+            for page in self.pages:
+                for offset in np.flatnonzero(self.touched[page][index]):
+                    address, value = (
+                        page << 8 | int(offset),
+                        self.pages[page][index, offset],
+                    )
+                    state.memory[f"0x{address:04x}"] = f"0x{value:02x}"
+            for reg in REGISTERS[:-1]:
+                state.registers[reg] = f"0x{int(self.regs[index, REG_INDEX[reg]]):02x}"
+            for col, flag in enumerate(FLAGS):
+                state.flags[flag] = bool(self.flags[index, col])
+            machine.interpreter.command_index_pointer = int(self.pc[index])
+            error = ""
+            try:
+                machine.run(max_steps=self.max_steps - int(self.steps[index]))
+            except Exception as e:
+                error = type(e).__name__
+            self.store(index, snapshot(state, error), machine.steps)
+
+    def store(self, index: int, final: dict, executed: int) -> None:
+        for reg, value in final["registers"].items():
+            self.regs[index, REG_INDEX[reg]] = value
+        for col, flag in enumerate(FLAGS):
+            self.flags[index, col] = final["flags"][flag]
+        for page in self.pages:
+            self.pages[page][index] = 0
+            self.touched[page][index] = False
+        for address, value in final["memory"].items():
+            data, touched = self.page(address >> 8)
+            data[index, address & 0xFF] = value
+            touched[index, address & 0xFF] = True
+        self.errors[index] = final["error"]
+        self.steps[index] += executed
+        self.active[index] = False
+        self.scalar[index] = True
+
+    def run(self) -> SweepResult:
+        while True:
+            live = np.flatnonzero(self.active)
+            if not live.size:
+                break
+            pointer = int(self.pc[live].min())
+            self.execute(pointer, live[self.pc[live] == pointer])
+        vector = np.flatnonzero(~self.scalar)
+        self.regs[vector, M] = self.read(vector, self.pair(vector, "H"))
+        return SweepResult(self)
+
+    def execute(self, pointer: int, idx: np.ndarray) -> None:
+        name, operands = self.program[pointer]
+        next_pc = np.full(len(idx), pointer + 1)
+        bad = self.evaluate(name, operands, idx, next_pc)
+        if bad is not None and bad.any():
+            # Leave the state of these untouched, a Machine redoes this command
+            self.hand_over(idx[bad])
+            idx, next_pc = idx[~bad], next_pc[~bad]
+        self.pc[idx] = next_pc
+        self.steps[idx] += 1
+        done = (next_pc >= len(self.program)) | (self.steps[idx] >= self.max_steps)
+        self.active[idx[done]] = False
+
+    def evaluate(
+        self, name: str, operands: tuple, idx: np.ndarray, next_pc: np.ndarray
+    ) -> Optional[np.ndarray]:
+        """
+        Vector version of the Command handler, Returns: Mask of instances to hand over
+        (checked before anything is written) or None.
+        """
+        count = len(idx)
+        acc = self.regs[idx, REG_INDEX["A"]]
+        if name == "MOV":
+            self.set(idx, operands[0], self.get(idx, operands[1]))
+        elif name == "MVI":
+            value = operands[1]
+            if value > 0xFF:
+                return np.ones(count, dtype=bool)
+            self.set(idx, operands[0], np.full(count, value))
+        elif name == "INR":
+            result = self.get(idx, operands[0]) + 1
+            bad = result > 0xFF
+            self.set(idx[~bad], operands[0], result[~bad])
+            return bad
+        elif name == "DCR":
+            result = self.get(idx, operands[0]) - 1
+            self.set_sub_flags(idx, result)
+            self.set(idx, operands[0], np.abs(result))
+        elif name == "LXI":
+            value = operands[1]
+            if value > 0xFFFF:
+                return np.ones(count, dtype=bool)
+            self.set_pair(idx, operands[0], np.full(count, value))
+        elif name in ("LDA", "STA"):
+            address = operands[0]
+            if address > 0xFFFF:
+                return np.ones(count, dtype=bool)
+            addr = np.full(count, address)
+            if name == "LDA":
+                self.write(idx, addr)
+                self.regs[idx, REG_INDEX["A"]] = self.read(idx, addr)
+            else:
+                self.write(idx, addr, acc)
+        elif name in ("ADD", "ADI"):
+            value = self.get(idx, operands[0]) if name == "ADD" else operands[0]
+            result = acc + value
+            self.flags[idx, CARRY] = result > 0xFF
+            self.flags[idx, SIGN] = False
+            self.flags[idx, ZERO] = result == 0
+            self.regs[idx, REG_INDEX["A"]] = result & 0xFF
+        elif name in ("SUB", "SUI", "CMP", "CPI"):
+            if name in ("SUB", "CMP"):
+                value = self.get(idx, operands[0])
+            else:
+                value = np.full(count, operands[0])
+            result = acc - value
+            bad = (
+                np.abs(result) > 0xFF
+                if name in ("SUB", "SUI")
+                else np.zeros(count, bool)
+            )
+            self.set_sub_flags(idx[~bad], result[~bad])
+            if name in ("SUB", "SUI"):
+                self.regs[idx[~bad], REG_INDEX["A"]] = np.abs(result[~bad])
+            return bad
+        elif name in ("ANI", "ORI"):
+            value = operands[0]
+            if name == "ORI" and value > 0xFF:
+                return np.ones(count, dtype=bool)
+            result = acc & value if name == "ANI" else acc | value
+            self.flags[idx, ZERO] = result == 0
+            self.regs[idx, REG_INDEX["A"]] = result
+        elif name == "RRC":
+            shifted_bit = acc & 1
+            result = acc >> 1 | shifted_bit << 7
+            self.flags[idx, CARRY] = shifted_bit == 1
+            self.flags[idx, ZERO] = result == 0
+            self.regs[idx, REG_INDEX["A"]] = result
+        elif name == "LDAX":
+            self.regs[idx, REG_INDEX["A"]] = self.read(idx, self.pair(idx, operands[0]))
+        elif name == "STAX":
+            self.write(idx, self.pair(idx, operands[0]), acc)
+        elif name == "INX":
+            result = self.pair(idx, operands[0]) + 1
+            bad = result > 0xFFFF
+            self.set_pair(idx[~bad], operands[0], result[~bad])
+            return bad
+        elif name == "DCX":
+            result = self.pair(idx, operands[0]) - 1
+            # The reference only logs an error when the pair would go negative
+            ok = result >= 0
+            self.set_pair(idx[ok], operands[0], result[ok])
+        elif name in ("JZ", "JNZ", "JC", "JNC"):
+            flag = self.flags[idx, ZERO if name in ("JZ", "JNZ") else CARRY]
+            taken = flag if name in ("JZ", "JC") else ~flag
+            if operands[0] not in self.labels_map:
+                return taken
+            next_pc[taken] = self.labels_map[operands[0]]
+        elif name == "HLT":
+            # HLT ends the run of these instances
+            next_pc[:] = len(self.program)
+        elif name == "OUT":
+            pass
+        else:
+            # Not vectorized yet, every instance finishes on a Machine
+            return np.ones(count, dtype=bool)
+        return None
+
+
+def sweep(
+    source: str,
+    inputs: Optional[Dict[InputKey, object]] = None,
+    count: Optional[int] = None,
+    max_steps: int = 100_000,
+) -> SweepResult:
+    """
+    Run source on one instance per input combination in lockstep.
+
+    inputs : Register names ("A".."L") or memory addresses (ints) to initial values,
+             arrays of equal length (one per instance) or scalars broadcast to all.
+             Use product() for every combination of several inputs.
+    count  : Number of instances, defaults to the length of the inputs
+    """
+    inputs = inputs or {}
+    arrays = {key: np.asarray(values, dtype=np.int64) for key, values in inputs.items()}
+    for key, array in arrays.items():
+        if array.size and (array.min() < 0 or array.max() > 0xFF):
+            raise ValueError(f"Input values for '{key}' must be bytes (0 to 255)")
+    if count is None:
+        count = max([array.size for array in arrays.values() if array.ndim], default=1)
+    engine = LockstepEngine(source, count, max_steps)
+    everyone = np.arange(count)
+    for key, array in arrays.items():
+        values = np.broadcast_to(array, (count,))
+        if isinstance(key, str):
+            engine.regs[:, REG_INDEX[key]] = values
+        else:
+            engine.write(everyone, np.full(count, key), values)
+    return engine.run()
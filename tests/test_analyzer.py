@@ -0,0 +1,54 @@
+"""
+The analysis server keeps serving after a message it can't handle
+"""
+import io
+import json
+
+from analyzer import AnalysisServer
+
+URI = "file:///program.asm"
+
+
+def frame(message: dict) -> bytes:
+    body = json.dumps(dict(message, jsonrpc="2.0")).encode()
+    return b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+
+def replies(output: bytes) -> list:
+    messages = []
+    for chunk in output.split(b"Content-Length: ")[1:]:
+        messages.append(json.loads(chunk.partition(b"\r\n\r\n")[2]))
+    return messages
+
+
+def test_failing_handler_keeps_the_server_running():
+    bad_range = {
+        "start": {"line": 9, "character": 0},
+        "end": {"line": 9, "character": 0},
+    }
+    messages = [
+        {
+            "method": "textDocument/didOpen",
+            "params": {"textDocument": {"uri": URI, "text": "L: JNZ L"}},
+        },
+        # Out of the document: a notification, only logged
+        {
+            "method": "textDocument/didChange",
+            "params": {
+                "textDocument": {"uri": URI},
+                "contentChanges": [{"range": bad_range, "text": "x"}],
+            },
+        },
+        # A request missing its parameters gets an internal error
+        {"id": 1, "method": "textDocument/definition", "params": {}},
+        {"id": 2, "method": "shutdown"},
+        {"method": "exit"},
+    ]
+    output = io.BytesIO()
+    server = AnalysisServer(io.BytesIO(b"".join(map(frame, messages))), output)
+    assert server.serve() == 0
+    answers = {
+        reply["id"]: reply for reply in replies(output.getvalue()) if "id" in reply
+    }
+    assert answers[1]["error"]["code"] == -32603
+    assert answers[2]["result"] is None
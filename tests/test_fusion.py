@@ -0,0 +1,141 @@
+"""
+Fused loops (fusion.py) leave the machine exactly as stepping them does
+"""
+import random
+
+import pytest
+
+from interpreter import Interpreter
+from machine import Machine
+
+COUNTDOWN = "MVI C 40H\nL: DCR C\nJNZ L\nHLT"
+FILL = "MVI A 5AH\nMVI C 20H\nLXI H 2050H\nL: MOV M A\nINX H\nDCR C\nJNZ L\nHLT"
+COPY = """LXI H 2000H
+MVI M 01H
+INX H
+MVI M 02H
+LXI B 2000H
+LXI D 2010H
+MVI L 10H
+L: LDAX B
+STAX D
+INX B
+INX D
+DCR L
+JNZ L
+HLT"""
+
+
+def run(source, fusion, **limits):
+    machine = Machine()
+    machine.interpreter.fusion = fusion
+    machine.load(source)
+    try:
+        status = machine.run(**limits)
+    except AssertionError:
+        # INX past FFFF
+        status = "assert"
+    memory = machine.state.memory
+    return {
+        "status": status,
+        "report": machine.report,
+        "steps": machine.steps,
+        "cycles": machine.cycles,
+        "registers": dict(machine.state.registers.data),
+        "flags": dict(machine.state.flags),
+        "memory": bytes(memory.buffer),
+        "written": list(memory.written),
+        "pointer": machine.interpreter.command_index_pointer,
+    }
+
+
+@pytest.fixture
+def fused(monkeypatch):
+    """
+    Instructions run in bulk by Interpreter.fuse
+    """
+    counts = []
+    fuse = Interpreter.fuse
+
+    def counting(self, *args, **kwargs):
+        count = fuse(self, *args, **kwargs)
+        counts.append(count)
+        return count
+
+    monkeypatch.setattr(Interpreter, "fuse", counting)
+    return counts
+
+
+@pytest.mark.parametrize(
+    "source", [COUNTDOWN, FILL, COPY], ids=["countdown", "fill", "copy"]
+)
+def test_fused_loop_matches_stepping(source, fused):
+    assert run(source, True) == run(source, False)
+    assert sum(fused) > 0
+
+
+@pytest.mark.parametrize("limits", [{"max_steps": 37}, {"max_loop_iterations": 5}])
+def test_fused_loop_stops_where_stepping_does(limits):
+    assert run(FILL, True, **limits) == run(FILL, False, **limits)
+
+
+def test_fill_across_ffff_matches_stepping():
+    source = FILL.replace("LXI H 2050H", "LXI H FFF0H")
+    assert run(source, True) == run(source, False)
+
+
+def byte():
+    return random.choice([0, 1, 2, 0xFF, random.randrange(256)])
+
+
+def random_loop() -> str:
+    lines = [f"MVI {register} {byte():02X}H" for register in "ABCDE"]
+    lines.append(
+        f"LXI H {random.choice([0x2000, 0xFFF8, random.randrange(0x10000)]):04X}H"
+    )
+    lines.append(
+        f"LXI B {random.choice([0x2000, 0x1FFE, random.randrange(0x10000)]):04X}H"
+    )
+    lines.append(
+        f"LXI D {random.choice([0x2002, 0x2100, random.randrange(0x10000)]):04X}H"
+    )
+    counter = random.choice("ABCDE")
+    kind = random.choice(["countdown", "fill", "copy"])
+    if kind == "countdown":
+        lines += [f"L: DCR {counter}", "JNZ L"]
+    elif kind == "fill":
+        store = random.choice(
+            [f"MOV M {random.choice('ABCDE')}", f"MVI M {byte():02X}H"]
+        )
+        lines += [f"L: {store}", "INX H", f"DCR {counter}", "JNZ L"]
+    else:
+        source, destination = random.sample("BDH", 2)
+        load = "MOV A M" if source == "H" else f"LDAX {source}"
+        store = "MOV M A" if destination == "H" else f"STAX {destination}"
+        lines += [f"L: {load}", store, f"INX {source}", f"INX {destination}"]
+        lines += [f"DCR {counter}", "JNZ L"]
+    return "\n".join(lines + ["MOV B A", "HLT"])
+
+
+def test_random_loops_match_stepping():
+    random.seed(8085)
+    for _ in range(200):
+        source = random_loop()
+        # A counter in a pair the loop increments can run for 64K iterations
+        limits = {"max_steps": random.choice([5000, random.randrange(1, 2000)])}
+        assert run(source, True, **limits) == run(source, False, **limits), source
+
+
+def test_restored_program_is_rescanned(tmp_path):
+    image = str(tmp_path / "session.img")
+    saved = Machine()
+    saved.load("MVI C 19H\nL: INR B\nDCR C\nJNZ L")
+    saved.save_image(image)
+    machine = Machine()
+    # A countdown of the same length, scanned before the image replaces it
+    machine.load("MVI C 19H\nL: DCR C\nJNZ L\nMOV A B")
+    machine.run()
+    machine.restore_image(image)
+    machine.interpreter.command_index_pointer = 0
+    assert machine.run(max_steps=40) == "instruction_limit"
+    assert machine.register("B") == 13
@@ -0,0 +1,30 @@
+"""
+The memory guard limits what a run adds, not the process' lifetime peak
+"""
+import sys
+
+import pytest
+
+from guards import MEMORY_LIMIT, ExecutionLimitExceeded, Watchdog
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="Current RSS from /proc"
+)
+
+
+def test_memory_limit_trips_on_growth():
+    watchdog = Watchdog(max_memory_mb=32, check_interval=1)
+    ballast = b"x" * (64 * 1024 * 1024)
+    with pytest.raises(ExecutionLimitExceeded) as stopped:
+        watchdog.tick()
+    assert stopped.value.status == MEMORY_LIMIT
+    del ballast
+
+
+def test_later_runs_start_from_their_own_memory():
+    ballast = b"x" * (64 * 1024 * 1024)
+    del ballast
+    # The process is far above 1MB, only the run's own growth counts
+    watchdog = Watchdog(max_memory_mb=1, check_interval=1)
+    for _ in range(10):
+        watchdog.tick()
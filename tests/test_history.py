@@ -0,0 +1,93 @@
+"""
+History compaction (-H) keeps jump semantics, see history.py
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+from loguru import logger
+
+import main
+from history import History
+from interpreter import Interpreter
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def repl(interpreter: Interpreter, lines) -> None:
+    for line in lines:
+        main.process_command(line, interpreter, "")
+
+
+def backward_jump_program(filler: int = 300):
+    return ["MVI C 03H", "START: INR B", "DCR C"] + ["MOV D E"] * filler + ["JNZ START"]
+
+
+def test_old_label_survives_compaction():
+    """
+    A label nothing jumps to yet, older than the compaction, is still jumped back to
+    """
+    lines = backward_jump_program() + ["inspect"]
+    result = subprocess.run(
+        [sys.executable, "main.py", "-i", "-H", "100000"],
+        input="\n".join(lines) + "\n",
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+    )
+    assert "B: 0x03" in result.stdout
+    assert "C: 0x00" in result.stdout
+
+
+def test_compaction_matches_unbounded_history():
+    states = []
+    for history in (None, History(100000)):
+        interpreter = Interpreter()
+        interpreter.state.verbose = False
+        interpreter.history = history
+        repl(interpreter, backward_jump_program())
+        states.append(dict(interpreter.state.registers.data))
+    assert states[0] == states[1]
+    assert states[0]["B"] == "0x03"
+
+
+def test_compaction_drops_unreachable_commands():
+    interpreter = Interpreter()
+    interpreter.state.verbose = False
+    interpreter.history = History()
+    repl(interpreter, ["MVI A 01H"] * 300 + ["L: INR B", "RET"] + ["MVI A 02H"] * 300)
+    interpreter.history.compact(interpreter)
+    assert [str(command) for command in interpreter.command_logs] == [
+        "L: INR B",
+        "RET ",
+    ]
+    assert interpreter.labels_map == {"L": 0}
+
+
+def test_limit_forgets_oldest_labels_with_warning():
+    messages = []
+    handler = logger.add(messages.append, level="WARNING")
+    try:
+        interpreter = Interpreter()
+        interpreter.state.verbose = False
+        interpreter.history = History(50)
+        repl(interpreter, ["OLD: MVI A 01H"] + ["MOV D E"] * 100 + ["NEW: INR B"])
+    finally:
+        logger.remove(handler)
+    assert len(interpreter.command_logs) <= 50
+    assert "OLD" not in interpreter.labels_map
+    assert interpreter.labels_map["NEW"] == len(interpreter.command_logs) - 1
+    assert any("Forgot labels OLD" in message for message in messages)
+
+
+def test_resume_points_are_remapped():
+    interpreter = Interpreter()
+    interpreter.state.verbose = False
+    interpreter.history = History()
+    for line in ["MVI A 01H"] * 10 + ["RST7.5: INR B", "RET"] + ["MVI A 02H"] * 7:
+        interpreter.add_command(main.cmd_preprocessor(line))
+    interpreter.state.return_stack = [17, 19]
+    interpreter.history.compact(interpreter)
+    assert len(interpreter.command_logs) == 4
+    assert interpreter.labels_map == {"RST7.5": 0}
+    assert interpreter.state.return_stack == [2, 4]
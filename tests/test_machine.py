@@ -0,0 +1,56 @@
+"""
+Machine's log option only applies to its own calls
+"""
+import pytest
+from loguru import logger
+
+import machine
+from machine import Machine
+from custom_dictionaries import MemoryDict
+from multicore import MultiMachine
+
+
+@pytest.fixture
+def records():
+    messages = []
+    handler = logger.add(lambda message: messages.append(message.record["message"]))
+    yield messages
+    logger.remove(handler)
+
+
+def test_quiet_machine_keeps_another_machines_records(records):
+    loud = Machine(log=True)
+    quiet = Machine()
+    quiet.write_memory(0x10000, 1)
+    assert records == []
+    loud.write_memory(0x10000, 1)
+    assert any("Invalid address" in message for message in records)
+
+
+def test_quiet_machine_leaves_the_process_logging(records):
+    Machine().write_memory(0x10000, 1)
+    MultiMachine(cores=2).run(max_steps=10)
+    assert machine.logging_enabled
+    assert records == []
+    MemoryDict().read_byte(0x10000)
+    assert len(records) == 1
+
+
+def test_read_memory_sees_the_memory_map():
+    machine = Machine()
+    machine.map_device(0x8000, 0x100, lambda offset: 0x42, lambda offset, value: None)
+    machine.unmap(0x9000, 0x100)
+    machine.write_memory(0x2050, 0x07)
+    assert machine.read_memory(0x8000) == 0x42
+    assert machine.read_memory(0x9000) == 0xFF
+    assert machine.read_memory(0x2050) == 0x07
+    assert machine.read_memory(0x2051) == 0
+
+
+def test_reading_m_is_quiet(records):
+    machine = Machine()
+    machine.load("LXI H 2050H")
+    machine.run()
+    assert machine.register("M") == 0
+    assert machine.registers["M"] == 0
+    assert records == []
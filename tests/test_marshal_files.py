@@ -0,0 +1,53 @@
+"""
+Session images and the program cache: read back by the python that wrote them only,
+a restored image replaces what was derived from the old program
+"""
+import pytest
+
+import session
+import program_cache
+from data import VERSION
+from interpreter import Interpreter
+from machine import Machine
+
+
+def test_session_image_of_another_python_is_rejected(tmp_path, monkeypatch):
+    image = str(tmp_path / "session.img")
+    monkeypatch.setattr(session, "MARSHAL_TAG", "cpython-38")
+    session.save_session(Interpreter(), image)
+    monkeypatch.setattr(session, "MARSHAL_TAG", "cpython-311")
+    with pytest.raises(ValueError, match="saved by cpython-38"):
+        session.restore_session(Interpreter(), image)
+
+
+def test_program_cache_is_kept_per_python(tmp_path, monkeypatch):
+    source = tmp_path / "program.asm"
+    source.write_text("MVI A 05H\n")
+    lines = ("MVI A 05H",)
+    for tag in ("cpython-38", "cpython-311"):
+        monkeypatch.setattr(program_cache, "MARSHAL_TAG", tag)
+        program_cache.load_program(str(source), lines)
+    names = sorted(path.name for path in (tmp_path / "__8085cache__").iterdir())
+    assert names == [
+        f"program.asm.v{VERSION}.cpython-311.prg",
+        f"program.asm.v{VERSION}.cpython-38.prg",
+    ]
+    digest = program_cache.source_hash(lines)
+    path = program_cache.cache_path(str(source))
+    assert program_cache.read_entries(path, digest, 1) is not None
+    monkeypatch.setattr(program_cache, "MARSHAL_TAG", "cpython-38")
+    assert program_cache.read_entries(path, digest, 1) is None
+
+
+def test_restore_resets_what_came_from_the_old_program(tmp_path):
+    image = str(tmp_path / "session.img")
+    saved = Machine()
+    saved.load("MVI A 01H\nMVI B 02H")
+    saved.save_image(image)
+    machine = Machine()
+    machine.load("L: DCR C\nJNZ L")
+    machine.start_profile()
+    machine.run(max_steps=4)
+    machine.restore_image(image)
+    assert machine.interpreter.scanned_loops == (None, 0, {})
+    assert "0 instructions" in machine.profile_report()
@@ -0,0 +1,29 @@
+"""
+The bytearray backed memory and the load/dump repl commands
+"""
+import main
+from custom_dictionaries import MemoryDict
+from interpreter import Interpreter
+
+
+def repl(lines):
+    interpreter = Interpreter()
+    interpreter.state.verbose = False
+    for line in lines:
+        main.process_command(line, interpreter, "")
+    return interpreter.state
+
+
+def test_value_above_a_byte_keeps_its_low_byte():
+    state = repl(["LXI H 2050H", "MVI M FFH", "INR M"])
+    assert state.memory["0x2050"] == "0x00"
+
+
+def test_address_past_ffff_is_dropped():
+    state = repl(["MVI A 07H", "STA 1FFFFH", "LDA 1FFFFH"])
+    assert state.registers["A"] == "0x00"
+    assert 0x1FFFF not in state.memory.written
+
+
+def test_read_past_ffff_reads_zero():
+    assert MemoryDict().read_byte(0x10000) == 0
@@ -0,0 +1,28 @@
+"""
+MultiMachine.run's instruction budget, like Machine.run's
+"""
+from guards import COMPLETED, INSTRUCTION_LIMIT
+from machine import Machine
+from multicore import MultiMachine
+
+
+def test_no_budget_runs_nothing():
+    program = "MVI A 01H\nMVI B 02H"
+    machine = Machine()
+    machine.load(program)
+    multi = MultiMachine(cores=1)
+    multi.load(0, program)
+    assert machine.run(max_steps=0) == INSTRUCTION_LIMIT
+    assert multi.run(max_steps=0) == INSTRUCTION_LIMIT
+    assert "cores 0 running" in multi.report
+    assert multi.steps == 0
+
+
+def test_budget_is_per_run():
+    multi = MultiMachine(cores=2)
+    multi.load(0, "MVI A 01H\nMVI B 02H\nMVI C 03H")
+    multi.load(1, "MVI A 04H")
+    assert multi.run(max_steps=2) == INSTRUCTION_LIMIT
+    # The steps of the first run don't count against the second
+    assert multi.run(max_steps=2) == COMPLETED
+    assert multi.steps == 4
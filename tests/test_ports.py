@@ -0,0 +1,30 @@
+"""
+OUT in the repl: batched to the console without a device, only the device's output with one
+"""
+import main
+from interpreter import Interpreter
+
+
+def repl(lines, capsys):
+    interpreter = Interpreter()
+    for line in lines:
+        main.process_command(line, interpreter, "")
+    return capsys.readouterr().out
+
+
+def test_out_without_device_is_shown_once_per_value(capsys):
+    out = repl(["MVI A 41H", "OUT 01H"], capsys)
+    assert out.count("01H: 41H") == 1
+
+
+def test_out_to_console_device_is_not_repeated(capsys):
+    out = repl(["MVI A 41H", "port 01H console", "OUT 01H"], capsys)
+    assert out.count("01H: 41H") == 1
+
+
+def test_out_to_ring_is_not_echoed(capsys):
+    interpreter = Interpreter()
+    for line in ["MVI A 41H", "port 02H ring", "OUT 02H"]:
+        main.process_command(line, interpreter, "")
+    assert "41H" not in capsys.readouterr().out.split("A -> 41H")[-1]
+    assert interpreter.state.ports.output("02H") == b"\x41"
@@ -0,0 +1,28 @@
+"""
+Profiler reports of commands entered after profiling started
+"""
+import main
+from machine import Machine
+from profiler import BLOCK_SIZE
+from interpreter import Interpreter
+
+
+def test_commands_loaded_after_start_profile():
+    machine = Machine()
+    machine.load("MVI A 01H")
+    machine.start_profile()
+    machine.load("MVI B 02H\nMVI C 03H")
+    machine.run(max_steps=1)
+    report = machine.profile_report()
+    assert "1 instructions" in report
+    assert "MVI C 0x03" in report
+
+
+def test_repl_profile_past_a_block(capsys):
+    interpreter = Interpreter()
+    interpreter.state.verbose = False
+    for _ in range(BLOCK_SIZE + 10):
+        main.process_command("MVI A 01H", interpreter, "")
+    main.process_command("profile on", interpreter, "")
+    main.process_command("profile", interpreter, "")
+    assert "0 instructions" in capsys.readouterr().out
@@ -0,0 +1,23 @@
+"""
+'path:options' command line specs (--log, --profile) with Windows paths
+"""
+from diagnostics import parse_log_spec, split_spec
+
+
+def test_options_after_the_last_colon():
+    assert split_spec("/tmp/run:trace") == ("/tmp/run", "trace")
+    assert split_spec("C:\\logs\\d.json:every=5,jumps") == (
+        "C:\\logs\\d.json",
+        "every=5,jumps",
+    )
+
+
+def test_drive_without_options_is_all_path():
+    assert split_spec("C:\\out") == ("C:\\out", "")
+    assert split_spec("/tmp/a:b/d.json") == ("/tmp/a:b/d.json", "")
+
+
+def test_log_spec_with_a_drive():
+    log_spec = parse_log_spec("C:\\logs\\d.json:every=5")
+    assert log_spec.filename == "C:\\logs\\d.json"
+    assert log_spec.every == 5
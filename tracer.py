@@ -0,0 +1,187 @@
+"""
+Compact binary execution trace: one fixed size record per executed instruction.
+
+File layout: MAGIC, uint16 length of the opcode table, the table (comma separated
+command names, opcode ids index it), then RECORD records until the end.
+
+python tracer.py trace.bin --op STA --address 2050H --steps 0 1000
+"""
+import sys
+import struct
+import argparse
+from typing import BinaryIO, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+from data import COMMANDS, REGISTERS
+from state_model import State
+
+MAGIC = b"8085TRC1"
+# step, instruction index, opcode id, changed mask, memory write address, memory write value
+RECORD = struct.Struct("<QIBHHB")
+OPCODES = tuple(COMMANDS)
+OPCODE_IDS = {name: index for index, name in enumerate(OPCODES)}
+
+# Changed mask bits: registers A..L, then the flags, then a memory write
+TRACED_REGISTERS = REGISTERS[:-1]
+TRACED_FLAGS = ("carry", "auxillary_carry", "zero", "sign")
+FLAG_SHIFT = 8
+MEMORY_WRITTEN = 1 << 15
+
+# Bytes buffered before they go to the file
+CHUNK_SIZE = 1 << 20
+
+
+class TraceRecord(NamedTuple):
+    step: int
+    index: int
+    opcode: str
+    changed: int
+    address: int
+    value: int
+
+    @property
+    def memory_written(self) -> bool:
+        return bool(self.changed & MEMORY_WRITTEN)
+
+    @property
+    def registers(self) -> Tuple[str, ...]:
+        return tuple(
+            reg for bit, reg in enumerate(TRACED_REGISTERS) if self.changed & 1 << bit
+        )
+
+    @property
+    def flags(self) -> Tuple[str, ...]:
+        return tuple(
+            flag
+            for bit, flag in enumerate(TRACED_FLAGS, start=FLAG_SHIFT)
+            if self.changed & 1 << bit
+        )
+
+    def __str__(self) -> str:
+        changes = [*self.registers, *self.flags]
+        if self.memory_written:
+            changes.append(f"[{self.address:04X}H]={self.value:02X}H")
+        return f"{self.step:>8} {self.index:>6} {self.opcode:<5} {' '.join(changes)}"
+
+
+class TraceRecorder:
+    """
+    Hooked into Interpreter.evaluate_command: before() ahead of the command, record() after it
+    """
+
+    def __init__(self, filename: str, chunk_size: int = CHUNK_SIZE):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.file: BinaryIO = open(filename, "wb")
+        table = ",".join(OPCODES).encode()
+        self.file.write(MAGIC + struct.pack("<H", len(table)) + table)
+        self.buffer = bytearray()
+        self.steps = 0
+        self.registers: Tuple[str, ...] = ()
+        self.flags: Tuple[bool, ...] = ()
+
+    def before(self, state: State) -> None:
+        registers = state.registers.data
+        self.registers = tuple(registers[reg] for reg in TRACED_REGISTERS)
+        self.flags = tuple(state.flags[flag] for flag in TRACED_FLAGS)
+        state.memory.last_write = -1
+
+    def record(self, index: int, name: str, state: State) -> None:
+        registers = state.registers.data
+        changed = 0
+        for bit, (reg, value) in enumerate(zip(TRACED_REGISTERS, self.registers)):
+            if registers[reg] != value:
+                changed |= 1 << bit
+        for bit, (flag, value) in enumerate(zip(TRACED_FLAGS, self.flags), FLAG_SHIFT):
+            if state.flags[flag] != value:
+                changed |= 1 << bit
+        address = state.memory.last_write
+        value = 0
+        if address >= 0:
+            changed |= MEMORY_WRITTEN
+            value = state.memory.buffer[address]
+        else:
+            address = 0
+        self.buffer += RECORD.pack(
+            self.steps, index, OPCODE_IDS[name], changed, address, value
+        )
+        self.steps += 1
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.buffer.clear()
+        self.file.flush()
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+def read_trace(
+    filename: str,
+    opcodes: Optional[Iterable[str]] = None,
+    address: Optional[int] = None,
+    steps: Optional[range] = None,
+    chunk_records: int = 65536,
+) -> Iterator[TraceRecord]:
+    """
+    Lazily decode a trace file, keeping the records of the given opcodes,
+    writing memory at address and within the steps range. Raises ValueError on a non trace file.
+    """
+    with open(filename, "rb") as rf:
+        if rf.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not an 8085 trace file: '{filename}'")
+        (table_size,) = struct.unpack("<H", rf.read(2))
+        table = rf.read(table_size).decode().split(",")
+        wanted = None
+        if opcodes is not None:
+            wanted = {index for index, name in enumerate(table) if name in opcodes}
+        if steps is not None and steps.start > 0:
+            # Steps are consecutive from 0, skip straight to the first one
+            rf.seek(steps.start * RECORD.size, 1)
+        while True:
+            chunk = rf.read(chunk_records * RECORD.size)
+            if not chunk:
+                return
+            # A trace of a run that crashed may end with a partial record
+            chunk = chunk[: len(chunk) - len(chunk) % RECORD.size]
+            for step, index, opcode, changed, mem_address, value in RECORD.iter_unpack(
+                chunk
+            ):
+                if steps is not None and step not in steps:
+                    if step >= steps.stop:
+                        return
+                    continue
+                if wanted is not None and opcode not in wanted:
+                    continue
+                if address is not None and (
+                    not changed & MEMORY_WRITTEN or mem_address != address
+                ):
+                    continue
+                yield TraceRecord(
+                    step, index, table[opcode], changed, mem_address, value
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("filename")
+    parser.add_argument("--op", nargs="+", help="Only these instructions (STA MOV)")
+    parser.add_argument("--address", help="Only writes to this address (2050H)")
+    parser.add_argument(
+        "--steps", nargs=2, type=int, metavar=("START", "STOP"), help="Step range"
+    )
+    args = parser.parse_args()
+    address = None
+    if args.address:
+        address = int(args.address.upper().rstrip("H"), 16)
+    steps = range(*args.steps) if args.steps else None
+    try:
+        for record in read_trace(args.filename, args.op, address, steps):
+            print(record)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(1)